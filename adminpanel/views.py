@@ -17,7 +17,7 @@ from sitevisitor.models import CustomUser, Profile, ContactMessage, NewsletterSu
 from .models import Subscription, Payment, Invoice, SubscriptionPlan
 from .forms import GrantSubscriptionForm
 from userpanel.models import WASenderSession
-from whatsappapi.wasender_service import WASenderService
+from whatsappapi.wasender_service import get_wasender_service
 
 def is_admin_user(user):
     return user.is_authenticated and (user.is_staff or user.is_superuser)
@@ -977,7 +977,7 @@ def admin_disconnect_session(request, session_id):
     session = get_object_or_404(WASenderSession, id=session_id)
     
     if request.method == 'POST':
-        service = WASenderService()
+        service = get_wasender_service()
         success = service.disconnect_session(session)
         
         if success:
@@ -997,7 +997,7 @@ def admin_delete_session(request, session_id):
     session = get_object_or_404(WASenderSession, id=session_id)
     
     if request.method == 'POST':
-        service = WASenderService()
+        service = get_wasender_service()
         user_email = session.user.email
         session_id_text = session.session_id
         
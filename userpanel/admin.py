@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem, Address, WASenderSession, WASenderMessage, WASenderCampaign
+from .models import Order, OrderItem, Address, WASenderSession, WASenderMessage, WASenderCampaign, CampaignRecipient
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -126,7 +126,7 @@ class WASenderCampaignAdmin(admin.ModelAdmin):
             'fields': ('message_type', 'message_template', 'media_url')
         }),
         ('Recipients', {
-            'fields': ('recipients', 'total_recipients')
+            'fields': ('total_recipients',)
         }),
         ('Statistics', {
             'fields': ('messages_sent', 'messages_delivered', 'messages_failed')
@@ -138,3 +138,12 @@ class WASenderCampaignAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'updated_at')
         })
     )
+
+
+@admin.register(CampaignRecipient)
+class CampaignRecipientAdmin(admin.ModelAdmin):
+    list_display = ('phone', 'name', 'campaign', 'status', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('phone', 'name')
+    raw_id_fields = ('campaign',)
+    readonly_fields = ('updated_at',)
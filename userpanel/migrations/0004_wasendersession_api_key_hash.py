@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_api_key_hashes(apps, schema_editor):
+    """Hash every session API key that can be decrypted with the current ENCRYPTION_KEY"""
+    from cryptography.fernet import Fernet
+    from whatsappapi.session_index import hash_session_key
+
+    WASenderSession = apps.get_model('userpanel', 'WASenderSession')
+    encryption_key = getattr(settings, 'ENCRYPTION_KEY', None)
+    cipher = Fernet(encryption_key) if encryption_key else None
+
+    for session in WASenderSession.objects.filter(api_key_hash__isnull=True).only('id', 'api_token').iterator():
+        token = session.api_token or ''
+        try:
+            api_key = cipher.decrypt(token.encode()).decode() if cipher else token
+        except Exception:
+            # Same fallback as WASenderService._decrypt_token: plain-text legacy tokens
+            api_key = '' if token.startswith('gAAAAA') else token
+        if api_key:
+            WASenderSession.objects.filter(id=session.id).update(api_key_hash=hash_session_key(api_key))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpanel', '0003_add_optout_contact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wasendersession',
+            name='api_key_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_api_key_hashes, migrations.RunPython.noop),
+    ]
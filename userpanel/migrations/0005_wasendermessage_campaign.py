@@ -0,0 +1,40 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_message_campaigns(apps, schema_editor):
+    """Copy metadata['campaign_id'] into the new campaign column"""
+    from whatsappapi.campaign_links import link_campaign_messages
+
+    link_campaign_messages(
+        apps.get_model('userpanel', 'WASenderMessage'),
+        apps.get_model('userpanel', 'WASenderCampaign'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpanel', '0004_wasendersession_api_key_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wasendermessage',
+            name='campaign',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='userpanel.wasendercampaign'),
+        ),
+        migrations.AddIndex(
+            model_name='wasendermessage',
+            index=models.Index(fields=['campaign', 'status'], name='userpanel_w_campaig_f59388_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasendermessage',
+            index=models.Index(fields=['campaign', 'recipient'], name='userpanel_w_campaig_7156bb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasendermessage',
+            index=models.Index(fields=['campaign', 'created_at'], name='userpanel_w_campaig_0e4f0c_idx'),
+        ),
+        migrations.RunPython(backfill_message_campaigns, migrations.RunPython.noop, elidable=True),
+    ]
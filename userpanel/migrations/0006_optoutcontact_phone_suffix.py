@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def backfill_phone_suffixes(apps, schema_editor):
+    """Store the last-10-digit match key for existing opt-outs"""
+    from whatsappapi.optout_filter import optout_suffix
+
+    OptOutContact = apps.get_model('userpanel', 'OptOutContact')
+    for optout in OptOutContact.objects.only('id', 'phone_number').iterator():
+        OptOutContact.objects.filter(id=optout.id).update(phone_suffix=optout_suffix(optout.phone_number))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpanel', '0005_wasendermessage_campaign'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optoutcontact',
+            name='phone_suffix',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='optoutcontact',
+            index=models.Index(fields=['user', 'phone_suffix', 'is_active'], name='userpanel_o_user_id_57b485_idx'),
+        ),
+        migrations.RunPython(backfill_phone_suffixes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_recipients_out_of_json(apps, schema_editor):
+    """Copy WASenderCampaign.recipients into CampaignRecipient rows"""
+    from whatsappapi.campaign_recipients import backfill_campaign_recipients
+
+    backfill_campaign_recipients(
+        apps.get_model('userpanel', 'WASenderCampaign'),
+        apps.get_model('userpanel', 'CampaignRecipient'),
+    )
+
+
+def restore_recipients_json(apps, schema_editor):
+    from whatsappapi.campaign_recipients import restore_recipients_json
+
+    restore_recipients_json(
+        apps.get_model('userpanel', 'WASenderCampaign'),
+        apps.get_model('userpanel', 'CampaignRecipient'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userpanel', '0006_optoutcontact_phone_suffix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CampaignRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone', models.CharField(max_length=24)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='pending', max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipient_rows', to='userpanel.wasendercampaign')),
+            ],
+            options={
+                'verbose_name': 'Campaign Recipient',
+                'verbose_name_plural': 'Campaign Recipients',
+                'indexes': [models.Index(fields=['campaign', 'status'], name='userpanel_c_campaig_0f5eb3_idx')],
+                'unique_together': {('campaign', 'phone')},
+            },
+        ),
+        migrations.RunPython(move_recipients_out_of_json, restore_recipients_json),
+    ]
@@ -149,6 +149,7 @@ class WASenderSession(models.Model):
     session_id = models.CharField(max_length=100, unique=True, db_index=True)  # WASender session ID
     session_name = models.CharField(max_length=255)
     api_token = models.CharField(max_length=500)  # Encrypted session-specific token
+    api_key_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # HMAC of the API key, for webhook lookup
     phone_number = models.CharField(max_length=20, blank=True, null=True)  # Phone entered during session creation
     connected_phone_number = models.CharField(max_length=20, blank=True, null=True)  # Actual WhatsApp number after scan
     status = models.CharField(max_length=20, choices=SESSION_STATUS_CHOICES, default='pending', db_index=True)
@@ -193,40 +194,19 @@ class WASenderSession(models.Model):
             self.save(update_fields=['messages_sent_today', 'last_reset_date'])
     
     def can_send_message(self):
-        """Check if message can be sent based on rate limits"""
-        self.reset_daily_count()
-        
-        # Check daily limit
-        if self.account_protection_enabled:
-            daily_limit = 17280  # 720 msg/hr * 24 hrs with account protection
-        else:
-            daily_limit = 368640  # 15360 msg/hr * 24 hrs without protection
-        
-        if self.messages_sent_today >= daily_limit:
-            return False, "Daily message limit reached"
-        
-        # Check time between messages (account protection)
-        if self.account_protection_enabled and self.last_message_at:
-            elapsed = (timezone.now() - self.last_message_at).total_seconds()
-            # Use configurable delay from settings (defaults to 5 seconds)
-            from django.conf import settings as django_settings
-            delay_required = getattr(django_settings, 'WASENDER_SEND_DELAY_SECONDS', 5)
-            try:
-                delay_required = int(delay_required)
-            except Exception:
-                delay_required = 5
-            if elapsed < delay_required:
-                return False, f"Wait {int(delay_required - elapsed)} seconds before next message"
+        """
+        Check if message can be sent based on rate limits.
         
-        return True, None
+        Atomic across workers (whatsappapi.session_rate_limit); an allowed
+        check reserves the send slot for the account protection spacing.
+        """
+        from whatsappapi.session_rate_limit import acquire_send
+        return acquire_send(self)
     
     def increment_message_count(self):
-        """Increment message counters"""
-        self.messages_sent_today += 1
-        self.messages_sent_this_month += 1
-        self.last_message_at = timezone.now()
-        self.last_activity_at = timezone.now()
-        self.save(update_fields=['messages_sent_today', 'messages_sent_this_month', 'last_message_at', 'last_activity_at'])
+        """Count a sent message; counts are written back to this row periodically"""
+        from whatsappapi.session_rate_limit import record_sent
+        record_sent(self)
 
 
 class WASenderMessage(models.Model):
@@ -275,6 +255,10 @@ class WASenderMessage(models.Model):
     delivered_at = models.DateTimeField(null=True, blank=True)
     read_at = models.DateTimeField(null=True, blank=True)
     
+    # Campaign this message was sent for (metadata['campaign_id'] is kept in sync for older readers).
+    # Not separately indexed: the composite indexes below all lead with campaign.
+    campaign = models.ForeignKey('WASenderCampaign', on_delete=models.SET_NULL, null=True, blank=True, related_name='messages', db_index=False)
+    
     # Metadata
     metadata = models.JSONField(default=dict, blank=True)  # Additional data
     
@@ -284,6 +268,9 @@ class WASenderMessage(models.Model):
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['message_id']),
+            models.Index(fields=['campaign', 'status']),
+            models.Index(fields=['campaign', 'recipient']),
+            models.Index(fields=['campaign', 'created_at']),
         ]
         ordering = ['-created_at']
         verbose_name = 'WASender Message'
@@ -337,7 +324,7 @@ class WASenderCampaign(models.Model):
     # Contact list reference
     contact_list = models.ForeignKey('whatsappapi.ContactList', on_delete=models.SET_NULL, null=True, blank=True, related_name='campaigns')
     
-    # Recipients (stored as JSON array)
+    # Legacy recipients JSON array; recipients now live in CampaignRecipient (recipient_rows)
     recipients = models.JSONField(default=list)  # [{"phone": "1234567890", "name": "John"}]
     
     # Metadata for additional campaign data (kept for backward compatibility)
@@ -391,22 +378,60 @@ class WASenderCampaign(models.Model):
         return f"{self.name} - {self.status}"
     
     def update_stats(self):
-        """Update campaign statistics from messages using metadata-based query"""
-        # Use metadata-based query (accurate for campaigns with tagged messages)
-        messages = WASenderMessage.objects.filter(metadata__campaign_id=self.id)
+        """
+        Recount campaign statistics from its messages (one grouped query).
+        
+        Counters are normally kept current by whatsappapi.campaign_counters;
+        this is the full recount used for repairs and legacy campaigns.
+        """
+        from whatsappapi.campaign_counters import count_statuses
+        
+        # Use the indexed campaign link (accurate for campaigns with tagged messages)
+        messages = WASenderMessage.objects.filter(campaign_id=self.id)
         
-        # Fallback to time-based if no metadata-tagged messages exist AND session exists
+        # Fallback to time-based if no linked messages exist AND session exists
         if not messages.exists() and self.session:
             messages = WASenderMessage.objects.filter(
                 session=self.session,
                 created_at__gte=self.created_at
             )
         
-        self.messages_sent = messages.filter(status__in=['sent', 'delivered', 'read']).count()
-        self.messages_delivered = messages.filter(status__in=['delivered', 'read']).count()
-        self.messages_read = messages.filter(status='read').count()
-        self.messages_failed = messages.filter(status='failed').count()
-        self.save(update_fields=['messages_sent', 'messages_delivered', 'messages_read', 'messages_failed'])
+        counts = count_statuses(messages)
+        for field, value in counts.items():
+            setattr(self, field, value)
+        self.save(update_fields=list(counts))
+
+
+class CampaignRecipient(models.Model):
+    """
+    One recipient of a campaign and its send state.
+    Replaces the WASenderCampaign.recipients JSON array so recipients can be
+    filtered, paged and streamed without loading the whole list.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),  # Claimed by a run, outcome not recorded yet
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),  # Opted out before the send
+    )
+
+    campaign = models.ForeignKey(WASenderCampaign, on_delete=models.CASCADE, related_name='recipient_rows')
+    phone = models.CharField(max_length=24)  # E.164, same as Contact.phone_e164 and WASenderMessage.recipient
+    name = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['campaign', 'phone']
+        indexes = [
+            models.Index(fields=['campaign', 'status']),
+        ]
+        verbose_name = 'Campaign Recipient'
+        verbose_name_plural = 'Campaign Recipients'
+
+    def __str__(self):
+        return f"{self.phone} ({self.status}) - campaign #{self.campaign_id}"
 
 
 class WASenderIncomingMessage(models.Model):
@@ -476,6 +501,8 @@ class OptOutContact(models.Model):
         db_index=True
     )
     phone_number = models.CharField(max_length=50, db_index=True)  # Normalized phone number
+    # Last 10 digits of phone_number, the match key for opt-out checks (set in save)
+    phone_suffix = models.CharField(max_length=10, blank=True, default='')
     
     # Opt-out details
     keyword_used = models.CharField(max_length=50)  # The keyword they used (STOP, unsubscribe, etc.)
@@ -500,6 +527,7 @@ class OptOutContact(models.Model):
             models.Index(fields=['user', 'phone_number']),
             models.Index(fields=['phone_number', 'is_active']),
             models.Index(fields=['user', 'is_active', 'opted_out_at']),
+            models.Index(fields=['user', 'phone_suffix', 'is_active']),
         ]
         # Ensure unique opt-out per user per phone number
         unique_together = ['user', 'phone_number']
@@ -511,27 +539,29 @@ class OptOutContact(models.Model):
         status = "Active" if self.is_active else "Reactivated"
         return f"{self.phone_number} - {status} (keyword: {self.keyword_used})"
     
+    def save(self, *args, **kwargs):
+        from whatsappapi.optout_filter import optout_suffix
+        self.phone_suffix = optout_suffix(self.phone_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'phone_suffix'}
+        super().save(*args, **kwargs)
+    
     @classmethod
     def is_opted_out(cls, user, phone_number):
         """
         Check if a phone number has opted out for a specific user.
-        Normalizes phone number for comparison.
+        Matches on the last 10 digits to handle country code variations
+        (one indexed lookup; use whatsappapi.optout_filter.OptOutMatcher for batches).
         """
-        import re
-        # Normalize: remove all non-digits
-        normalized = re.sub(r'\D', '', phone_number)
-        # Check last 10 digits to handle country code variations
-        if len(normalized) >= 10:
-            last_10 = normalized[-10:]
-            return cls.objects.filter(
-                user=user,
-                is_active=True,
-                phone_number__endswith=last_10
-            ).exists()
+        from whatsappapi.optout_filter import optout_suffix
+        suffix = optout_suffix(phone_number)
+        if not suffix:
+            return False
         return cls.objects.filter(
             user=user,
-            is_active=True,
-            phone_number=normalized
+            phone_suffix=suffix,
+            is_active=True
         ).exists()
     
     @classmethod
@@ -541,6 +571,7 @@ class OptOutContact(models.Model):
         Returns (optout_obj, created) tuple.
         """
         import re
+        from whatsappapi.optout_filter import forget_optouts
         # Normalize phone number
         normalized = re.sub(r'\D', '', phone_number)
         
@@ -554,4 +585,19 @@ class OptOutContact(models.Model):
                 'is_active': True
             }
         )
+        forget_optouts(optout.user_id)
         return optout, created
+    
+    @classmethod
+    def remove_optout(cls, user, optout_id):
+        """
+        Delete an opt-out so the number can be messaged again.
+        Returns the removed phone number.
+        Raises OptOutContact.DoesNotExist if the user has no such opt-out.
+        """
+        from whatsappapi.optout_filter import forget_optouts
+        optout = cls.objects.get(id=optout_id, user=user)
+        phone = optout.phone_number
+        optout.delete()
+        forget_optouts(optout.user_id)
+        return phone
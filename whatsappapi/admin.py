@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ContactList, Contact
+from .models import ContactList, Contact, WebhookEvent, MediaAsset
 
 
 @admin.register(ContactList)
@@ -16,3 +16,19 @@ class ContactAdmin(admin.ModelAdmin):
     list_filter = ['is_on_whatsapp', 'created_at', 'contact_list']
     search_fields = ['phone_number', 'first_name', 'last_name', 'email', 'custom_field_1', 'custom_field_2', 'custom_field_3']
     date_hierarchy = 'created_at'
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_type', 'user_id', 'status', 'attempts', 'processed', 'received_at', 'processed_at']
+    list_filter = ['status', 'event_type']
+    search_fields = ['event_type', 'error']
+    date_hierarchy = 'received_at'
+
+
+@admin.register(MediaAsset)
+class MediaAssetAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'user', 'attachment_type', 'size', 'wasender_expires_at', 'last_used_at']
+    list_filter = ['attachment_type']
+    search_fields = ['sha256', 'cloudinary_public_id', 'user__email']
+    date_hierarchy = 'created_at'
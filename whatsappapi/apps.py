@@ -13,6 +13,13 @@ class WhatsappapiConfig(AppConfig):
         Called when Django starts.
         Auto-resume stuck campaigns after server restart/downtime.
         """
+        # Registers the post_save receiver that counts new campaign messages
+        from whatsappapi import campaign_counters  # noqa: F401
+        # Registers the receivers that drop cached session credentials
+        from whatsappapi import session_credentials  # noqa: F401
+        # Registers the receivers that keep session API key hashes current
+        from whatsappapi import session_index  # noqa: F401
+        
         import os
         
         # Only run in the main process (not in migrations, shell, etc.)
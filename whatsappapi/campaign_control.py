@@ -0,0 +1,115 @@
+"""
+Campaign Control Channel
+Out-of-band pause/stop signal for running campaigns.
+
+Send loops used to re-read the campaign row to notice a pause. The command is
+now published to the Django cache (Redis), and loops poll it with a single GET:
+
+    claim_campaign           publishes 'run' when a campaign starts or resumes
+    stop_campaign (view)     writes status='paused' and publishes 'pause'
+    engine / cooldowns       read_control() every CONTROL_POLL_SECONDS
+
+The database row stays the source of truth. 'run' is only ever cached for
+WASENDER_CONTROL_SEED_SECONDS; once it expires (or the cache is flushed) the
+status is read from the database again, so a pause made without publishing
+(Django admin, a direct status write) is still seen within that window.
+An explicit 'pause' is kept until the campaign is claimed again.
+
+Settings (all optional):
+    WASENDER_CONTROL_POLL_SECONDS   how often send loops poll the channel (default 0.5)
+    WASENDER_CONTROL_SEED_SECONDS   lifetime of 'run' and of a command re-read from the database (default 30)
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CONTROL_RUN = 'run'
+CONTROL_PAUSE = 'pause'
+
+# An explicitly published pause outlives any campaign run
+_PAUSE_SECONDS = 7 * 24 * 3600
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def control_poll_seconds():
+    return _setting('WASENDER_CONTROL_POLL_SECONDS', 0.5)
+
+
+def _cache_key(campaign_id):
+    return f"wasender:campaign_control:{campaign_id}"
+
+
+def _command_seconds(command):
+    # 'run' expires quickly so the database status is re-checked while sending
+    if command == CONTROL_PAUSE:
+        return _PAUSE_SECONDS
+    return _setting('WASENDER_CONTROL_SEED_SECONDS', 30)
+
+
+def publish_control(campaign_id, command):
+    """Publish a control command for a campaign (best effort; the DB status is authoritative)"""
+    try:
+        cache.set(_cache_key(campaign_id), command, _command_seconds(command))
+    except Exception as e:
+        logger.warning(f"⚠️ Could not publish '{command}' for campaign {campaign_id}: {e}")
+
+
+def _command_for_status(status):
+    return CONTROL_PAUSE if status == 'paused' else CONTROL_RUN
+
+
+def read_control(campaign_id):
+    """
+    Current control command for a campaign: one cache GET, DB status on a miss.
+
+    Returns:
+        str: CONTROL_RUN or CONTROL_PAUSE
+    """
+    try:
+        command = cache.get(_cache_key(campaign_id))
+    except Exception:
+        command = None
+    if command is not None:
+        return command
+
+    from userpanel.models import WASenderCampaign
+
+    status = WASenderCampaign.objects.filter(id=campaign_id).values_list('status', flat=True).first()
+    command = _command_for_status(status)
+    try:
+        cache.set(_cache_key(campaign_id), command, _setting('WASENDER_CONTROL_SEED_SECONDS', 30))
+    except Exception:
+        pass
+    return command
+
+
+def is_pause_requested(campaign_id):
+    return read_control(campaign_id) == CONTROL_PAUSE
+
+
+def pause_campaign(campaign):
+    """
+    Pause (stop) a running or pending campaign and signal its send loop.
+
+    Returns:
+        bool: True if the campaign was running or pending
+    """
+    from userpanel.models import WASenderCampaign
+
+    updated = WASenderCampaign.objects.filter(
+        id=campaign.id, status__in=['running', 'pending']
+    ).update(status='paused')
+    if updated:
+        campaign.status = 'paused'
+        publish_control(campaign.id, CONTROL_PAUSE)
+    return bool(updated)
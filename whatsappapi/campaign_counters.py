@@ -0,0 +1,238 @@
+"""
+Campaign Counters
+Keeps WASenderCampaign's message counters current with atomic deltas.
+
+The stored counters (messages_sent, messages_delivered, messages_read,
+messages_failed) used to be recounted from the message table on every read and
+on every status webhook. Now each message contributes to them exactly once:
+
+    insert      a campaign message is created -> +1 on the counters its status is in
+    transition  a status change is written with a compare-and-set
+                UPDATE ... WHERE status = <old>, and only the writer that wins
+                applies the F() delta between the two statuses
+
+so campaign pages read four integers no matter how large the campaign is.
+While a send run is active its deltas are buffered by the run's
+CampaignProgressWriter (campaign_progress) and written in coalesced flushes.
+
+Counters can still drift (messages deleted, rows edited by hand, full-model
+saves of a stale campaign object), so reconcile_campaign_counters recounts
+recently active campaigns with one grouped aggregate and repairs any that
+differ. Run it periodically (manage.py reconcile_campaign_counters). The
+periodic pass skips 'running' campaigns: their worker may still hold buffered
+deltas, and it reconciles the campaign itself after each flush. A repair is
+one UPDATE whose counts are subqueries, so nothing lands between read and write.
+
+Settings (all optional):
+    WASENDER_COUNTER_RECONCILE_HOURS   finished campaigns touched within this window are reconciled (default 24)
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Counter column -> message statuses it counts ('played' is a read voice/video note)
+COUNTER_STATUSES = {
+    'messages_sent': ('sent', 'delivered', 'read', 'played'),
+    'messages_delivered': ('delivered', 'read', 'played'),
+    'messages_read': ('read', 'played'),
+    'messages_failed': ('failed',),
+}
+COUNTER_FIELDS = tuple(COUNTER_STATUSES)
+
+ACTIVE_STATUSES = ('pending', 'running', 'paused')
+
+_RECONCILE_CHUNK = 500
+
+# campaign_id -> CampaignProgressWriter of the run currently sending it in this process
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def status_deltas(old_status, new_status):
+    """Counter deltas for a message moving from old_status to new_status (None = not counted yet)"""
+    deltas = {}
+    for field, statuses in COUNTER_STATUSES.items():
+        delta = (new_status in statuses) - (old_status in statuses)
+        if delta:
+            deltas[field] = delta
+    return deltas
+
+
+def buffer_counters(campaign_id, writer):
+    """Send this campaign's deltas to writer.add() instead of the database until released"""
+    with _buffers_lock:
+        _buffers[campaign_id] = writer
+
+
+def release_counters(campaign_id, writer):
+    with _buffers_lock:
+        if _buffers.get(campaign_id) is writer:
+            del _buffers[campaign_id]
+
+
+def apply_status_change(campaign_id, old_status, new_status):
+    """Apply the counter deltas of one message transition as a single atomic UPDATE (or buffer them)"""
+    from userpanel.models import WASenderCampaign
+
+    deltas = status_deltas(old_status, new_status)
+    if not campaign_id or not deltas:
+        return False
+    writer = _buffers.get(campaign_id)
+    if writer is not None and writer.add(deltas):
+        return True
+    WASenderCampaign.objects.filter(id=campaign_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+    return True
+
+
+def transition_message_status(message, status, **fields):
+    """
+    Move a message to status (plus any extra columns) and count it exactly once.
+
+    The write only succeeds if the row still has the status this object was
+    loaded with, so concurrent webhooks for one message cannot both apply
+    their delta.
+
+    Returns:
+        bool: True if this call performed the transition
+    """
+    from userpanel.models import WASenderMessage
+
+    old_status = message.status
+    updated = WASenderMessage.objects.filter(pk=message.pk, status=old_status).update(status=status, **fields)
+    if not updated:
+        return False
+
+    message.status = status
+    for name, value in fields.items():
+        setattr(message, name, value)
+    if message.campaign_id:
+        apply_status_change(message.campaign_id, old_status, status)
+    return True
+
+
+@receiver(post_save, sender='userpanel.WASenderMessage')
+def count_new_campaign_message(sender, instance, created, raw=False, **kwargs):
+    """Count a campaign message once, when its row is inserted"""
+    if created and not raw and instance.campaign_id:
+        try:
+            apply_status_change(instance.campaign_id, None, instance.status)
+        except Exception as e:
+            logger.error(f"❌ Failed to count message {instance.pk} for campaign #{instance.campaign_id}: {e}")
+
+
+# ==================== Recounting ====================
+
+def _empty_counts():
+    return {field: 0 for field in COUNTER_FIELDS}
+
+
+def _add_status(counts, status, n):
+    for field, statuses in COUNTER_STATUSES.items():
+        if status in statuses:
+            counts[field] += n
+
+
+def count_statuses(messages_qs):
+    """Counter values for an arbitrary message queryset in one GROUP BY status query"""
+    counts = _empty_counts()
+    for row in messages_qs.order_by().values('status').annotate(n=Count('id')):
+        _add_status(counts, row['status'], row['n'])
+    return counts
+
+
+def grouped_counts(campaign_ids):
+    """
+    Counter values for many campaigns in one GROUP BY (campaign, status) query.
+
+    Returns:
+        dict: campaign_id -> {counter field: value}; campaigns without messages map to zeros
+    """
+    from userpanel.models import WASenderMessage
+
+    counts = {campaign_id: _empty_counts() for campaign_id in campaign_ids}
+    rows = (
+        WASenderMessage.objects.filter(campaign_id__in=counts)
+        .order_by()
+        .values('campaign_id', 'status')
+        .annotate(n=Count('id'))
+    )
+    for row in rows:
+        _add_status(counts[row['campaign_id']], row['status'], row['n'])
+    return counts
+
+
+def _count_subquery(statuses):
+    """Number of the outer campaign's messages in statuses, as an UPDATE-able expression"""
+    from userpanel.models import WASenderMessage
+
+    counted = (
+        WASenderMessage.objects.filter(campaign_id=OuterRef('pk'), status__in=statuses)
+        .order_by()
+        .values('campaign_id')
+        .annotate(n=Count('id'))
+        .values('n')[:1]
+    )
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def _reconcile_hours():
+    try:
+        return int(getattr(settings, 'WASENDER_COUNTER_RECONCILE_HOURS', 24))
+    except (TypeError, ValueError):
+        return 24
+
+
+def reconcile_campaign_counters(campaign_ids=None):
+    """
+    Recount campaigns from their messages and repair counters that drifted.
+
+    Args:
+        campaign_ids: Campaigns to check; defaults to pending/paused campaigns plus
+                      any updated within WASENDER_COUNTER_RECONCILE_HOURS, never
+                      'running' ones (their worker reconciles them after flushing)
+
+    Returns:
+        int: number of campaigns whose counters were corrected
+    """
+    from userpanel.models import WASenderCampaign
+
+    if campaign_ids is None:
+        since = timezone.now() - timedelta(hours=_reconcile_hours())
+        campaign_ids = WASenderCampaign.objects.filter(
+            Q(status__in=ACTIVE_STATUSES) | Q(updated_at__gte=since)
+        ).exclude(status='running').values_list('id', flat=True)
+    campaign_ids = list(campaign_ids)
+
+    corrected = 0
+    for start in range(0, len(campaign_ids), _RECONCILE_CHUNK):
+        chunk = campaign_ids[start:start + _RECONCILE_CHUNK]
+        actual = grouped_counts(chunk)
+        stored = WASenderCampaign.objects.filter(id__in=chunk).values('id', *COUNTER_FIELDS)
+        for row in stored:
+            counts = actual[row['id']]
+            if any(row[field] != counts[field] for field in COUNTER_FIELDS):
+                # Linked messages are the source of truth, except for legacy campaigns with none
+                if not any(counts.values()):
+                    continue
+                # Recounted inside the UPDATE itself, so deltas applied since the read are kept
+                WASenderCampaign.objects.filter(id=row['id']).update(
+                    **{field: _count_subquery(statuses) for field, statuses in COUNTER_STATUSES.items()}
+                )
+                logger.info(
+                    f"🔧 Reconciled campaign #{row['id']} counters: "
+                    + ", ".join(f"{field} {row[field]}→{counts[field]}" for field in COUNTER_FIELDS if row[field] != counts[field])
+                )
+                corrected += 1
+    return corrected
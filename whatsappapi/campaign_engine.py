@@ -0,0 +1,468 @@
+"""
+Pipelined Campaign Send Engine
+Overlaps per-contact preparation and persistence with the paced network send.
+
+The old loop in send_campaign_async did everything serially for each contact:
+duplicate check, personalization, presence call + typing pause, HTTP send,
+several DB writes and only then the pacing delay. The engine splits this into
+three stages connected by bounded queues:
+
+    prepare  (thread)  dedupe, recipient claim, personalization
+    send     (caller)  pacing wait, typing indicator, HTTP send
+    persist  (thread)  failure records, coalesced progress writes
+
+Pacing is unchanged: the next send starts no earlier than `delay` seconds after
+the previous send completed (random_delay_min/max with advanced controls, or
+MESSAGE_DELAY_WITH/WITHOUT_PROTECTION by session account protection), and the
+typing indicator is issued inside that wait instead of after it. Everything
+else now happens while the engine is waiting anyway, so a campaign's wall
+clock is roughly the enforced pacing alone.
+"""
+
+import logging
+import queue
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from userpanel.models import WASenderMessage
+from whatsappapi.message_template import compile_template
+from whatsappapi.phone_format import contact_e164
+from whatsappapi.campaign_control import control_poll_seconds, is_pause_requested
+from whatsappapi.campaign_progress import CampaignProgressWriter
+from whatsappapi.campaign_recipients import claim_recipient
+from whatsappapi.media_resolver import forget_rejected_media, resolve_campaign_media
+
+logger = logging.getLogger(__name__)
+
+# Bounded look-ahead so preparation never runs far ahead of a paused campaign
+PREPARE_AHEAD = 16
+TYPING_PAUSE_SECONDS = 0.5
+
+_DONE = object()
+
+
+class PreparedSend:
+    """A contact that passed dedupe checks, with its personalized message"""
+
+    __slots__ = ('contact', 'phone', 'message')
+
+    def __init__(self, contact, phone, message):
+        self.contact = contact
+        self.phone = phone
+        self.message = message
+
+
+class SendResult:
+    """Outcome of one contact's send, handed to the persist stage"""
+
+    __slots__ = ('job', 'text_msg', 'msg', 'error')
+
+    def __init__(self, job, text_msg=None, msg=None, error=None):
+        self.job = job
+        self.text_msg = text_msg
+        self.msg = msg
+        self.error = error
+
+
+class CampaignSendEngine:
+    """
+    Sends one list of contacts for a campaign with pipelined prepare/persist stages.
+
+    Usage:
+        engine = CampaignSendEngine(campaign, service, session, processed_phones)
+        outcome = engine.run(contacts)   # 'completed' | 'paused' | 'disconnected'
+        engine.sent_count, engine.failed_count
+    """
+
+    def __init__(self, campaign, service, session, processed_phones,
+                 pause_check_interval=None, status_check_interval=None):
+        self.campaign = campaign
+        self.service = service
+        self.session = session
+        self.processed_phones = processed_phones
+        # Compiled once per campaign; each contact is a single join
+        self.template = compile_template(campaign.message_template)
+        self.attachment_url = campaign.attachment_url
+        self.attachment_type = campaign.attachment_type
+        # Sendable attachment URL, preflighted/uploaded once per campaign (media_resolver)
+        self._media = None
+        # Pause checks are a cache GET on the control channel, so they can be frequent
+        self.pause_check_interval = pause_check_interval or control_poll_seconds()
+        self.status_check_interval = status_check_interval
+        self.sent_count = 0
+        self.failed_count = 0
+        self.error = None
+        # Counter deltas and the heartbeat are written every N results / T seconds
+        self.progress = CampaignProgressWriter(campaign)
+
+        self._stop = threading.Event()
+        self._prepared = queue.Queue(maxsize=PREPARE_AHEAD)
+        self._results = queue.Queue()
+        self._counts_lock = threading.Lock()
+        self._next_send_at = None
+        self._last_pause_check = 0.0
+
+    # ==================== Pacing ====================
+
+    def next_delay(self):
+        """Per-message delay exactly as configured for the campaign/session"""
+        campaign = self.campaign
+        if campaign.use_advanced_controls:
+            delay = random.randint(campaign.random_delay_min, campaign.random_delay_max)
+            logger.info(f"⏱️ ADVANCED DELAY: {delay}s (Range: {campaign.random_delay_min}-{campaign.random_delay_max}s)")
+        else:
+            delay = settings.MESSAGE_DELAY_WITH_PROTECTION if self.session.account_protection_enabled else settings.MESSAGE_DELAY_WITHOUT_PROTECTION
+            logger.info(f"⏱️ STANDARD DELAY: {delay}s (Protection: {self.session.account_protection_enabled})")
+        return delay
+
+    def pause_check_due(self):
+        """True once pause_check_interval has elapsed since the last control read"""
+        return time.monotonic() - self._last_pause_check >= self.pause_check_interval
+
+    def is_paused(self, force=False):
+        """Poll the control channel, at most once per pause_check_interval unless forced"""
+        if not force and not self.pause_check_due():
+            return False
+        self._last_pause_check = time.monotonic()
+        try:
+            paused = is_pause_requested(self.campaign.id)
+        except Exception:
+            return False
+        if paused:
+            self.campaign.status = 'paused'
+        return paused
+
+    def _wait_until(self, deadline):
+        """Sleep until deadline in short slices, returning False if paused meanwhile"""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            if self.is_paused():
+                return False
+            time.sleep(min(self.pause_check_interval, remaining))
+
+    def _wait_for_slot(self, job, typing):
+        """Wait for this contact's send slot; send the typing indicator inside the wait"""
+        deadline = self._next_send_at or time.monotonic()
+        if typing:
+            if not self._wait_until(deadline - TYPING_PAUSE_SECONDS):
+                return False
+            try:
+                self.service.send_presence_update(self.session, job.phone, 'composing')
+            except Exception:
+                pass  # Non-critical, continue with message
+            deadline = max(deadline, time.monotonic() + TYPING_PAUSE_SECONDS)
+        if not self._wait_until(deadline):
+            return False
+        # Always honour a pause requested right before the send
+        return not self.is_paused(force=True)
+
+    # ==================== Stages ====================
+
+    def prepare_one(self, contact):
+        """
+        Dedupe, claim and personalize one contact.
+
+        processed_phones is preloaded with every number the campaign already
+        has a message for, so duplicates are skipped without a query; the
+        recipient claim (one conditional UPDATE) settles races with another
+        run of the same campaign.
+
+        Returns:
+            PreparedSend ready to send, SendResult carrying an error, or None to skip
+        """
+        phone_norm = contact_e164(contact)
+
+        # Skip if we've already processed this phone in this campaign run
+        if phone_norm in self.processed_phones:
+            logger.warning(f"Skipping duplicate phone {phone_norm} in current campaign run")
+            return None
+        self.processed_phones.add(phone_norm)
+
+        try:
+            # Campaign-specific duplicate prevention, decided by the database
+            if not claim_recipient(self.campaign.id, phone_norm):
+                logger.warning(f"DUPLICATE PREVENTED: {phone_norm} already claimed in campaign {self.campaign.id}")
+                return None
+
+            return PreparedSend(contact, phone_norm, self.template.render(contact))
+        except Exception as e:
+            logger.error(f"Error preparing {contact.phone_number}: {e}")
+            return SendResult(PreparedSend(contact, phone_norm, ''), error=e)
+
+    def _prepare(self, contacts):
+        """Stage 1: dedupe, claim and personalize ahead of the sender"""
+        try:
+            max_iterations = len(contacts) * 2  # Safety limit: at most 2x the unique contacts
+            iteration_count = 0
+            for contact in contacts:
+                if self._stop.is_set():
+                    break
+
+                iteration_count += 1
+                if iteration_count > max_iterations:
+                    logger.error(f"Safety limit exceeded: {iteration_count} iterations for {len(contacts)} contacts")
+                    break
+
+                job = self.prepare_one(contact)
+                if job is None:
+                    continue
+                if isinstance(job, SendResult):
+                    self._results.put(job)
+                    continue
+
+                while not self._stop.is_set():
+                    try:
+                        self._prepared.put(job, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            logger.error(f"Campaign {self.campaign.id} prepare stage failed: {e}", exc_info=True)
+        finally:
+            close_old_connections()
+            while True:
+                try:
+                    self._prepared.put(_DONE, timeout=0.5)
+                    break
+                except queue.Full:
+                    if self._stop.is_set():
+                        break
+
+    def wants_typing(self):
+        """True when the send starts with a text message that gets a typing indicator"""
+        if not getattr(settings, 'WASENDER_SEND_TYPING', True):
+            return False
+        return not (self.attachment_url and self.attachment_type) or self.attachment_type == 'audio'
+
+    def media(self):
+        """The campaign's resolved attachment, re-resolved only once it expires (None if unresolvable)"""
+        if self._media is None or self._media.expired:
+            try:
+                self._media = resolve_campaign_media(self.campaign, self.service, self.session)
+            except Exception as e:
+                logger.error(f"Campaign {self.campaign.id} media resolution failed: {e}")
+                self._media = None
+        return self._media
+
+    def _check_media(self, msg):
+        """Drop the resolved attachment when WASender rejected a send because of it"""
+        if forget_rejected_media(self.campaign, msg):
+            self._media = None
+
+    def dispatch(self, job):
+        """Stage 2: the network send for one prepared contact, with no pacing waits"""
+        service = self.service
+        session = self.session
+        attachment_url = self.attachment_url
+        attachment_type = self.attachment_type
+
+        if attachment_url and attachment_type:
+            if attachment_type == 'audio':
+                # 1) Send text message to guarantee content delivery
+                text_msg = service.send_text_message(session, job.phone, job.message, send_typing=False, campaign=self.campaign)
+                # 2) Then send audio media (caption often not shown for audio)
+                msg = service.send_media_message(
+                    session=session,
+                    recipient=job.phone,
+                    media_url=attachment_url,
+                    message_type='audio',
+                    caption=None,
+                    campaign=self.campaign,
+                    resolved=self.media()
+                )
+                self._check_media(msg)
+                return SendResult(job, text_msg=text_msg, msg=msg)
+
+            # The resolved handle prefers the Wasender-hosted URL for documents
+            msg = service.send_media_message(
+                session=session,
+                recipient=job.phone,
+                media_url=attachment_url,
+                message_type=attachment_type,
+                caption=job.message,
+                campaign=self.campaign,
+                resolved=self.media()
+            )
+            self._check_media(msg)
+            return SendResult(job, msg=msg)
+
+        msg = service.send_text_message(session, job.phone, job.message, send_typing=False, campaign=self.campaign)
+        return SendResult(job, msg=msg)
+
+    def _send(self, job):
+        """Wait for the contact's pacing slot on the caller's thread, then dispatch"""
+        if not self._wait_for_slot(job, self.wants_typing()):
+            return None
+        return self.dispatch(job)
+
+    def check_session(self):
+        """Session connectivity probe; returns False (and sets self.error) on disconnect"""
+        is_still_connected, current_status, check_error = self.service.check_session_status_safe(self.session)
+        if not is_still_connected:
+            logger.error(f"🚨 Session disconnected during campaign! Status: {current_status}, Error: {check_error}")
+            self.error = f'Session disconnected: {current_status}'
+            return False
+        logger.info(f"✅ Periodic status check OK (every {self.status_check_interval} msgs): Session still connected")
+        return True
+
+    def _persist(self):
+        """Stage 3: record failures and write progress behind the sender"""
+        try:
+            while True:
+                result = self._results.get()
+                if result is _DONE:
+                    break
+                try:
+                    self.persist_one(result)
+                except Exception as e:
+                    logger.error(f"Error persisting result for {result.job.phone}: {e}", exc_info=True)
+        finally:
+            close_old_connections()
+
+    def persist_one(self, result):
+        """Stage 3: record failures and write progress for one result"""
+        job = result.job
+        campaign = self.campaign
+        session = self.session
+        attachment_url = self.attachment_url
+        attachment_type = self.attachment_type
+        sent = failed = 0
+
+        if result.error is not None:
+            logger.error(f"Error sending to {job.contact.phone_number}: {result.error}")
+            failed += 1
+        else:
+            if attachment_url and attachment_type == 'audio':
+                text_msg = result.text_msg
+                if text_msg:
+                    if text_msg.status == 'sent':
+                        sent += 1
+                    else:
+                        failed += 1
+                else:
+                    failed += 1
+                    # Record failed text message
+                    try:
+                        WASenderMessage.objects.create(
+                            session=session,
+                            user=session.user,
+                            recipient=job.phone,
+                            message_type='text',
+                            content=job.message,
+                            status='failed',
+                            error_message='Text send failed before audio',
+                            campaign=campaign,
+                            metadata={'campaign_id': campaign.id}
+                        )
+                    except Exception as e:
+                        logger.error(f"Failed to record failed text message for {job.phone}: {e}")
+
+            msg = result.msg
+            if msg:
+                if msg.status == 'sent':
+                    sent += 1
+                    logger.info(f"✅ Message sent successfully to {job.phone}")
+                else:
+                    failed += 1
+                    error_msg = getattr(msg, 'error_message', 'Unknown error')
+                    logger.error(f"❌ Message failed to {job.phone}: status={msg.status}, error={error_msg}")
+            else:
+                failed += 1
+                logger.error(f"❌ No message object returned for {job.phone} - send method returned None")
+                # Record failed message for visibility in campaign details and exports
+                try:
+                    WASenderMessage.objects.create(
+                        session=session,
+                        user=session.user,
+                        recipient=job.phone,
+                        message_type=attachment_type or 'text',
+                        content=attachment_url or job.message,
+                        caption=job.message if attachment_url and attachment_type else None,
+                        status='failed',
+                        error_message='Send method returned None - possible API error or rate limit',
+                        campaign=campaign,
+                        metadata={'campaign_id': campaign.id}
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to record failed message for {job.phone}: {e}")
+
+        with self._counts_lock:
+            self.sent_count += sent
+            self.failed_count += failed
+
+        # Counter deltas from the message inserts above are buffered by the progress
+        # writer; each flush also bumps updated_at, the stuck-campaign liveness signal.
+        if result.error is not None:
+            # The send raised before any message row was written: give the recipient
+            # back so a resumed run sends to it again (as a per-contact check used to)
+            state = 'pending'
+        else:
+            state = 'failed' if failed else 'sent'
+        self.progress.record(job.phone, state)
+
+    # ==================== Driver ====================
+
+    def run(self, contacts):
+        """
+        Send to contacts in order with paced, pipelined stages.
+
+        Returns:
+            str: 'completed', 'paused', 'disconnected' (self.error has details)
+        """
+        outcome = 'completed'
+        self.progress.start()
+        preparer = threading.Thread(target=self._prepare, args=(contacts,), name=f"campaign_{self.campaign.id}_prepare", daemon=True)
+        persister = threading.Thread(target=self._persist, name=f"campaign_{self.campaign.id}_persist", daemon=True)
+        preparer.start()
+        persister.start()
+
+        messages_since_status_check = 0
+        try:
+            while True:
+                job = self._prepared.get()
+                if job is _DONE:
+                    break
+
+                # Periodic session status check to detect disconnects early
+                if self.status_check_interval:
+                    messages_since_status_check += 1
+                    if messages_since_status_check >= self.status_check_interval:
+                        messages_since_status_check = 0
+                        if not self.check_session():
+                            outcome = 'disconnected'
+                            break
+
+                try:
+                    result = self._send(job)
+                except Exception as e:
+                    result = SendResult(job, error=e)
+
+                if result is None:
+                    logger.info(f"Campaign {self.campaign.id} paused by user. Halting sends.")
+                    outcome = 'paused'
+                    break
+
+                # The pacing delay runs from the completion of this send
+                self._next_send_at = time.monotonic() + self.next_delay()
+                self._results.put(result)
+        finally:
+            self._stop.set()
+            # Unblock the preparer if it is waiting on a full queue
+            try:
+                while True:
+                    self._prepared.get_nowait()
+            except queue.Empty:
+                pass
+            preparer.join()
+            self._results.put(_DONE)
+            persister.join()
+            # Always flush when the run stops: pause, completion, disconnect or error
+            self.progress.close()
+
+        return outcome
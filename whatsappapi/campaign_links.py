@@ -0,0 +1,63 @@
+"""
+Campaign Message Links
+Backfills WASenderMessage.campaign from the legacy metadata['campaign_id'] tag.
+
+Messages used to record their campaign only inside the metadata JSON, which no
+index covers. New messages get the indexed campaign foreign key at insert time;
+older rows are linked here by walking the table in primary-key windows, so
+each query touches at most batch_size rows however large the table is.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def link_campaign_messages(message_model, campaign_model, batch_size=5000, start_id=0):
+    """
+    Set campaign on unlinked messages whose metadata names an existing campaign.
+
+    Takes the model classes as arguments so migrations can pass historical models.
+
+    Args:
+        message_model: WASenderMessage (or its historical model)
+        campaign_model: WASenderCampaign (or its historical model)
+        batch_size: Primary-key window scanned per query
+        start_id: Resume the scan after this message id
+
+    Returns:
+        int: number of messages linked
+    """
+    bounds = message_model.objects.filter(id__gt=start_id).order_by('-id').values_list('id', flat=True).first()
+    if not bounds:
+        return 0
+
+    linked = 0
+    window_start = start_id
+    while window_start < bounds:
+        window_end = window_start + batch_size
+        rows = message_model.objects.filter(
+            id__gt=window_start,
+            id__lte=window_end,
+            campaign__isnull=True,
+        ).values_list('id', 'metadata')
+
+        by_campaign = {}
+        for message_id, metadata in rows:
+            try:
+                campaign_id = int((metadata or {}).get('campaign_id'))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            by_campaign.setdefault(campaign_id, []).append(message_id)
+
+        if by_campaign:
+            # Campaigns can be deleted while their messages remain; leave those unlinked
+            existing = set(campaign_model.objects.filter(id__in=by_campaign).values_list('id', flat=True))
+            for campaign_id, message_ids in by_campaign.items():
+                if campaign_id in existing:
+                    linked += message_model.objects.filter(id__in=message_ids).update(campaign_id=campaign_id)
+
+        window_start = window_end
+        logger.debug(f"Campaign link backfill reached message id {window_start} ({linked} linked)")
+
+    return linked
@@ -0,0 +1,196 @@
+"""
+Campaign Progress Writer
+Coalesces a running campaign's progress writes and pushes them to the dashboard.
+
+Every persisted message used to write the campaign row: a counter UPDATE per
+message insert (campaign_counters) plus the updated_at heartbeat. While an
+engine run is active, CampaignProgressWriter takes over both for its campaign:
+
+    campaign_counters   hands the run's counter deltas to the writer instead of
+                        issuing an UPDATE per message
+    persist stage       calls record() once per result, with the recipient's
+                        new send state
+    flush               one UPDATE of only the changed columns (F() deltas plus
+                        updated_at), one UPDATE per recipient state, then the
+                        resulting snapshot is sent to the owner's websocket
+                        group as a 'campaign_update' event
+
+A flush happens every WASENDER_PROGRESS_FLUSH_MESSAGES results or
+WASENDER_PROGRESS_FLUSH_SECONDS seconds, whichever comes first, and always when
+the run ends (pause, completion, disconnect or error). Deltas buffered by a
+worker that dies mid-run are repaired by reconcile_campaign_counters.
+
+Settings (all optional):
+    WASENDER_PROGRESS_FLUSH_MESSAGES   results buffered before a flush (default 25)
+    WASENDER_PROGRESS_FLUSH_SECONDS    longest time between flushes while sending (default 5)
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from whatsappapi import campaign_counters
+from whatsappapi.campaign_recipients import mark_recipients
+
+logger = logging.getLogger(__name__)
+
+_SNAPSHOT_FIELDS = ('name', 'status', 'total_recipients') + campaign_counters.COUNTER_FIELDS
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def campaign_snapshot(campaign_id):
+    """Current progress of a campaign as stored, or None if it no longer exists"""
+    from userpanel.models import WASenderCampaign
+
+    return WASenderCampaign.objects.filter(id=campaign_id).values(*_SNAPSHOT_FIELDS).first()
+
+
+def publish_progress(campaign_id, user_id, snapshot=None, message=''):
+    """Send a campaign progress snapshot to the owner's websocket group (best effort)"""
+    try:
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+
+        channel_layer = get_channel_layer()
+        if not channel_layer:
+            return
+        snapshot = snapshot or campaign_snapshot(campaign_id)
+        if not snapshot:
+            return
+
+        sent = snapshot['messages_sent']
+        failed = snapshot['messages_failed']
+        total = snapshot['total_recipients']
+        async_to_sync(channel_layer.group_send)(
+            f"updates_{user_id}",
+            {
+                'type': 'campaign_update',
+                'campaign_id': campaign_id,
+                'campaign_name': snapshot['name'],
+                'status': snapshot['status'],
+                'sent_count': sent,
+                'failed_count': failed,
+                'total_contacts': total,
+                'progress_percent': min(100, round((sent + failed) * 100 / total)) if total else 0,
+                'message': message,
+                'timestamp': str(timezone.now()),
+            }
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Could not publish progress for campaign {campaign_id}: {e}")
+
+
+class CampaignProgressWriter:
+    """
+    Buffers one campaign's progress and writes it in coalesced flushes.
+
+    Usage:
+        progress = CampaignProgressWriter(campaign)
+        progress.start()
+        progress.record(phone, 'sent')   # once per persisted result
+        progress.close()             # always, when the run stops
+
+    Safe to use from the send, persist and webhook threads of one process.
+    """
+
+    def __init__(self, campaign, flush_every=None, flush_seconds=None):
+        self.campaign_id = campaign.id
+        self.user_id = campaign.user_id
+        self.flush_every = flush_every or _setting('WASENDER_PROGRESS_FLUSH_MESSAGES', 25)
+        self.flush_seconds = flush_seconds or _setting('WASENDER_PROGRESS_FLUSH_SECONDS', 5.0)
+        self.flushes = 0
+
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._states = {}
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._closed = False
+
+    def start(self):
+        """Route this campaign's counter deltas into the buffer"""
+        self._last_flush = time.monotonic()
+        campaign_counters.buffer_counters(self.campaign_id, self)
+
+    def add(self, deltas):
+        """
+        Buffer counter deltas (called by campaign_counters.apply_status_change).
+
+        Returns:
+            bool: False once the writer is closed; the caller must write the deltas itself
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            for field, delta in deltas.items():
+                self._deltas[field] = self._deltas.get(field, 0) + delta
+            return True
+
+    def record(self, phone=None, state=None):
+        """Count one persisted result and flush if N results or T seconds have accumulated"""
+        with self._lock:
+            if phone and state:
+                self._states[phone] = state
+            self._pending += 1
+            due = (
+                self._pending >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self, message=''):
+        """Write the buffered progress in one UPDATE and publish the resulting snapshot"""
+        from userpanel.models import WASenderCampaign
+
+        with self._lock:
+            deltas = {field: delta for field, delta in self._deltas.items() if delta}
+            states = self._states
+            self._deltas = {}
+            self._states = {}
+            self._pending = 0
+            self._last_flush = time.monotonic()
+
+        try:
+            WASenderCampaign.objects.filter(id=self.campaign_id).update(
+                updated_at=timezone.now(),
+                **{field: F(field) + delta for field, delta in deltas.items()}
+            )
+        except Exception:
+            # Keep the deltas for the next flush rather than losing them
+            with self._lock:
+                for field, delta in deltas.items():
+                    self._deltas[field] = self._deltas.get(field, 0) + delta
+            raise
+
+        by_state = {}
+        for phone, state in states.items():
+            by_state.setdefault(state, []).append(phone)
+        for state, phones in by_state.items():
+            try:
+                mark_recipients(self.campaign_id, phones, state)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not record {len(phones)} '{state}' recipients for campaign #{self.campaign_id}: {e}")
+
+        self.flushes += 1
+        publish_progress(self.campaign_id, self.user_id, message=message)
+
+    def close(self, message=''):
+        """Stop buffering and write whatever is left"""
+        campaign_counters.release_counters(self.campaign_id, self)
+        with self._lock:
+            self._closed = True
+        try:
+            self.flush(message=message)
+        except Exception as e:
+            logger.error(f"❌ Final progress flush failed for campaign #{self.campaign_id}: {e}")
@@ -0,0 +1,200 @@
+"""
+Campaign Recipients
+Per-campaign recipient rows (userpanel.CampaignRecipient) and their send state.
+
+Recipients used to be stored as one JSON array on WASenderCampaign, so every
+page that filtered messages by recipient loaded and deserialized the whole
+list. They are now one indexed row per (campaign, phone):
+
+    prepare_campaign_run    snapshot_recipients() inserts the run's contacts
+                            (rows from an earlier run keep their state) and
+                            marks opted-out numbers 'skipped'
+    send engine             claim_recipient() moves a row pending -> sending
+                            with one conditional UPDATE right before the send;
+                            the unique (campaign, phone) row means only one of
+                            two concurrent runs can win it
+    progress writer         marks recipients 'sent' / 'failed' in its
+                            coalesced flushes, and back to 'pending' when the
+                            send raised without recording a message
+    views / export          filter with recipient_phones(), a subquery the
+                            database evaluates, and page through the rows with
+                            recipients_page() / iter_recipients()
+"""
+
+import logging
+
+from django.utils import timezone
+
+from whatsappapi.phone_format import format_e164
+
+logger = logging.getLogger(__name__)
+
+_WRITE_BATCH = 1000
+
+
+def _recipient_row(recipient_model, campaign_id, phone, name):
+    return recipient_model(campaign_id=campaign_id, phone=phone[:24], name=(name or '')[:255])
+
+
+def snapshot_recipients(campaign, contacts):
+    """
+    Record the contacts a campaign run will send to.
+
+    Contacts must carry phone_e164. Duplicate numbers are stored once, and
+    numbers already recorded by an earlier run keep their send state.
+
+    Returns:
+        int: number of distinct recipients in this snapshot
+    """
+    from userpanel.models import CampaignRecipient
+
+    rows = []
+    seen = set()
+    for contact in contacts:
+        phone = contact.phone_e164
+        if not phone or phone in seen:
+            continue
+        seen.add(phone)
+        name = f"{contact.first_name or ''} {contact.last_name or ''}".strip()
+        rows.append(_recipient_row(CampaignRecipient, campaign.id, phone, name))
+
+    CampaignRecipient.objects.bulk_create(rows, batch_size=_WRITE_BATCH, ignore_conflicts=True)
+    return len(rows)
+
+
+def mark_recipients(campaign_id, phones, status):
+    """
+    Set the send state of many recipients, one UPDATE per chunk of numbers.
+
+    Returns:
+        int: number of rows updated
+    """
+    from userpanel.models import CampaignRecipient
+
+    phones = list(phones)
+    now = timezone.now()
+    updated = 0
+    for start in range(0, len(phones), _WRITE_BATCH):
+        updated += CampaignRecipient.objects.filter(
+            campaign_id=campaign_id, phone__in=phones[start:start + _WRITE_BATCH]
+        ).update(status=status, updated_at=now)
+    return updated
+
+
+def claim_recipient(campaign_id, phone):
+    """
+    Claim a pending recipient for sending.
+
+    Returns:
+        bool: True if this caller won the recipient (it was still pending)
+    """
+    from userpanel.models import CampaignRecipient
+
+    return bool(
+        CampaignRecipient.objects.filter(campaign_id=campaign_id, phone=phone, status='pending')
+        .update(status='sending', updated_at=timezone.now())
+    )
+
+
+def release_unsent_claims(campaign_id):
+    """
+    Return recipients left 'sending' without any message (run stopped mid-send) to pending.
+
+    Only call while owning the campaign run (after claim_campaign).
+
+    Returns:
+        int: number of recipients released
+    """
+    from userpanel.models import CampaignRecipient, WASenderMessage
+
+    attempted = WASenderMessage.objects.filter(campaign_id=campaign_id).values('recipient')
+    return (
+        CampaignRecipient.objects.filter(campaign_id=campaign_id, status='sending')
+        .exclude(phone__in=attempted)
+        .update(status='pending', updated_at=timezone.now())
+    )
+
+
+def has_recipients(campaign):
+    from userpanel.models import CampaignRecipient
+
+    return CampaignRecipient.objects.filter(campaign_id=campaign.id).exists()
+
+
+def recipient_phones(campaign):
+    """A campaign's recipient numbers as a subquery, for recipient__in filters"""
+    from userpanel.models import CampaignRecipient
+
+    return CampaignRecipient.objects.filter(campaign_id=campaign.id).values('phone')
+
+
+def recipients_page(campaign_id, after_id=0, limit=100, status=None):
+    """
+    One keyset page of a campaign's recipients in insertion order.
+
+    Returns:
+        tuple: (list of recipient dicts, cursor for the next page or None)
+    """
+    from userpanel.models import CampaignRecipient
+
+    rows = CampaignRecipient.objects.filter(campaign_id=campaign_id, id__gt=after_id)
+    if status:
+        rows = rows.filter(status=status)
+    page = list(rows.order_by('id').values('id', 'phone', 'name', 'status', 'updated_at')[:limit + 1])
+    if len(page) > limit:
+        page = page[:limit]
+        return page, page[-1]['id']
+    return page, None
+
+
+def iter_recipients(campaign_id, status=None, chunk_size=2000):
+    """Stream a campaign's recipients page by page without loading them all"""
+    after_id = 0
+    while after_id is not None:
+        page, after_id = recipients_page(campaign_id, after_id, chunk_size, status)
+        yield from page
+
+
+# ==================== Legacy JSON migration ====================
+
+def backfill_campaign_recipients(campaign_model, recipient_model):
+    """
+    Copy each campaign's recipients JSON into recipient rows and empty the JSON.
+
+    Takes the model classes as arguments so migrations can pass historical models.
+    Rows start out 'pending'; a resumed run still skips numbers that already
+    have a message for the campaign.
+
+    Returns:
+        int: number of recipient rows created
+    """
+    created = 0
+    campaign_ids = campaign_model.objects.exclude(recipients=[]).values_list('id', flat=True)
+    for campaign_id in list(campaign_ids):
+        recipients = campaign_model.objects.filter(id=campaign_id).values_list('recipients', flat=True).first()
+        rows = []
+        seen = set()
+        for recipient in recipients or []:
+            if not isinstance(recipient, dict):
+                continue
+            phone = format_e164(recipient.get('phone'))
+            if phone and phone not in seen:
+                seen.add(phone)
+                rows.append(_recipient_row(recipient_model, campaign_id, phone, recipient.get('name')))
+        recipient_model.objects.bulk_create(rows, batch_size=_WRITE_BATCH, ignore_conflicts=True)
+        campaign_model.objects.filter(id=campaign_id).update(recipients=[])
+        created += len(rows)
+        logger.debug(f"Campaign #{campaign_id}: {len(rows)} recipients moved out of the JSON")
+    return created
+
+
+def restore_recipients_json(campaign_model, recipient_model):
+    """Reverse of backfill_campaign_recipients: rebuild each campaign's recipients JSON"""
+    campaign_ids = recipient_model.objects.order_by().values_list('campaign_id', flat=True).distinct()
+    for campaign_id in list(campaign_ids):
+        recipients = [
+            {'phone': phone, 'name': name}
+            for phone, name in recipient_model.objects.filter(campaign_id=campaign_id)
+            .order_by('id').values_list('phone', 'name')
+        ]
+        campaign_model.objects.filter(id=campaign_id).update(recipients=recipients)
@@ -0,0 +1,345 @@
+"""
+Campaign Scheduler
+Runs many campaigns side by side on one asyncio loop and a small thread pool.
+
+With Django-Q every running campaign pins an OS worker for its whole lifetime,
+including the per-message delays and batch cooldowns it spends asleep. The
+scheduler instead gives each claimed campaign (bound to its own WASenderSession)
+a coroutine: pacing delays, typing pauses and cooldowns are asyncio timers, and
+only the actual blocking work (ORM queries, WASender HTTP calls) borrows a
+thread from a fixed pool. Throughput then scales with connected sessions rather
+than with the number of worker processes.
+
+Each campaign reuses the same phases as the Django-Q task (claim, prepare,
+send via CampaignSendEngine, finish), so pacing, dedupe, resume and pause
+semantics are identical. Run a single scheduler process:
+
+    python manage.py run_campaign_scheduler
+
+Settings (all optional):
+    WASENDER_CAMPAIGN_SCHEDULER         hand send_campaign_async tasks to the scheduler (default False)
+    WASENDER_SCHEDULER_WORKERS          threads for blocking DB/HTTP calls (default 8)
+    WASENDER_SCHEDULER_POLL_SECONDS     how often pending campaigns are claimed (default 5)
+    WASENDER_SCHEDULER_MAX_CAMPAIGNS    campaigns running concurrently per process (default 50)
+"""
+
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from userpanel.models import WASenderCampaign
+from whatsappapi import tasks
+from whatsappapi.campaign_engine import (
+    CampaignSendEngine, SendResult, PREPARE_AHEAD, TYPING_PAUSE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Cooldown pause checks are control-channel GETs, so once a second is cheap
+COOLDOWN_CHECK_SECONDS = 1
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _blocking(fn, *args, **kwargs):
+    """Run fn on a pool thread, dropping stale DB connections first"""
+    close_old_connections()
+    return fn(*args, **kwargs)
+
+
+def _release_campaign(campaign_id):
+    """Hand a campaign interrupted by shutdown back to pending so it resumes on next start"""
+    WASenderCampaign.objects.filter(id=campaign_id, status='running').update(status='pending')
+
+
+def _pending_campaigns(exclude_ids, limit):
+    return list(
+        WASenderCampaign.objects.filter(status='pending')
+        .exclude(id__in=list(exclude_ids))
+        .order_by('created_at')
+        .values_list('id', 'session_id')[:limit]
+    )
+
+
+class CampaignScheduler:
+    """Multiplexes running campaigns onto one event loop and a fixed thread pool"""
+
+    def __init__(self, workers=None, poll_interval=None, max_campaigns=None):
+        self.workers = workers or _setting('WASENDER_SCHEDULER_WORKERS', 8)
+        self.poll_interval = poll_interval or _setting('WASENDER_SCHEDULER_POLL_SECONDS', 5.0)
+        self.max_campaigns = max_campaigns or _setting('WASENDER_SCHEDULER_MAX_CAMPAIGNS', 50)
+        self._executor = None
+        self._stopping = None
+        self._active = {}  # campaign_id -> asyncio.Task
+        self._busy_sessions = set()
+
+    # ==================== Lifecycle ====================
+
+    def run(self):
+        """Block running the scheduler until SIGINT/SIGTERM"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='campaign_scheduler')
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        logger.info(f"🗓️ Campaign scheduler started: {self.workers} workers, up to {self.max_campaigns} campaigns")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await self._claim_pending()
+                except Exception as e:
+                    logger.error(f"Campaign scheduler poll failed: {e}", exc_info=True)
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            running = list(self._active.values())
+            if running:
+                logger.info(f"Campaign scheduler stopping: releasing {len(running)} running campaign(s)")
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            self._executor.shutdown(wait=True)
+            logger.info("Campaign scheduler stopped")
+
+    async def _call(self, fn, *args, **kwargs):
+        """Await a blocking call on the shared pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(_blocking, fn, *args, **kwargs))
+
+    # ==================== Claiming ====================
+
+    async def _claim_pending(self):
+        free = self.max_campaigns - len(self._active)
+        if free <= 0:
+            return
+        candidates = await self._call(_pending_campaigns, set(self._active), free * 2)
+        for campaign_id, session_id in candidates:
+            if len(self._active) >= self.max_campaigns:
+                break
+            # One running campaign per session keeps per-number pacing intact
+            if session_id in self._busy_sessions:
+                continue
+            try:
+                campaign = await self._call(tasks.claim_campaign, campaign_id)
+            except WASenderCampaign.DoesNotExist:
+                continue
+            if isinstance(campaign, dict):
+                logger.info(f"Campaign {campaign_id} not claimed: {campaign.get('message') or campaign.get('status')}")
+                continue
+
+            self._busy_sessions.add(session_id)
+            task = asyncio.create_task(self._run_campaign(campaign), name=f"campaign_{campaign_id}")
+            self._active[campaign_id] = task
+            task.add_done_callback(partial(self._finished, campaign_id, session_id))
+            logger.info(f"▶️ Scheduler started campaign {campaign_id} ({len(self._active)} running)")
+
+    def _finished(self, campaign_id, session_id, task):
+        self._active.pop(campaign_id, None)
+        self._busy_sessions.discard(session_id)
+
+    # ==================== Campaign coroutines ====================
+
+    async def _run_campaign(self, campaign):
+        campaign_id = campaign.id
+        try:
+            run = await self._call(tasks.prepare_campaign_run, campaign)
+            if isinstance(run, dict):
+                return run
+            if run.batched:
+                result = await self._send_batched(run)
+            else:
+                result = await self._send_standard(run)
+            logger.info(f"Scheduler finished campaign {campaign_id}: {result}")
+            return result
+        except asyncio.CancelledError:
+            await self._call(_release_campaign, campaign_id)
+            raise
+        except WASenderCampaign.DoesNotExist:
+            logger.error(f"Campaign {campaign_id} not found")
+            return {'error': 'Campaign not found'}
+        except Exception as e:
+            return await self._call(tasks.fail_campaign, campaign_id, e)
+
+    async def _send_standard(self, run):
+        tasks.log_standard_mode(run.session)
+        engine = CampaignSendEngine(
+            run.campaign, run.service, run.session, run.processed_phones,
+            status_check_interval=50
+        )
+        outcome = await self._drive(engine, run.contacts)
+        return await self._call(
+            tasks.finish_campaign, run.campaign, outcome,
+            engine.sent_count, engine.failed_count, engine.error
+        )
+
+    async def _send_batched(self, run):
+        campaign = run.campaign
+        batches = await self._call(tasks.split_into_batches, run)
+        total_sent = 0
+        total_failed = 0
+
+        for batch_index, batch in enumerate(batches, 1):
+            await self._call(tasks.start_batch, campaign, batch_index, len(batches), len(batch))
+            engine = CampaignSendEngine(campaign, run.service, run.session, run.processed_phones)
+            outcome = await self._drive(engine, batch)
+            total_sent += engine.sent_count
+            total_failed += engine.failed_count
+            await self._call(tasks.save_progress, campaign, total_sent, total_failed)
+
+            if outcome == 'paused':
+                return await self._call(tasks.finish_campaign, campaign, outcome, total_sent, total_failed)
+
+            if batch_index < len(batches):
+                cooldown_seconds = await self._call(tasks.begin_cooldown, campaign, batch_index)
+                # The cooldown is a timer: the campaign holds no thread while it waits
+                for second in range(0, cooldown_seconds, COOLDOWN_CHECK_SECONDS):
+                    paused = await self._call(
+                        tasks.cooldown_tick, campaign, second, cooldown_seconds, total_sent, total_failed
+                    )
+                    if paused:
+                        return paused
+                    await asyncio.sleep(min(COOLDOWN_CHECK_SECONDS, cooldown_seconds - second))
+                await self._call(tasks.end_cooldown, campaign, batch_index)
+
+        return await self._call(tasks.finish_campaign, campaign, 'completed', total_sent, total_failed)
+
+    # ==================== Async engine driver ====================
+
+    async def _drive(self, engine, contacts):
+        """
+        Async counterpart of CampaignSendEngine.run.
+
+        Preparation, dispatch and persistence use the engine's stage methods on
+        the pool; pacing and typing waits are timers on the event loop.
+
+        Returns:
+            str: 'completed', 'paused', 'disconnected' (engine.error has details)
+        """
+        loop = asyncio.get_running_loop()
+        prepared = asyncio.Queue(maxsize=PREPARE_AHEAD)
+        results = asyncio.Queue()
+
+        async def prepare():
+            try:
+                for contact in contacts:
+                    job = await self._call(engine.prepare_one, contact)
+                    if job is None:
+                        continue
+                    if isinstance(job, SendResult):
+                        results.put_nowait(job)
+                        continue
+                    await prepared.put(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Campaign {engine.campaign.id} prepare stage failed: {e}", exc_info=True)
+            await prepared.put(None)
+
+        engine.progress.start()
+
+        async def persist():
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                try:
+                    await self._call(engine.persist_one, result)
+                except Exception as e:
+                    logger.error(f"Error persisting result for {result.job.phone}: {e}", exc_info=True)
+
+        preparer = asyncio.create_task(prepare())
+        persister = asyncio.create_task(persist())
+        typing = engine.wants_typing()
+        next_send_at = None
+        messages_since_status_check = 0
+        outcome = 'completed'
+        try:
+            while True:
+                job = await prepared.get()
+                if job is None:
+                    break
+
+                if engine.status_check_interval:
+                    messages_since_status_check += 1
+                    if messages_since_status_check >= engine.status_check_interval:
+                        messages_since_status_check = 0
+                        if not await self._call(engine.check_session):
+                            outcome = 'disconnected'
+                            break
+
+                try:
+                    result = await self._send(engine, job, next_send_at, typing)
+                except Exception as e:
+                    result = SendResult(job, error=e)
+
+                if result is None:
+                    logger.info(f"Campaign {engine.campaign.id} paused by user. Halting sends.")
+                    outcome = 'paused'
+                    break
+
+                # The pacing delay runs from the completion of this send
+                next_send_at = loop.time() + engine.next_delay()
+                results.put_nowait(result)
+        finally:
+            preparer.cancel()
+            results.put_nowait(None)
+            await asyncio.gather(preparer, persister, return_exceptions=True)
+            await self._call(engine.progress.close)
+
+        return outcome
+
+    async def _wait_until(self, engine, deadline):
+        """Timer wait until deadline, returning False if the campaign is paused meanwhile"""
+        loop = asyncio.get_running_loop()
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return True
+            if engine.pause_check_due() and await self._call(engine.is_paused, True):
+                return False
+            await asyncio.sleep(min(engine.pause_check_interval, remaining))
+
+    async def _send(self, engine, job, next_send_at, typing):
+        """Wait for the contact's pacing slot (typing indicator inside the wait), then dispatch"""
+        loop = asyncio.get_running_loop()
+        deadline = next_send_at or loop.time()
+        if typing:
+            if not await self._wait_until(engine, deadline - TYPING_PAUSE_SECONDS):
+                return None
+            try:
+                await self._call(engine.service.send_presence_update, engine.session, job.phone, 'composing')
+            except Exception:
+                pass  # Non-critical, continue with message
+            deadline = max(deadline, loop.time() + TYPING_PAUSE_SECONDS)
+        if not await self._wait_until(engine, deadline):
+            return None
+        # Always honour a pause requested right before the send
+        if await self._call(engine.is_paused, True):
+            return None
+        return await self._call(engine.dispatch, job)
@@ -27,7 +27,10 @@ class UpdatesConsumer(AsyncWebsocketConsumer):
         # Only authenticated users can connect
         if self.user.is_authenticated:
             self.user_group = f"updates_{self.user.id}"
+            # Contact list events (create/import/rename/delete) use their own group
+            self.contacts_group = f"user_updates_{self.user.id}"
             await self.channel_layer.group_add(self.user_group, self.channel_name)
+            await self.channel_layer.group_add(self.contacts_group, self.channel_name)
             await self.accept()
             logger.info(f"WebSocket connected for user {self.user.email}")
         else:
@@ -38,6 +41,7 @@ class UpdatesConsumer(AsyncWebsocketConsumer):
         """Handle WebSocket disconnection."""
         if self.user.is_authenticated:
             await self.channel_layer.group_discard(self.user_group, self.channel_name)
+            await self.channel_layer.group_discard(self.contacts_group, self.channel_name)
             logger.info(f"WebSocket disconnected for user {self.user.email} (code: {close_code})")
     
     async def receive(self, text_data):
@@ -170,3 +174,23 @@ class UpdatesConsumer(AsyncWebsocketConsumer):
             logger.info(f"📡 Session status update sent | Session: {event.get('session_id')} | Status: {event.get('status')}")
         except Exception as e:
             logger.error(f"Error sending session status update: {e}")
+    
+    async def contact_list_event(self, event):
+        """
+        Send contact list changes to the contacts page.
+        Payload shape: {'event': <type>, 'list': {...}, 'list_id': ..., 'progress': {...}}
+        """
+        try:
+            payload = {'event': event.get('type')}
+            for key in ('list', 'list_id', 'progress'):
+                if key in event:
+                    payload[key] = event[key]
+            await self.send(text_data=json.dumps(payload))
+        except Exception as e:
+            logger.error(f"Error sending contact list update: {e}")
+    
+    contact_list_created = contact_list_event
+    contacts_count_updated = contact_list_event
+    contact_list_renamed = contact_list_event
+    contact_list_deleted = contact_list_event
+    contact_import_progress = contact_list_event
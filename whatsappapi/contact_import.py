@@ -0,0 +1,358 @@
+"""
+Contact List Import
+Background bulk import of uploaded CSV/XLSX contact files.
+
+upload_contacts stores the file, sniffs its header row and creates the
+ContactList, then hands the rest to a Django-Q worker so large lists never
+hold up the web request:
+
+    read        stream the file in fixed-size row chunks (CSV chunksize,
+                XLSX openpyxl read_only rows) so memory stays flat
+    normalize   vectorized strip, leading-zero removal and country-code prefix,
+                plus the E.164 form stored in Contact.phone_e164
+    validate    rows whose phone is not a phone number (digits with optional '+'
+                and separators) or longer than the column are rejected and
+                counted, and legacy text columns are clipped to their length,
+                so bulk_create never relies on the database to truncate
+    dedupe      vectorized drop_duplicates within a chunk; repeats across
+                chunks are skipped by the (contact_list, phone_number) unique key
+    write       Contact bulk_create(ignore_conflicts=True) per chunk
+
+Progress is pushed to the user's contacts page over the channels layer after
+every chunk ('contact_import_progress' on the user_updates_<id> group).
+
+Settings (all optional):
+    WASENDER_CONTACT_IMPORT_CHUNK   rows read and written per chunk (default 2000)
+"""
+
+import logging
+import os
+import threading
+
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+from whatsappapi.models import ContactList, Contact
+
+logger = logging.getLogger(__name__)
+
+LEGACY_COLUMNS = ('first_name', 'last_name', 'email', 'custom_field_1', 'custom_field_2', 'custom_field_3')
+
+# Column sizes of Contact.phone_number and the legacy CharFields/EmailField
+PHONE_MAX_LENGTH = 20
+LEGACY_MAX_LENGTH = 255
+PHONE_PATTERN = r'^\+?[\d\s().\-]*\d[\d\s().\-]*$'
+
+
+def _chunk_size():
+    try:
+        return max(100, int(getattr(settings, 'WASENDER_CONTACT_IMPORT_CHUNK', 2000)))
+    except (TypeError, ValueError):
+        return 2000
+
+
+# ==================== Reading ====================
+
+class ContactFileHeader:
+    """Sniffed header row: usable column names and their positions in the file"""
+
+    def __init__(self, columns, positions, header_row=0, estimated_rows=None):
+        self.columns = columns
+        self.positions = positions
+        self.header_row = header_row
+        self.estimated_rows = estimated_rows
+
+    @property
+    def available_fields(self):
+        """Dynamic fields for ContactList.available_fields (every column but phone)"""
+        return [col for col in self.columns if col != 'phone']
+
+
+def _cell_text(value):
+    """Spreadsheet cell -> text; integral floats lose the '.0' Excel gives phone numbers"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _clean_header(raw):
+    """
+    Strip header names, drop unnamed columns, make repeats unique (like pandas)
+    and map any case/spacing variant of 'phone' to 'phone'.
+    """
+    columns = []
+    positions = []
+    counts = {}
+    for position, name in enumerate(raw):
+        name = _cell_text(name)
+        name = name.strip() if name else ''
+        if not name or name.lower().startswith('unnamed:'):
+            continue
+        if name.lower() == 'phone':
+            name = 'phone'
+        if name in counts:
+            counts[name] += 1
+            name = f"{name}.{counts[name]}"
+        else:
+            counts[name] = 0
+        columns.append(name)
+        positions.append(position)
+    return columns, positions
+
+
+def sniff_header(file_path, file_extension):
+    """
+    Read only the header row of an uploaded contact file.
+
+    Leading blank rows in spreadsheets are skipped. estimated_rows is the data
+    row count when the format records it cheaply (XLSX dimensions), else None.
+    """
+    if file_extension == 'csv':
+        columns, positions = _clean_header(pd.read_csv(file_path, nrows=0, dtype=str).columns)
+        return ContactFileHeader(columns, positions)
+
+    if file_extension == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            for row_index, row in enumerate(sheet.iter_rows(values_only=True)):
+                if any(cell not in (None, '') for cell in row):
+                    columns, positions = _clean_header(row)
+                    estimated = sheet.max_row - row_index - 1 if sheet.max_row else None
+                    return ContactFileHeader(columns, positions, row_index, estimated)
+        finally:
+            workbook.close()
+        return ContactFileHeader([], [])
+
+    # Legacy .xls has no streaming reader; it is capped at 65k rows anyway
+    columns, positions = _clean_header(pd.read_excel(file_path, nrows=0).columns)
+    return ContactFileHeader(columns, positions)
+
+
+def _select(frame, header):
+    frame = frame.iloc[:, header.positions]
+    frame.columns = header.columns
+    return frame
+
+
+def iter_contact_frames(file_path, file_extension, header, chunk_rows):
+    """
+    Yield the file's data rows as DataFrames of at most chunk_rows rows.
+
+    Every value is text (or NaN for blanks), so phones never turn into floats.
+    Only one chunk is held in memory at a time for CSV and XLSX.
+    """
+    if file_extension == 'csv':
+        for chunk in pd.read_csv(file_path, dtype=str, chunksize=chunk_rows):
+            yield _select(chunk, header)
+        return
+
+    if file_extension == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = []
+            rows_iter = workbook.active.iter_rows(min_row=header.header_row + 2, values_only=True)
+            for row in rows_iter:
+                rows.append([_cell_text(row[i]) if i < len(row) else None for i in header.positions])
+                if len(rows) >= chunk_rows:
+                    yield pd.DataFrame(rows, columns=header.columns)
+                    rows = []
+            if rows:
+                yield pd.DataFrame(rows, columns=header.columns)
+        finally:
+            workbook.close()
+        return
+
+    frame = pd.read_excel(file_path, dtype=str)
+    for start in range(0, len(frame), chunk_rows):
+        yield _select(frame.iloc[start:start + chunk_rows], header)
+
+
+# ==================== Normalizing ====================
+
+def normalize_phones(phones, country_code='', country_type='single'):
+    """
+    Vectorized phone cleanup for a whole column.
+
+    Strips whitespace; in single-country mode removes leading zeros and adds the
+    country code when missing. Blank/NaN phones come back as ''.
+    """
+    phones = phones.astype('string').str.strip().fillna('')
+    if country_type == 'single' and country_code:
+        phones = phones.str.lstrip('0')
+        needs_code = (phones != '') & ~phones.str.startswith(country_code)
+        phones = phones.mask(needs_code, country_code + phones)
+    return phones
+
+
+def e164_phones(phones):
+    """Vectorized phone_format.format_e164: keep digits and '+', ensure a '+' prefix"""
+    phones = phones.astype('string').fillna('').str.replace(r'[^\d+]', '', regex=True)
+    return phones.mask((phones != '') & ~phones.str.startswith('+'), '+' + phones)
+
+
+def prepare_contact_frame(frame, country_code='', country_type='single'):
+    """
+    Normalize phones, reject invalid ones and drop blanks and duplicates within
+    the frame (first occurrence wins).
+
+    Returns:
+        tuple: (deduplicated frame, duplicate rows removed, invalid rows rejected)
+    """
+    frame = frame.assign(phone=normalize_phones(frame['phone'], country_code, country_type))
+    frame = frame[frame['phone'] != '']
+    valid = (frame['phone'].str.len() <= PHONE_MAX_LENGTH) & frame['phone'].str.match(PHONE_PATTERN)
+    rejected = int((~valid).sum())
+    if rejected:
+        logger.warning(f"Skipping {rejected} rows with invalid phone numbers, e.g. {frame['phone'][~valid].iloc[0][:40]!r}")
+        frame = frame[valid]
+    frame = frame.assign(phone_e164=e164_phones(frame['phone']))
+    deduped = frame.drop_duplicates(subset=['phone'], keep='first')
+    return deduped, len(frame) - len(deduped), rejected
+
+
+def build_contacts(contact_list, frame, field_columns):
+    """Turn a prepared frame into unsaved Contact rows with dynamic and legacy fields"""
+    if field_columns:
+        values = frame[field_columns].astype(object)
+        records = values.where(values.notna(), '').astype(str).to_dict('records')
+    else:
+        records = [{} for _ in range(len(frame))]
+
+    contacts = []
+    for phone, phone_e164, contact_fields in zip(frame['phone'].tolist(), frame['phone_e164'].tolist(), records):
+        contacts.append(Contact(
+            contact_list=contact_list,
+            phone_number=phone,
+            phone_e164=phone_e164,
+            fields=contact_fields,  # Store all CSV fields dynamically
+            # Backward compatibility - populate specific fields if they exist
+            **{column: contact_fields.get(column, '')[:LEGACY_MAX_LENGTH] for column in LEGACY_COLUMNS}
+        ))
+    return contacts
+
+
+# ==================== Progress ====================
+
+def contact_list_payload(contact_list):
+    return {
+        'id': contact_list.id,
+        'name': contact_list.name,
+        'total_contacts': contact_list.total_contacts,
+        'created_at': timezone.localtime(contact_list.created_at).strftime("%d/%m/%Y, %H:%M:%S"),
+    }
+
+
+def publish_contact_list_event(contact_list, event_type, **extra):
+    """Broadcast a contact list event to the owner's contacts page (best effort)"""
+    try:
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            f"user_updates_{contact_list.user_id}",
+            {'type': event_type, 'list': contact_list_payload(contact_list), **extra}
+        )
+    except Exception:
+        pass
+
+
+# ==================== Import job ====================
+
+def import_contact_file(contact_list_id, file_path, country_code='', country_type='single'):
+    """
+    Background task: bulk import an uploaded file into an existing ContactList
+
+    Args:
+        contact_list_id: ContactList created by the upload view
+        file_path: Temp path of the uploaded CSV/XLSX (deleted when done)
+        country_code: Dial code without '+', used in single-country mode
+        country_type: 'single' or 'multiple'
+
+    Returns:
+        dict: Import results (total_contacts, duplicates_removed, rejected)
+    """
+    contact_list = ContactList.objects.get(id=contact_list_id)
+    file_extension = file_path.rsplit('.', 1)[-1].lower()
+    progress = {'status': 'importing', 'processed': 0, 'total': None, 'duplicates_removed': 0, 'rejected': 0}
+
+    try:
+        header = sniff_header(file_path, file_extension)
+        field_columns = header.available_fields
+        progress['total'] = header.estimated_rows
+        publish_contact_list_event(contact_list, 'contact_import_progress', progress=progress)
+
+        valid_rows = 0
+        duplicates = 0
+        for frame in iter_contact_frames(file_path, file_extension, header, _chunk_size()):
+            progress['processed'] += len(frame)
+            frame, chunk_duplicates, chunk_rejected = prepare_contact_frame(frame, country_code, country_type)
+            duplicates += chunk_duplicates
+            progress['rejected'] += chunk_rejected
+            if len(frame):
+                # Repeats of phones from earlier chunks are skipped by the unique key
+                Contact.objects.bulk_create(
+                    build_contacts(contact_list, frame, field_columns),
+                    ignore_conflicts=True
+                )
+                valid_rows += len(frame)
+                contact_list.total_contacts = valid_rows
+                ContactList.objects.filter(id=contact_list.id).update(total_contacts=valid_rows)
+            publish_contact_list_event(contact_list, 'contact_import_progress', progress=progress)
+
+        # ignore_conflicts hides skipped rows, so count what actually landed
+        contact_list.total_contacts = Contact.objects.filter(contact_list=contact_list).count()
+        contact_list.save(update_fields=['total_contacts', 'updated_at'])
+        # Repeats inside a chunk were dropped by the frame, repeats across chunks by the unique key
+        duplicates_removed = duplicates + (valid_rows - contact_list.total_contacts)
+        if duplicates_removed > 0:
+            logger.info(f"Removed {duplicates_removed} duplicate phone numbers from upload")
+        progress.update(status='completed', total=progress['processed'], duplicates_removed=duplicates_removed)
+        logger.info(f"📇 Imported {contact_list.total_contacts} contacts into list {contact_list.id}")
+
+        return {
+            'list_id': contact_list.id,
+            'total_contacts': contact_list.total_contacts,
+            'duplicates_removed': duplicates_removed,
+            'rejected': progress['rejected'],
+        }
+
+    except Exception as e:
+        logger.error(f"Error importing contacts into list {contact_list_id}: {e}", exc_info=True)
+        progress.update(status='failed', error=str(e))
+        return {'list_id': contact_list_id, 'error': str(e)}
+
+    finally:
+        publish_contact_list_event(contact_list, 'contact_import_progress', progress=progress)
+        publish_contact_list_event(contact_list, 'contacts_count_updated')
+        try:
+            os.remove(file_path)
+        except Exception as e:
+            logger.warning(f"Failed to delete temp contact file: {e}")
+
+
+def queue_contact_import(contact_list, file_path, country_code='', country_type='single'):
+    """
+    Queue import_contact_file on Django-Q, falling back to a local thread
+
+    Returns:
+        str: task id (or 'thread:<name>' for the fallback)
+    """
+    args = (contact_list.id, file_path, country_code, country_type)
+    try:
+        from django_q.tasks import async_task
+        return async_task(import_contact_file, *args, task_name=f"contact_import_{contact_list.id}")
+    except Exception as e:
+        logger.error(f"Failed to queue contact import for list {contact_list.id}: {e}")
+        thread_name = f"contact_import_{contact_list.id}_worker"
+        threading.Thread(target=import_contact_file, args=args, name=thread_name, daemon=True).start()
+        logger.warning(f"Django-Q queue failed; started local thread '{thread_name}' for contact list {contact_list.id}")
+        return f"thread:{thread_name}"
@@ -4,7 +4,7 @@ import csv
 import json
 from typing import List, Dict
 from django.core.management.base import BaseCommand, CommandParser
-from whatsappapi.moderation import evaluate_content
+from whatsappapi.moderation import ai_cache_stats, evaluate_content
 
 
 class Command(BaseCommand):
@@ -139,4 +139,9 @@ class Command(BaseCommand):
             except Exception as e:
                 self.stderr.write(self.style.ERROR(f"Failed to write output: {e}"))
 
+        stats = ai_cache_stats()
+        self.stdout.write(
+            f"Verdict cache: local_hits={stats['local_hits']} shared_hits={stats['shared_hits']} "
+            f"negative_hits={stats['negative_hits']} misses={stats['misses']}"
+        )
         self.stdout.write(self.style.SUCCESS("Done."))
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Management command to fill Contact.phone_e164 for contacts imported before it existed.
+
+Usage:
+    python manage.py backfill_contact_e164                      # Whole table
+    python manage.py backfill_contact_e164 --start-id=2000000   # Resume after an interrupted run
+    python manage.py backfill_contact_e164 --batch-size=20000
+
+Migration 0003 runs the same backfill once; this re-runs it (e.g. for rows
+written by old workers during a deploy). Contacts that already have a value
+are skipped, so it is safe to repeat.
+"""
+
+from django.core.management.base import BaseCommand
+
+from whatsappapi.models import Contact
+from whatsappapi.phone_format import backfill_contact_e164
+
+
+class Command(BaseCommand):
+    help = 'Store the E.164 phone number on contacts that are missing it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Contact id window updated per query (default: 5000)',
+        )
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            default=0,
+            help='Only scan contacts with an id above this (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        updated = backfill_contact_e164(
+            Contact,
+            batch_size=max(1, options['batch_size']),
+            start_id=options['start_id'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"✅ Stored E.164 numbers for {updated} contacts"))
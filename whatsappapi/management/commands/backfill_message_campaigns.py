@@ -0,0 +1,44 @@
+"""
+Management command to link historical messages to their campaigns.
+
+Usage:
+    python manage.py backfill_message_campaigns                     # Whole table
+    python manage.py backfill_message_campaigns --start-id=5000000  # Resume after an interrupted run
+    python manage.py backfill_message_campaigns --batch-size=20000
+
+Migration 0005 runs the same backfill once; run this afterwards to pick up
+messages tagged only in metadata by workers that were still on the old code
+during the deploy. It is safe to re-run: linked rows are skipped.
+"""
+
+from django.core.management.base import BaseCommand
+
+from userpanel.models import WASenderMessage, WASenderCampaign
+from whatsappapi.campaign_links import link_campaign_messages
+
+
+class Command(BaseCommand):
+    help = "Set WASenderMessage.campaign from metadata['campaign_id'] for unlinked messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Message id window scanned per query (default: 5000)',
+        )
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            default=0,
+            help='Only scan messages with an id above this (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        linked = link_campaign_messages(
+            WASenderMessage,
+            WASenderCampaign,
+            batch_size=max(1, options['batch_size']),
+            start_id=options['start_id'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"✅ Linked {linked} messages to their campaigns"))
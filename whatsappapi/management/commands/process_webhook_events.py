@@ -0,0 +1,100 @@
+"""
+Management command to drain the webhook ingestion queue.
+
+Usage:
+    python manage.py process_webhook_events                  # One consumer, runs until stopped
+    python manage.py process_webhook_events --workers=4      # Four consumers claiming with SKIP LOCKED
+    python manage.py process_webhook_events --once           # Drain what is pending, then exit
+
+Several copies can run side by side (on one or more hosts); each batch is
+claimed with SELECT ... FOR UPDATE SKIP LOCKED so no event is handled twice.
+"""
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from whatsappapi.webhook_queue import (
+    claim_batch, process_batch, requeue_stale, purge_processed, drain_webhook_events,
+)
+
+MAINTENANCE_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = 'Process queued WASender webhook events in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Consumer threads in this process (default: 1)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Events claimed per batch (default: WASENDER_WEBHOOK_BATCH_SIZE or 200)',
+        )
+        parser.add_argument(
+            '--idle-sleep',
+            type=float,
+            default=1.0,
+            help='Seconds a consumer waits when the queue is empty (default: 1)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process everything currently pending and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            requeue_stale()
+            finished = drain_webhook_events()
+            self.stdout.write(self.style.SUCCESS(f"✅ Processed {finished} webhook events"))
+            return
+
+        workers = max(1, options['workers'])
+        stop = threading.Event()
+        threads = [
+            threading.Thread(
+                target=self._consume,
+                args=(stop, options['batch_size'], options['idle_sleep']),
+                name=f"webhook_consumer_{i}",
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        self.stdout.write(self.style.NOTICE(f"📥 Webhook consumers running: {workers}"))
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    requeue_stale()
+                    purge_processed()
+                except Exception as e:
+                    self.stderr.write(f"⚠️ Webhook queue maintenance failed: {e}")
+                time.sleep(MAINTENANCE_SECONDS)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=30)
+            self.stdout.write(self.style.SUCCESS("✅ Webhook consumers stopped"))
+
+    def _consume(self, stop, batch_size, idle_sleep):
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                events = claim_batch(batch_size)
+                if events:
+                    process_batch(events)
+                    continue
+            except Exception as e:
+                self.stderr.write(f"❌ Webhook consumer error: {e}")
+            stop.wait(idle_sleep)
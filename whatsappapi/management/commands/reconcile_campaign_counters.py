@@ -0,0 +1,46 @@
+"""
+Scheduled task to repair drifted campaign counters.
+Run this every 10-15 minutes via PythonAnywhere Scheduled Tasks (or cron).
+
+Usage:
+    python manage.py reconcile_campaign_counters                 # Pending/paused + recently updated campaigns
+    python manage.py reconcile_campaign_counters --campaign=42   # One campaign
+    python manage.py reconcile_campaign_counters --all           # Every campaign not running (slow on big tables)
+
+Counters are normally maintained per message by whatsappapi.campaign_counters;
+this recounts with one grouped aggregate per 500 campaigns and only writes
+campaigns whose stored values differ. Running campaigns are skipped; their
+send worker reconciles them after flushing its buffered progress.
+"""
+
+from django.core.management.base import BaseCommand
+
+from userpanel.models import WASenderCampaign
+from whatsappapi.campaign_counters import reconcile_campaign_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount campaign message counters from messages and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--campaign',
+            type=int,
+            help='Reconcile only this campaign ID',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Reconcile every campaign, not just active/recent ones',
+        )
+
+    def handle(self, *args, **options):
+        if options['campaign']:
+            campaign_ids = [options['campaign']]
+        elif options['all']:
+            campaign_ids = WASenderCampaign.objects.exclude(status='running').values_list('id', flat=True)
+        else:
+            campaign_ids = None
+
+        corrected = reconcile_campaign_counters(campaign_ids)
+        self.stdout.write(self.style.SUCCESS(f"✅ Reconciled campaign counters: {corrected} corrected"))
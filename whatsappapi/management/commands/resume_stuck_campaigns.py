@@ -114,7 +114,7 @@ class Command(BaseCommand):
         
         # Count messages already sent for this campaign
         sent_messages = WASenderMessage.objects.filter(
-            metadata__campaign_id=campaign.id,
+            campaign_id=campaign.id,
             status__in=['sent', 'delivered', 'read']
         )
         sent_phones = set(sent_messages.values_list('recipient', flat=True))
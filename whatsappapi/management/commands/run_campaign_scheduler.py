@@ -0,0 +1,56 @@
+"""
+Management command to run campaigns on the shared asyncio campaign scheduler.
+
+Usage:
+    python manage.py run_campaign_scheduler                  # Use WASENDER_SCHEDULER_* settings
+    python manage.py run_campaign_scheduler --workers=4      # Override the blocking-call pool size
+    python manage.py run_campaign_scheduler --max-campaigns=20
+
+Set WASENDER_CAMPAIGN_SCHEDULER = True so Django-Q send tasks leave campaigns
+pending for this process instead of running them on a worker.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from whatsappapi.campaign_scheduler import CampaignScheduler
+
+
+class Command(BaseCommand):
+    help = 'Run pending WhatsApp campaigns concurrently on one event loop and a small thread pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Threads for blocking DB/HTTP calls (default: WASENDER_SCHEDULER_WORKERS or 8)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            help='Seconds between checks for pending campaigns (default: WASENDER_SCHEDULER_POLL_SECONDS or 5)',
+        )
+        parser.add_argument(
+            '--max-campaigns',
+            type=int,
+            help='Campaigns running concurrently (default: WASENDER_SCHEDULER_MAX_CAMPAIGNS or 50)',
+        )
+
+    def handle(self, *args, **options):
+        scheduler = CampaignScheduler(
+            workers=options['workers'],
+            poll_interval=options['poll_interval'],
+            max_campaigns=options['max_campaigns'],
+        )
+
+        self.stdout.write(self.style.NOTICE(
+            f"🗓️ Campaign scheduler: {scheduler.workers} workers, "
+            f"up to {scheduler.max_campaigns} campaigns, polling every {scheduler.poll_interval}s"
+        ))
+        if not getattr(settings, 'WASENDER_CAMPAIGN_SCHEDULER', False):
+            self.stdout.write(self.style.WARNING(
+                "⚠️ WASENDER_CAMPAIGN_SCHEDULER is off: Django-Q workers will also claim pending campaigns"
+            ))
+
+        scheduler.run()
+        self.stdout.write(self.style.SUCCESS("✅ Campaign scheduler stopped"))
@@ -0,0 +1,46 @@
+"""
+Scheduled task to copy session send counts from the rate limiter to the database.
+Run this every few minutes via PythonAnywhere Scheduled Tasks (or cron).
+
+Usage:
+    python manage.py sync_session_usage               # Connected sessions
+    python manage.py sync_session_usage --session=7   # One session (database ID)
+    python manage.py sync_session_usage --all         # Every session
+
+Sends are counted in Redis by whatsappapi.session_rate_limit, which already
+writes a session's counts back at most every WASENDER_RATE_LIMIT_SYNC_SECONDS
+while it is sending; this catches sessions whose last sync predates their
+last send, and rolls daily counts over for idle sessions.
+"""
+
+from django.core.management.base import BaseCommand
+
+from userpanel.models import WASenderSession
+from whatsappapi.session_rate_limit import sync_session_usage
+
+
+class Command(BaseCommand):
+    help = 'Write rate limiter send counts back to WASender sessions for display'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--session',
+            type=int,
+            help='Sync only this session (database ID)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Sync every session, not just connected ones',
+        )
+
+    def handle(self, *args, **options):
+        if options['session']:
+            session_ids = [options['session']]
+        elif options['all']:
+            session_ids = WASenderSession.objects.values_list('id', flat=True)
+        else:
+            session_ids = WASenderSession.objects.filter(status='connected').values_list('id', flat=True)
+
+        synced = sync_session_usage(list(session_ids))
+        self.stdout.write(self.style.SUCCESS(f"✅ Synced send counts for {synced} sessions"))
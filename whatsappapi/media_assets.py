@@ -0,0 +1,118 @@
+"""
+Campaign Media Assets
+Content-addressed record of uploaded campaign attachments (whatsappapi.MediaAsset).
+
+Every campaign used to upload its attachment again when it started: the temp
+file to Cloudinary and, for documents, the bytes to WASender as well, even when
+the user had sent the same brochure in ten earlier campaigns. Attachments are
+now identified by the SHA-256 of their content, per user and attachment type:
+
+    campaign start    the temp file is hashed in chunks; a known hash reuses the
+                      stored Cloudinary URL instead of uploading again, and a
+                      known document reuses its WASender-hosted URL until it
+                      expires
+    new content       is uploaded once, into a folder named after its hash so a
+                      later file with the same name cannot overwrite it, and
+                      recorded here
+    media resolver    a WASender upload made while sending is remembered on the
+                      asset through remember_wasender_url()
+
+Settings (all optional):
+    WASENDER_MEDIA_UPLOAD_SECONDS   how long a WASender-hosted upload is reused (default 43200)
+"""
+
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def file_sha256(path):
+    """
+    Hash a file without reading it into memory at once.
+
+    Returns:
+        tuple: (hex digest, size in bytes)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def asset_folder(user_id, sha256):
+    """Cloudinary folder for an asset; the hash keeps equal file names with different content apart"""
+    return f"wa_campaigns/{user_id}/{sha256[:16]}"
+
+
+def find_asset(user_id, sha256, attachment_type):
+    """The user's stored asset for this content, or None"""
+    from whatsappapi.models import MediaAsset
+
+    asset = MediaAsset.objects.filter(user_id=user_id, sha256=sha256, attachment_type=attachment_type).first()
+    if asset is not None:
+        asset.last_used_at = timezone.now()
+        MediaAsset.objects.filter(id=asset.id).update(last_used_at=asset.last_used_at)
+    return asset
+
+
+def record_asset(user_id, sha256, attachment_type, size, public_id, url):
+    """Store (or refresh) the Cloudinary upload of an asset"""
+    from whatsappapi.models import MediaAsset
+
+    asset, _ = MediaAsset.objects.update_or_create(
+        user_id=user_id,
+        sha256=sha256,
+        attachment_type=attachment_type,
+        defaults={
+            'size': size,
+            'cloudinary_public_id': public_id or '',
+            'cloudinary_url': url,
+            'last_used_at': timezone.now(),
+        },
+    )
+    return asset
+
+
+def hosted_url(asset):
+    """The asset's WASender-hosted URL while it is still valid, else ''"""
+    if asset.wasender_url and asset.wasender_expires_at and asset.wasender_expires_at > timezone.now():
+        return asset.wasender_url
+    return ''
+
+
+def remember_wasender_url(user_id, cloudinary_url, wasender_url):
+    """
+    Record a WASender upload on the asset(s) stored at a Cloudinary URL.
+
+    Returns:
+        int: number of assets updated
+    """
+    from whatsappapi.models import MediaAsset
+
+    if not (cloudinary_url and wasender_url):
+        return 0
+    expires_at = timezone.now() + timedelta(seconds=_setting('WASENDER_MEDIA_UPLOAD_SECONDS', 43200))
+    try:
+        return MediaAsset.objects.filter(user_id=user_id, cloudinary_url=cloudinary_url).update(
+            wasender_url=wasender_url, wasender_expires_at=expires_at
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Could not remember WASender upload for {cloudinary_url}: {e}")
+        return 0
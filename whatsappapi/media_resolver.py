@@ -0,0 +1,199 @@
+"""
+Campaign Media Resolver
+Decides once per campaign which URL WASender should fetch an attachment from.
+
+send_media_message used to preflight the attachment for every recipient: a
+HEAD request, and a full re-upload to WASender whenever the HEAD failed, even
+though every recipient of a campaign gets the same file. The resolver does
+that work once and hands the send path a ResolvedMedia handle:
+
+    audio       sent from its URL as-is (CDNs often block HEAD on audio)
+    reachable   a HEAD < 400 on the WASender-hosted copy (documents pre-uploaded
+                at campaign start) or on the attachment URL itself
+    uploaded    otherwise the file is uploaded to WASender once and its hosted
+                URL is used (and stored in wasender_document_url for documents,
+                and on the attachment's MediaAsset for later campaigns)
+
+Handles are cached in the Django cache per campaign until they expire, so
+every worker and every resumed run of the campaign reuses them. A send that
+WASender rejects for its media (e.g. a hosted URL that expired early) drops
+the handle through forget_rejected_media, and the next send resolves again.
+
+Settings (all optional):
+    WASENDER_MEDIA_VALIDATED_SECONDS   how long a reachable URL is trusted (default 3600)
+    WASENDER_MEDIA_UPLOAD_SECONDS      how long a WASender-hosted upload is reused (default 43200)
+"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import time
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+
+from whatsappapi.media_assets import remember_wasender_url
+
+logger = logging.getLogger(__name__)
+
+# Send errors that blame the attachment rather than the recipient or the API
+_MEDIA_ERROR = re.compile(
+    r"\b(url|media|download|fetch|file|document|image|video|audio|attachment)\b"
+    r"|expired|forbidden|not\s+accessible|\b40[34]\b",
+    re.IGNORECASE,
+)
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _cache_key(campaign_id, message_type, media_url):
+    url_hash = hashlib.md5(media_url.encode()).hexdigest()[:12]
+    return f"wasender:campaign_media:{campaign_id}:{message_type}:{url_hash}"
+
+
+def clean_media_url(url):
+    """Strip accidental backticks/quotes from UI or logs"""
+    try:
+        return str(url).strip().strip('`"')
+    except Exception:
+        return str(url)
+
+
+def media_filename(url):
+    """File name WASender should show for a media URL ('' if the path has none)"""
+    return unquote(os.path.basename(urlparse(url).path))
+
+
+def document_mime_type(filename):
+    mime, _ = mimetypes.guess_type(filename)
+    if not mime and filename.lower().endswith('.pdf'):
+        mime = 'application/pdf'
+    return mime
+
+
+class ResolvedMedia:
+    """A sendable media URL plus what the send payload needs, valid until expires_at (epoch seconds)"""
+
+    __slots__ = ('url', 'message_type', 'file_name', 'mime_type', 'expires_at')
+
+    def __init__(self, url, message_type, file_name='', mime_type=None, expires_at=0.0):
+        self.url = url
+        self.message_type = message_type
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.expires_at = expires_at
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _is_reachable(service, url):
+    try:
+        return service.http.head(url, timeout=10, allow_redirects=True).status_code < 400
+    except Exception as e:
+        logger.warning(f"⚠️ Media preflight failed for {url}: {e}")
+        return False
+
+
+def _resolve(campaign, service, session, media_url, message_type, public_id):
+    file_name = media_filename(media_url)
+    mime_type = None
+    if message_type == 'document':
+        file_name = file_name or 'document.pdf'
+        mime_type = document_mime_type(file_name)
+
+    def handle(url, lifetime):
+        return ResolvedMedia(url, message_type, file_name, mime_type, time.time() + lifetime)
+
+    validated = _setting('WASENDER_MEDIA_VALIDATED_SECONDS', 3600)
+    if message_type == 'audio':
+        return handle(media_url, validated)
+
+    hosted = getattr(campaign, 'wasender_document_url', None) if message_type == 'document' else None
+    for candidate in filter(None, [hosted, media_url]):
+        if _is_reachable(service, candidate):
+            return handle(candidate, validated)
+
+    uploaded_url = service.upload_media_file(session, media_url, message_type, file_name or None, public_id)
+    if not uploaded_url:
+        logger.error(f"❌ Media URL not publicly accessible and upload failed: {media_url}")
+        return None
+    if message_type == 'document' and campaign.id:
+        campaign.wasender_document_url = uploaded_url
+        campaign.save(update_fields=['wasender_document_url'])
+    # Later campaigns sending the same file reuse this upload
+    remember_wasender_url(campaign.user_id, media_url, uploaded_url)
+    logger.info(f"📎 Campaign #{campaign.id} {message_type} uploaded to WASender once: {uploaded_url}")
+    return handle(uploaded_url, _setting('WASENDER_MEDIA_UPLOAD_SECONDS', 43200))
+
+
+def resolve_campaign_media(campaign, service, session, media_url=None, message_type=None):
+    """
+    The sendable media handle for a campaign's attachment, resolved at most once per expiry.
+
+    Returns:
+        ResolvedMedia, or None if the attachment is neither reachable nor uploadable
+    """
+    media_url = clean_media_url(media_url or campaign.attachment_url)
+    message_type = message_type or campaign.attachment_type
+    key = _cache_key(campaign.id, message_type, media_url)
+
+    try:
+        cached = cache.get(key)
+    except Exception:
+        cached = None
+    if cached:
+        media = ResolvedMedia(**cached)
+        if not media.expired:
+            return media
+
+    media = _resolve(campaign, service, session, media_url, message_type, campaign.attachment_public_id)
+    if media is not None:
+        try:
+            cache.set(key, media.as_dict(), max(int(media.expires_at - time.time()), 1))
+        except Exception:
+            pass
+    return media
+
+
+def forget_campaign_media(campaign_id, message_type, media_url):
+    """Drop a campaign's cached media handle (e.g. after a send with it was rejected)"""
+    try:
+        cache.delete(_cache_key(campaign_id, message_type, clean_media_url(media_url)))
+    except Exception:
+        pass
+
+
+def is_media_rejection(message):
+    """True if a failed WASenderMessage was rejected because of its media"""
+    if message is None or getattr(message, 'status', None) != 'failed':
+        return False
+    return bool(_MEDIA_ERROR.search(str(getattr(message, 'error_message', '') or '')))
+
+
+def forget_rejected_media(campaign, message, media_url=None, message_type=None):
+    """
+    Drop the campaign's cached media handle if this send failed because of its media.
+
+    Returns:
+        bool: True if the handle was dropped (the caller should resolve again)
+    """
+    if not is_media_rejection(message):
+        return False
+    media_url = media_url or campaign.attachment_url
+    message_type = message_type or campaign.attachment_type
+    forget_campaign_media(campaign.id, message_type, media_url)
+    logger.warning(f"⚠️ Campaign #{campaign.id} media rejected ({message.error_message}); resolving it again")
+    return True
@@ -0,0 +1,139 @@
+"""
+WASender Media Upload Body
+Bounded-memory media uploads to WASender's upload-media-file endpoint.
+
+upload_media_file used to hold the whole file in memory, then its base64
+text, then the JSON payload built from it: about 2.3x the file size in
+Python objects at once, plus another copy when a campaign re-read its temp
+file to pass the bytes in. Uploads now stream:
+
+    source          a file on disk (the campaign's temp upload) is read in
+                    place; a remote URL is downloaded in chunks into a spooled
+                    temporary file (memory up to 1 MB, disk beyond)
+    body            Base64JsonBody yields the JSON payload piece by piece,
+                    base64-encoding fixed-size chunks of the source as they are
+                    sent, with an exact Content-Length so no chunked transfer
+                    encoding is needed; it can be iterated again for the next
+                    upload route or a transport retry
+    ceiling         files larger than WASENDER_MEDIA_UPLOAD_MAX_BYTES are
+                    refused before anything is read or sent
+
+Sending from a public URL (media_resolver) stays the preferred path; an upload
+only happens when WASender cannot fetch the attachment itself.
+
+Settings (all optional):
+    WASENDER_MEDIA_UPLOAD_MAX_BYTES   largest file uploaded to WASender (default 100 MB)
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Multiple of 3 so every chunk encodes to whole base64 quads (no padding mid-stream)
+_ENCODE_CHUNK = 3 * 64 * 1024
+_DOWNLOAD_CHUNK = 256 * 1024
+_SPOOL_IN_MEMORY = 1024 * 1024
+
+
+class MediaTooLarge(Exception):
+    """The media file exceeds WASENDER_MEDIA_UPLOAD_MAX_BYTES"""
+
+
+def upload_size_limit():
+    try:
+        return int(getattr(settings, 'WASENDER_MEDIA_UPLOAD_MAX_BYTES', 100 * 1024 * 1024))
+    except (TypeError, ValueError):
+        return 100 * 1024 * 1024
+
+
+def check_size(size, limit=None):
+    limit = upload_size_limit() if limit is None else limit
+    if limit and size > limit:
+        raise MediaTooLarge(f"Media is {size} bytes, over the {limit} byte upload limit")
+
+
+def download_media(http, url, timeout=60):
+    """
+    Download a URL into a spooled temporary file, enforcing the upload ceiling.
+
+    Returns:
+        tuple: (file object positioned at 0, or None if the response was an error; status code)
+
+    Raises:
+        MediaTooLarge: the response is (or declares itself) over the ceiling
+    """
+    limit = upload_size_limit()
+    with http.get(url, timeout=timeout, allow_redirects=True, stream=True) as resp:
+        if resp.status_code >= 400:
+            return None, resp.status_code
+        declared = resp.headers.get('Content-Length')
+        if declared and declared.isdigit():
+            check_size(int(declared), limit)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_IN_MEMORY)
+        size = 0
+        try:
+            for chunk in resp.iter_content(_DOWNLOAD_CHUNK):
+                size += len(chunk)
+                check_size(size, limit)
+                spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool, resp.status_code
+
+
+class Base64JsonBody:
+    """
+    A JSON request body {..fields, "base64": "<source encoded>"} produced while it is sent.
+
+    Args:
+        source: path of a file on disk, or a seekable binary file object
+        fields: other JSON members, written before the base64 member
+
+    requests sends it with the exact Content-Length from len(); iterating again
+    starts over from the beginning of the source.
+    """
+
+    def __init__(self, source, fields=None):
+        self.source = source
+        if isinstance(source, (str, os.PathLike)):
+            self.size = os.path.getsize(source)
+        else:
+            source.seek(0, os.SEEK_END)
+            self.size = source.tell()
+            source.seek(0)
+
+        head = json.dumps(fields or {})[:-1]
+        if fields:
+            head += ', '
+        self._head = (head + '"base64": "').encode()
+        self._tail = b'"}'
+
+    def __len__(self):
+        return len(self._head) + 4 * ((self.size + 2) // 3) + len(self._tail)
+
+    def _open(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            return open(self.source, 'rb'), True
+        self.source.seek(0)
+        return self.source, False
+
+    def __iter__(self):
+        import base64
+
+        yield self._head
+        f, owned = self._open()
+        try:
+            for chunk in iter(lambda: f.read(_ENCODE_CHUNK), b''):
+                yield base64.b64encode(chunk)
+        finally:
+            if owned:
+                f.close()
+        yield self._tail
@@ -0,0 +1,150 @@
+"""
+Campaign Message Templates
+Compiles a message template once and renders it per contact in a single join.
+
+Templates use ``{field}`` placeholders. A placeholder resolves, in order, to:
+
+    1. the contact's dynamic ``fields`` JSON entry (CSV/XLSX column)
+    2. a legacy Contact column: first_name, last_name, phone, email, custom_field_1..3
+
+Empty values render as ''. A placeholder the contact has no value for at all
+is handled by the template's ``unknown`` policy:
+
+    keep   leave ``{field}`` in the text unchanged (default, historic behaviour)
+    blank  render it as ''
+    error  raise TemplateVariableError
+
+Settings (all optional):
+    WASENDER_TEMPLATE_UNKNOWN_VARIABLES   default unknown-variable policy (default 'keep')
+"""
+
+import re
+from functools import lru_cache
+
+from django.conf import settings
+
+UNKNOWN_KEEP = 'keep'
+UNKNOWN_BLANK = 'blank'
+UNKNOWN_ERROR = 'error'
+UNKNOWN_POLICIES = (UNKNOWN_KEEP, UNKNOWN_BLANK, UNKNOWN_ERROR)
+
+PLACEHOLDER_RE = re.compile(r'\{([^{}\n]+)\}')
+
+# Placeholder name -> Contact attribute, for lists uploaded before dynamic fields
+LEGACY_FIELDS = {
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'phone': 'phone_number',
+    'email': 'email',
+    'custom_field_1': 'custom_field_1',
+    'custom_field_2': 'custom_field_2',
+    'custom_field_3': 'custom_field_3',
+}
+
+_MISSING = object()
+
+
+class TemplateVariableError(ValueError):
+    """Raised under the 'error' policy when a contact has no value for a placeholder"""
+
+    def __init__(self, name):
+        super().__init__(f"No value for template variable {{{name}}}")
+        self.name = name
+
+
+def default_unknown_policy():
+    policy = str(getattr(settings, 'WASENDER_TEMPLATE_UNKNOWN_VARIABLES', UNKNOWN_KEEP)).lower()
+    return policy if policy in UNKNOWN_POLICIES else UNKNOWN_KEEP
+
+
+def _contact_value(contact, fields, name):
+    if name in fields:
+        value = fields[name]
+        return str(value) if value else ''
+    attr = LEGACY_FIELDS.get(name)
+    if attr is not None:
+        return getattr(contact, attr, None) or ''
+    return _MISSING
+
+
+class MessageTemplate:
+    """
+    A template pre-split into literal parts and placeholder slots.
+
+    Usage:
+        template = compile_template(campaign.message_template)
+        text = template.render(contact)
+        texts = template.render_many(contacts)
+    """
+
+    __slots__ = ('source', 'unknown', '_parts', '_slots')
+
+    def __init__(self, source, unknown=UNKNOWN_KEEP):
+        if unknown not in UNKNOWN_POLICIES:
+            raise ValueError(f"Unknown variable policy must be one of {UNKNOWN_POLICIES}, got {unknown!r}")
+        self.source = source or ''
+        self.unknown = unknown
+
+        # Placeholder parts hold their original text so the 'keep' policy needs no work
+        parts = []
+        slots = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(self.source):
+            if match.start() > position:
+                parts.append(self.source[position:match.start()])
+            slots.append((len(parts), match.group(1)))
+            parts.append(match.group(0))
+            position = match.end()
+        if position < len(self.source):
+            parts.append(self.source[position:])
+        self._parts = tuple(parts)
+        self._slots = tuple(slots)
+
+    @property
+    def variables(self):
+        """Placeholder names in order of first appearance"""
+        return list(dict.fromkeys(name for _, name in self._slots))
+
+    def _fill(self, lookup):
+        if not self._slots:
+            return self.source
+        parts = list(self._parts)
+        for index, name in self._slots:
+            value = lookup(name)
+            if value is _MISSING:
+                if self.unknown == UNKNOWN_KEEP:
+                    continue
+                if self.unknown == UNKNOWN_ERROR:
+                    raise TemplateVariableError(name)
+                value = ''
+            parts[index] = value
+        return ''.join(parts)
+
+    def render(self, contact):
+        """Render for a Contact (dynamic fields first, then legacy columns)"""
+        fields = contact.fields or {}
+        return self._fill(lambda name: _contact_value(contact, fields, name))
+
+    def render_values(self, values):
+        """Render from a plain {name: value} mapping, e.g. sample data for previews"""
+        return self._fill(lambda name: (str(values[name]) if values[name] else '') if name in values else _MISSING)
+
+    def render_many(self, contacts):
+        """Render for a sequence of contacts, returning texts in the same order"""
+        return [self.render(contact) for contact in contacts]
+
+
+@lru_cache(maxsize=256)
+def _compile(source, unknown):
+    return MessageTemplate(source, unknown)
+
+
+def compile_template(source, unknown=None):
+    """
+    Return the compiled template for source, cached per process.
+
+    Args:
+        source: Template text with {field} placeholders
+        unknown: 'keep', 'blank' or 'error'; defaults to WASENDER_TEMPLATE_UNKNOWN_VARIABLES
+    """
+    return _compile(source or '', unknown or default_unknown_policy())
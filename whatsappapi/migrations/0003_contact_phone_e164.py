@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+def backfill_phone_e164(apps, schema_editor):
+    """Store the E.164 form of every existing contact's phone number"""
+    from whatsappapi.phone_format import backfill_contact_e164
+
+    backfill_contact_e164(apps.get_model('whatsappapi', 'Contact'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsappapi', '0002_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='phone_e164',
+            field=models.CharField(blank=True, default='', max_length=24),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['contact_list', 'phone_e164'], name='contacts_contact_36c8f3_idx'),
+        ),
+        migrations.RunPython(backfill_phone_e164, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('whatsappapi', '0003_contact_phone_e164'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('attachment_type', models.CharField(max_length=20)),
+                ('size', models.BigIntegerField(default=0)),
+                ('cloudinary_public_id', models.CharField(max_length=300)),
+                ('cloudinary_url', models.URLField(max_length=500)),
+                ('wasender_url', models.URLField(blank=True, default='', max_length=500)),
+                ('wasender_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_assets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Media Asset',
+                'verbose_name_plural': 'Media Assets',
+                'db_table': 'media_assets',
+                'indexes': [
+                    models.Index(fields=['user', 'cloudinary_url'], name='media_asset_user_id_e89a0f_idx'),
+                ],
+                'unique_together': {('user', 'sha256', 'attachment_type')},
+            },
+        ),
+    ]
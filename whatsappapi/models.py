@@ -41,6 +41,8 @@ class Contact(models.Model):
     """
     contact_list = models.ForeignKey(ContactList, on_delete=models.CASCADE, related_name='contacts')
     phone_number = models.CharField(max_length=20, db_index=True)  # With country code (required)
+    # phone_number in E.164 (+digits), computed once at import; what campaigns send to
+    phone_e164 = models.CharField(max_length=24, blank=True, default='')
     
     # Store all CSV fields as JSON (dynamic fields)
     fields = models.JSONField(default=dict, blank=True)  # {'first_name': 'John', 'company': 'ABC Corp', 'city': 'NYC'}
@@ -64,6 +66,17 @@ class Contact(models.Model):
     class Meta:
         db_table = 'contacts'
         unique_together = ['contact_list', 'phone_number']
+        indexes = [
+            models.Index(fields=['contact_list', 'phone_e164']),
+        ]
+    
+    def save(self, *args, **kwargs):
+        from whatsappapi.phone_format import format_e164
+        self.phone_e164 = format_e164(self.phone_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'phone_e164'}
+        super().save(*args, **kwargs)
     
     def __str__(self):
         full_name = f"{self.first_name or ''} {self.last_name or ''}".strip()
@@ -157,3 +170,78 @@ class ModerationIncident(models.Model):
 
     def __str__(self):
         return f"{self.user} - {self.status} ({self.risk_score}) at {self.created_at}"
+
+
+# --- Webhook Ingestion ---
+
+class WebhookEvent(models.Model):
+    """
+    Raw WASender webhook event, queued by the webhook endpoint and processed
+    in batches by the process_webhook_events consumer.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    user_id = models.BigIntegerField(db_index=True)  # From the webhook URL (session isolation)
+    event_type = models.CharField(max_length=64, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    processed = models.BooleanField(null=True)  # Handler result once done
+    error = models.TextField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'webhook_events'
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['status', 'claimed_at']),
+            models.Index(fields=['status', 'processed_at']),
+        ]
+        verbose_name = 'Webhook Event'
+        verbose_name_plural = 'Webhook Events'
+
+    def __str__(self):
+        return f"{self.event_type} for user {self.user_id} ({self.status})"
+
+
+# --- Attachment Assets ---
+
+class MediaAsset(models.Model):
+    """
+    An uploaded campaign attachment, keyed by the SHA-256 of its content.
+    Campaigns that send the same file reuse its Cloudinary and WASender uploads.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='media_assets')
+    sha256 = models.CharField(max_length=64)  # Hex digest of the file content
+    attachment_type = models.CharField(max_length=20)  # image, video, audio, document
+    size = models.BigIntegerField(default=0)  # Bytes
+
+    # Cloudinary copy
+    cloudinary_public_id = models.CharField(max_length=300)
+    cloudinary_url = models.URLField(max_length=500)
+
+    # WASender-hosted copy (documents); these URLs expire
+    wasender_url = models.URLField(max_length=500, blank=True, default='')
+    wasender_expires_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'media_assets'
+        unique_together = ['user', 'sha256', 'attachment_type']
+        indexes = [
+            models.Index(fields=['user', 'cloudinary_url']),
+        ]
+        verbose_name = 'Media Asset'
+        verbose_name_plural = 'Media Assets'
+
+    def __str__(self):
+        return f"{self.attachment_type} {self.sha256[:12]} for {self.user}"
@@ -4,6 +4,9 @@ import time
 import json
 import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
 
 # Prefer Django settings for configuration if available; fall back to env vars
@@ -94,37 +97,128 @@ def _has_shortener_or_messaging_link(urls: List[str]) -> bool:
         return True
 
 
+# ----------------------- Heuristic Rule Sets -----------------------
+#
+# Context checks used around the AI verdict. Each category's patterns are
+# compiled once into a single alternation, and _heuristic_categories() runs
+# them all over a text and remembers the result, so evaluate_content and the
+# checks it calls share one scan per text. Categories stay separate
+# alternations because they overlap ("dm" is both promotion and risky_claim).
+
+_HEURISTIC_RULES: Dict[str, List[str]] = {
+    # Non-violence disclaimers (downgrade AI 'violence' blocks)
+    'non_violence': [
+        r"\bnon[\W_]*violent\b",
+        r"\bavoid\b[^\n]{0,60}\bviolence\b",
+        r"\bavoid\b[^\n]{0,60}\bharm\b",
+        r"\bavoid\b[^\n]{0,60}\bfighting\b",
+        r"\bavoid\b[^\n]{0,60}\bthreats?\b",
+        r"\bno\b[^\n]{0,60}\bharm\b",
+        r"\bno\b[^\n]{0,60}\bfighting\b",
+        r"\bno\b[^\n]{0,60}\bthreats?\b",
+        r"\bfamily[\W_]*friendly\b",
+        r"\bsafe\b[^\n]{0,60}\btone\b",
+    ],
+    # Offer/sale/promotion language
+    'promotion': [
+        r"\bfor\s+sale\b",
+        r"\bavailable\b",
+        r"\bbuy\b",
+        r"\border\b",
+        r"\bprice\b",
+        r"\bdm\b|\bpm\b|\bmessage\s+me\b",
+        r"\blink\b|\bdownload\b|\burl\b",
+        r"\bshipping\b|\bdelivery\b|\bdiscreet\s+shipping\b",
+        r"\bsubscribe\b|\bjoin\b",
+        r"\bcontact\s+now\b|\bcontact\b",
+        r"\bget\s+now\b|\bgrab\b|\boffer\b",
+    ],
+    # Investigation/reporting, medical, news and academic context
+    'reporting': [
+        r"\binform\s+police\b",
+        r"\breport\s+(to\s+)?police\b",
+        r"\breport\s+(to\s+)?authorit(y|ies)\b",
+        r"\binvestigat(e|ion)\b",
+        r"\billegal\s+activit(y|ies)\b",
+        r"\billegal\s+content\b",
+        r"\bneed\s+to\s+inform\b|\bneed\s+inform\b",
+        r"\bcomplain(t)?\b",
+        r"\bevidence\b",
+        r"\bfound\b",
+        r"\bdiscovered?\b",
+        r"\breport\s+(this|it|the)\b",
+        r"\bawareness\b",
+        # Medical context patterns
+        r"\bmedical\s+emergency\b",
+        r"\bemergency\b",
+        r"\btreatment\b",
+        r"\btherapy\b",
+        r"\brehabilitation\b|\brehab\b",
+        r"\bhelpline\b",
+        r"\bsupport\s+group\b",
+        # News/Journalism context patterns
+        r"\binvestigative\b",
+        r"\breaking\s+news\b",
+        r"\bnews\b",
+        r"\bjournalism\b",
+        # Academic/Historical context patterns
+        r"\bmuseum\b",
+        r"\bhistoric(al)?\b",
+        r"\bacademic\b",
+        r"\bstudy\b",
+        r"\bresearch\b",
+        r"\bexhibit(ion)?\b",
+    ],
+    # Banking notice conditions
+    'bank': [r"\b(bank|nbfc|finance|financial\s+services|incred|lender|creditor)\b"],
+    'loan': [r"\b(loan|credit\s+line|home\s+loan|car\s+loan|personal\s+loan|emi|credit|borrowing)\b"],
+    'status': [r"\b(approved|sanctioned|disburs(e|al|ed)|funds\s+on\s+the\s+way|view\s+status|track|statement|receipt|officially)\b"],
+    'amount': [r"[₹\$£€¥]|\b(rs|usd|inr|pound|euro|yen)\b|\d+[,\d]*\s*(thousand|lakh|crore|million|billion)"],
+    # Promotional or scam-like claims that rule out a banking notice
+    'risky_claim': [
+        r"\binstant\b", r"\bguarantee(d)?\b", r"no\s*doc(ument)?s", r"zero\s*docs",
+        r"apply\s*now", r"limited\s*time", r"cheap\s*loan", r"lowest\s*interest\s*now",
+        r"dm\b|\bmessage\s+me\b|\bwhatsapp\b|\btelegram\b|\bcall\s+now\b",  # Exclude generic "contact"
+        r"pay\s*(fee|charges)\s*(first|upfront)", r"processing\s*fee\s*(first|upfront)",
+        r"upi\b|gpay\b|paytm\b|phonepe\b",  # Payment apps (scam indicator)
+    ],
+}
+
+_HEURISTIC_MATCHERS: Tuple[Tuple[str, "re.Pattern"], ...] = tuple(
+    (category, re.compile('|'.join(f"(?:{p})" for p in patterns), re.IGNORECASE))
+    for category, patterns in _HEURISTIC_RULES.items()
+)
+
+
+@lru_cache(maxsize=256)
+def _heuristic_categories(text: str) -> frozenset:
+    """Every heuristic category matching the text (lowercased), computed once per text"""
+    t = (text or '').lower()
+    return frozenset(category for category, matcher in _HEURISTIC_MATCHERS if matcher.search(t))
+
+
 def _is_legitimate_banking_notice(text: str, urls: List[str]) -> bool:
     """Heuristic to detect non-promotional, transactional banking/loan notifications.
 
     Targets messages like: "Loan sanctioned/approved", "Funds on the way",
     "View status", etc., from a bank/NBFC. Reject if promotional/suspicious.
     """
-    t = (text or '').lower()
     try:
         # STRICT mode: require at least 2 of these conditions:
         # 1. Bank/financial entity mention
         # 2. Loan-related keywords
         # 3. Transaction status keywords (approved, funds on way, disbursed)
         # 4. Amount/currency mention (₹, $, USD, INR, etc.)
-        
-        bank_like = bool(re.search(r"\b(bank|nbfc|finance|financial\s+services|incred|lender|creditor)\b", t))
-        loan_like = bool(re.search(r"\b(loan|credit\s+line|home\s+loan|car\s+loan|personal\s+loan|emi|credit|borrowing)\b", t))
-        status_like = bool(re.search(r"\b(approved|sanctioned|disburs(e|al|ed)|funds\s+on\s+the\s+way|view\s+status|track|statement|receipt|officially)\b", t))
-        amount_like = bool(re.search(r"[₹\$£€¥]|\b(rs|usd|inr|pound|euro|yen)\b|\d+[,\d]*\s*(thousand|lakh|crore|million|billion)", t))
+        # REJECT if clearly promotional or scam-like (risky_claim)
+        matched = _heuristic_categories(text)
+        bank_like = 'bank' in matched
+        loan_like = 'loan' in matched
+        status_like = 'status' in matched
+        amount_like = 'amount' in matched
         
         # Count matching conditions
         conditions_met = sum([bank_like, loan_like, status_like, amount_like])
-        
-        # REJECT if clearly promotional or scam-like
-        risky_claims = [
-            r"\binstant\b", r"\bguarantee(d)?\b", r"no\s*doc(ument)?s", r"zero\s*docs",
-            r"apply\s*now", r"limited\s*time", r"cheap\s*loan", r"lowest\s*interest\s*now",
-            r"dm\b|\bmessage\s+me\b|\bwhatsapp\b|\btelegram\b|\bcall\s+now\b",  # Exclude generic "contact"
-            r"pay\s*(fee|charges)\s*(first|upfront)", r"processing\s*fee\s*(first|upfront)",
-            r"upi\b|gpay\b|paytm\b|phonepe\b",  # Payment apps (scam indicator)
-        ]
-        has_risky_claim = any(re.search(p, t, flags=re.IGNORECASE) for p in risky_claims)
+        has_risky_claim = 'risky_claim' in matched
         
         # Link checks: allow if none or all in allowlist, and no shorteners/messaging jumps
         links_ok = _urls_in_finance_allowlist(urls) and (not _has_shortener_or_messaging_link(urls))
@@ -152,27 +246,7 @@ def _has_non_violence_disclaimer(text: str) -> bool:
     Matches common forms such as "non‑violent", "avoid violence/harm/fighting/threats",
     "family-friendly", and similar. Handles punctuation or special hyphens between words.
     """
-    t = (text or '').lower()
-    patterns = [
-        r"\bnon[\W_]*violent\b",
-        r"\bavoid\b[^\n]{0,60}\bviolence\b",
-        r"\bavoid\b[^\n]{0,60}\bharm\b",
-        r"\bavoid\b[^\n]{0,60}\bfighting\b",
-        r"\bavoid\b[^\n]{0,60}\bthreats?\b",
-        r"\bno\b[^\n]{0,60}\bharm\b",
-        r"\bno\b[^\n]{0,60}\bfighting\b",
-        r"\bno\b[^\n]{0,60}\bthreats?\b",
-        r"\bfamily[\W_]*friendly\b",
-        r"\bsafe\b[^\n]{0,60}\btone\b",
-    ]
-    for p in patterns:
-        try:
-            if re.search(p, t, flags=re.IGNORECASE):
-                return True
-        except Exception:
-            # If regex fails, skip and continue
-            continue
-    return False
+    return 'non_violence' in _heuristic_categories(text)
 
 
 def _has_offer_promotion(text: str) -> bool:
@@ -181,27 +255,7 @@ def _has_offer_promotion(text: str) -> bool:
     Examples: for sale, available, buy, order, price, DM, link, download,
     shipping, delivery, subscribe, join, contact now.
     """
-    t = (text or '').lower()
-    patterns = [
-        r"\bfor\s+sale\b",
-        r"\bavailable\b",
-        r"\bbuy\b",
-        r"\border\b",
-        r"\bprice\b",
-        r"\bdm\b|\bpm\b|\bmessage\s+me\b",
-        r"\blink\b|\bdownload\b|\burl\b",
-        r"\bshipping\b|\bdelivery\b|\bdiscreet\s+shipping\b",
-        r"\bsubscribe\b|\bjoin\b",
-        r"\bcontact\s+now\b|\bcontact\b",
-        r"\bget\s+now\b|\bgrab\b|\boffer\b",
-    ]
-    for p in patterns:
-        try:
-            if re.search(p, t, flags=re.IGNORECASE):
-                return True
-        except Exception:
-            continue
-    return False
+    return 'promotion' in _heuristic_categories(text)
 
 
 def _is_reporting_context(text: str) -> bool:
@@ -212,49 +266,7 @@ def _is_reporting_context(text: str) -> bool:
     medical emergency, treatment, therapy, rehabilitation, helpline,
     investigative, breaking news, news, journalism, museum, historical, academic, study, research.
     """
-    t = (text or '').lower()
-    patterns = [
-        r"\binform\s+police\b",
-        r"\breport\s+(to\s+)?police\b",
-        r"\breport\s+(to\s+)?authorit(y|ies)\b",
-        r"\binvestigat(e|ion)\b",
-        r"\billegal\s+activit(y|ies)\b",
-        r"\billegal\s+content\b",
-        r"\bneed\s+to\s+inform\b|\bneed\s+inform\b",
-        r"\bcomplain(t)?\b",
-        r"\bevidence\b",
-        r"\bfound\b",
-        r"\bdiscovered?\b",
-        r"\breport\s+(this|it|the)\b",
-        r"\bawareness\b",
-        # Medical context patterns
-        r"\bmedical\s+emergency\b",
-        r"\bemergency\b",
-        r"\btreatment\b",
-        r"\btherapy\b",
-        r"\brehabilitation\b|\brehab\b",
-        r"\bhelpline\b",
-        r"\bsupport\s+group\b",
-        # News/Journalism context patterns
-        r"\binvestigative\b",
-        r"\breaking\s+news\b",
-        r"\bnews\b",
-        r"\bjournalism\b",
-        # Academic/Historical context patterns
-        r"\bmuseum\b",
-        r"\bhistoric(al)?\b",
-        r"\bacademic\b",
-        r"\bstudy\b",
-        r"\bresearch\b",
-        r"\bexhibit(ion)?\b",
-    ]
-    for p in patterns:
-        try:
-            if re.search(p, t, flags=re.IGNORECASE):
-                return True
-        except Exception:
-            continue
-    return False
+    return 'reporting' in _heuristic_categories(text)
 
 
 def evaluate_content(text: str, attachment_type: str = None) -> Dict:
@@ -271,12 +283,8 @@ def evaluate_content(text: str, attachment_type: str = None) -> Dict:
     # Always use AI moderation (with caching). If AI unavailable, block as fail-safe.
     ai_res = None
     try:
-        cache_key = hashlib.sha256((text or '').encode('utf-8')).hexdigest()
-        ai_res = _ai_cache_get(cache_key)
-        if ai_res is None:
-            ai_res = _ai_evaluate_content(text)
-            if ai_res:
-                _ai_cache_set(cache_key, ai_res)
+        model = _conf('OPENAI_MODERATION_MODEL', 'omni-moderation-latest')
+        ai_res = _cached_ai_call('moderation', model, text, _ai_evaluate_content)
     except Exception:
         ai_res = None
 
@@ -338,7 +346,8 @@ def evaluate_content(text: str, attachment_type: str = None) -> Dict:
     # to catch policy violations not always covered by Moderations.
     if classifier_enabled and (not blocked):
         try:
-            cls = _ai_illicit_trade_classifier(text)
+            model = _conf('OPENAI_CLASSIFIER_MODEL', 'gpt-4o-mini')
+            cls = _cached_ai_call('classifier', model, text, _ai_illicit_trade_classifier)
         except Exception:
             cls = None
         if cls:
@@ -365,8 +374,7 @@ def evaluate_content(text: str, attachment_type: str = None) -> Dict:
             # Context-aware: allow investigative/reporting texts unless promotion language present
             reporting_ctx = _is_reporting_context(normalized)
             promo_lang = _has_offer_promotion(normalized)
-            # Banking notice override — detect legitimate transactional loan/bank messages
-            legit_bank_notice = _is_legitimate_banking_notice(normalized, urls)
+            # Banking notice override uses legit_bank_notice from the early check above
             if illegal and category in hard_block_cats and confidence >= 0.70:
                 if reporting_ctx and not promo_lang:
                     # Treat as contextual mention; do not block
@@ -795,51 +803,136 @@ def _ai_evaluate_deepseek(text: str) -> Optional[Dict]:
         return None
 
 
-# ----------------------- Simple TTL Cache -----------------------
+# ----------------------- Verdict Cache -----------------------
+#
+# Two tiers, keyed by kind (moderation / classifier), model and a hash of the
+# whitespace-normalized text:
+#   1. in-process LRU (OrderedDict; hits move to the end, overflow pops the front)
+#   2. shared Django cache (Redis in production), so one worker's verdict serves
+#      every gunicorn / Django-Q process until it expires
+# Provider failures are cached briefly as {"unavailable": True} so a burst of
+# sends does not hammer a failing provider.
+#
+# Settings / env (all optional):
+#   AI_CACHE_MAX            in-process entries (default 500)
+#   AI_CACHE_TTL            seconds a verdict is reused (default 300)
+#   AI_CACHE_NEGATIVE_TTL   seconds a provider failure is reused (default 30, 0 to disable)
+#   AI_CACHE_SHARED         use the shared Django cache tier (default true)
 
-_AI_CACHE: Dict[str, Tuple[Dict, float, int]] = {}
-_AI_CACHE_MAX = int(str(
-    os.environ.get('AI_CACHE_MAX') if os.environ.get('AI_CACHE_MAX') is not None else (
-        getattr(django_settings, 'AI_CACHE_MAX', '500') if django_settings else '500'
-    )
-))
-_AI_CACHE_TTL = int(str(
-    os.environ.get('AI_CACHE_TTL') if os.environ.get('AI_CACHE_TTL') is not None else (
-        getattr(django_settings, 'AI_CACHE_TTL', '300') if django_settings else '300'
-    )
-))
-_AI_CACHE_SEQ = 0
+# Bump when the mapping of provider output to verdicts changes
+_AI_CACHE_VERSION = 1
 
+_WHITESPACE = re.compile(r"\s+")
 
-def _ai_cache_get(key: str) -> Optional[Dict]:
+
+def _conf(name: str, default: str) -> str:
+    val = os.environ.get(name)
+    if val is None and django_settings is not None:
+        try:
+            val = getattr(django_settings, name, default)
+        except Exception:
+            val = default
+    return str(default if val is None else val)
+
+
+_AI_CACHE: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+_AI_CACHE_LOCK = threading.Lock()
+_AI_CACHE_MAX = int(_conf('AI_CACHE_MAX', '500'))
+_AI_CACHE_TTL = int(_conf('AI_CACHE_TTL', '300'))
+_AI_CACHE_NEGATIVE_TTL = int(_conf('AI_CACHE_NEGATIVE_TTL', '30'))
+_AI_CACHE_SHARED = _conf('AI_CACHE_SHARED', 'true').lower() in {'1', 'true', 'yes'}
+_AI_CACHE_STATS = {'local_hits': 0, 'shared_hits': 0, 'negative_hits': 0, 'misses': 0}
+
+
+def ai_cache_stats() -> Dict[str, int]:
+    """Verdict cache hit/miss counters of this process"""
+    with _AI_CACHE_LOCK:
+        stats = dict(_AI_CACHE_STATS)
+        stats['local_entries'] = len(_AI_CACHE)
+    return stats
+
+
+def _ai_cache_key(kind: str, model: str, text: str) -> str:
+    normalized = _WHITESPACE.sub(' ', text or '').strip()
+    digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    return f"wasender:moderation:v{_AI_CACHE_VERSION}:{kind}:{model}:{digest}"
+
+
+def _shared_cache():
+    if not _AI_CACHE_SHARED:
+        return None
     try:
-        entry = _AI_CACHE.get(key)
-        if not entry:
-            return None
-        value, expiry, _seq = entry
-        if time.time() > expiry:
-            try:
-                del _AI_CACHE[key]
-            except Exception:
-                pass
-            return None
-        return value
+        from django.core.cache import cache
+        return cache
     except Exception:
         return None
 
 
-def _ai_cache_set(key: str, value: Dict) -> None:
-    global _AI_CACHE_SEQ
-    try:
-        _AI_CACHE_SEQ += 1
-        _AI_CACHE[key] = (value, time.time() + _AI_CACHE_TTL, _AI_CACHE_SEQ)
-        # Evict oldest when exceeding max
-        if len(_AI_CACHE) > _AI_CACHE_MAX:
-            # Find oldest by seq
-            oldest_key = min(_AI_CACHE.items(), key=lambda kv: kv[1][2])[0]
-            try:
-                del _AI_CACHE[oldest_key]
-            except Exception:
-                pass
-    except Exception:
-        pass
+def _count(stat: str) -> None:
+    with _AI_CACHE_LOCK:
+        _AI_CACHE_STATS[stat] += 1
+
+
+def _ai_cache_get(key: str) -> Optional[Dict]:
+    """Cached verdict, {"unavailable": True} for a cached provider failure, or None on a miss"""
+    now = time.time()
+    with _AI_CACHE_LOCK:
+        entry = _AI_CACHE.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                _AI_CACHE.move_to_end(key)
+                _AI_CACHE_STATS['negative_hits' if entry[0].get('unavailable') else 'local_hits'] += 1
+                return entry[0]
+            del _AI_CACHE[key]
+
+    shared = _shared_cache()
+    if shared is not None:
+        try:
+            entry = shared.get(key)
+        except Exception:
+            entry = None
+        if entry:
+            value, expiry = entry
+            if expiry > now:
+                _ai_cache_put_local(key, value, expiry)
+                _count('negative_hits' if value.get('unavailable') else 'shared_hits')
+                return value
+
+    _count('misses')
+    return None
+
+
+def _ai_cache_put_local(key: str, value: Dict, expiry: float) -> None:
+    with _AI_CACHE_LOCK:
+        _AI_CACHE[key] = (value, expiry)
+        _AI_CACHE.move_to_end(key)
+        while len(_AI_CACHE) > _AI_CACHE_MAX:
+            _AI_CACHE.popitem(last=False)
+
+
+def _ai_cache_set(key: str, value: Optional[Dict]) -> None:
+    """Cache a verdict; None (provider failure) is cached for AI_CACHE_NEGATIVE_TTL"""
+    ttl = _AI_CACHE_TTL if value else _AI_CACHE_NEGATIVE_TTL
+    if ttl <= 0:
+        return
+    value = value or {"unavailable": True}
+    expiry = time.time() + ttl
+    _ai_cache_put_local(key, value, expiry)
+
+    shared = _shared_cache()
+    if shared is not None:
+        try:
+            shared.set(key, (value, expiry), ttl)
+        except Exception:
+            pass
+
+
+def _cached_ai_call(kind: str, model: str, text: str, call) -> Optional[Dict]:
+    """Run a provider call through the verdict cache; None if the provider failed (now or recently)"""
+    key = _ai_cache_key(kind, model, text)
+    cached = _ai_cache_get(key)
+    if cached is not None:
+        return None if cached.get('unavailable') else cached
+    result = call(text)
+    _ai_cache_set(key, result)
+    return result
@@ -0,0 +1,102 @@
+"""
+Opt-Out Filter
+Matches a whole campaign's contacts against a user's opt-outs in memory.
+
+A number counts as opted out when its last 10 digits equal the last 10 digits
+of an active opt-out (so country-code variants match), or, for numbers shorter
+than 10 digits, when the digits are identical. Both cases reduce to comparing
+optout_suffix() values, which OptOutContact stores in the indexed
+``phone_suffix`` column.
+
+OptOutMatcher loads a user's active suffixes once (one query, cached in the
+Django cache) and answers each contact with a set lookup.
+OptOutContact.add_optout / remove_optout drop the cached set.
+
+Settings (all optional):
+    WASENDER_OPTOUT_CACHE_SECONDS   lifetime of a user's cached suffix set (default 3600)
+"""
+
+import logging
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SUFFIX_DIGITS = 10
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def optout_suffix(phone_number):
+    """Match key of a phone number: its last 10 digits (all digits if shorter)"""
+    return _NON_DIGITS.sub('', phone_number or '')[-SUFFIX_DIGITS:]
+
+
+def _cache_key(user_id):
+    return f"wasender:optout_suffixes:{user_id}"
+
+
+def _ttl():
+    try:
+        return int(getattr(settings, 'WASENDER_OPTOUT_CACHE_SECONDS', 3600))
+    except (TypeError, ValueError):
+        return 3600
+
+
+def forget_optouts(user_id):
+    """Invalidate a user's cached opt-out set (call after any opt-out change)"""
+    try:
+        cache.delete(_cache_key(user_id))
+    except Exception:
+        pass
+
+
+def load_optout_suffixes(user_id):
+    """Active opt-out suffixes for a user, from the cache or one query"""
+    from userpanel.models import OptOutContact
+
+    try:
+        suffixes = cache.get(_cache_key(user_id))
+    except Exception:
+        suffixes = None
+    if suffixes is not None:
+        return suffixes
+
+    suffixes = frozenset(
+        OptOutContact.objects.filter(user_id=user_id, is_active=True)
+        .exclude(phone_suffix='')
+        .values_list('phone_suffix', flat=True)
+    )
+    try:
+        cache.set(_cache_key(user_id), suffixes, _ttl())
+    except Exception:
+        pass
+    return suffixes
+
+
+class OptOutMatcher:
+    """
+    In-memory opt-out check for one user.
+
+    Usage:
+        optouts = OptOutMatcher.for_user(campaign.user_id)
+        allowed = [c for c in contacts if not optouts.matches(c.phone_number)]
+    """
+
+    __slots__ = ('suffixes',)
+
+    def __init__(self, suffixes):
+        self.suffixes = suffixes
+
+    @classmethod
+    def for_user(cls, user_id):
+        return cls(load_optout_suffixes(user_id))
+
+    def __len__(self):
+        return len(self.suffixes)
+
+    def matches(self, phone_number):
+        suffix = optout_suffix(phone_number)
+        return bool(suffix) and suffix in self.suffixes
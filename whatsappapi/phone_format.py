@@ -0,0 +1,77 @@
+"""
+Phone Number Formatting
+E.164 formatting shared by the send path, contact imports and campaign setup.
+
+format_e164 is the single-number form (what WASenderService._format_phone_number
+does); contacts store its result in the indexed ``Contact.phone_e164`` column
+at import time so campaigns, dedupe and retries read it instead of
+reformatting every number on every pass. Bulk imports use the vectorized
+pandas equivalent in contact_import.e164_phones.
+"""
+
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Everything except digits and '+' is stripped, same as the original generator
+_STRIP = re.compile(r'[^\d+]')
+
+
+def format_e164(phone):
+    """
+    Format a phone number for the WASender API: keep digits and '+', ensure a '+' prefix.
+
+    Returns:
+        str: E.164 formatted phone (+1234567890), or '' for no number
+    """
+    if not phone:
+        return ''
+    phone = _STRIP.sub('', str(phone))
+    if not phone.startswith('+'):
+        phone = '+' + phone
+    return phone
+
+
+def contact_e164(contact):
+    """A contact's stored E.164 number, formatted on the fly for rows not yet backfilled"""
+    return contact.phone_e164 or format_e164(contact.phone_number)
+
+
+def backfill_contact_e164(contact_model, batch_size=5000, start_id=0):
+    """
+    Fill phone_e164 for contacts that don't have it yet, in primary-key windows.
+
+    Takes the model class as an argument so migrations can pass the historical model.
+
+    Returns:
+        int: number of contacts updated
+    """
+    last_id = contact_model.objects.order_by('-id').values_list('id', flat=True).first()
+    if not last_id:
+        return 0
+
+    updated = 0
+    window_start = start_id
+    while window_start < last_id:
+        window_end = window_start + batch_size
+        rows = contact_model.objects.filter(
+            id__gt=window_start,
+            id__lte=window_end,
+            phone_e164='',
+        ).values_list('id', 'phone_number')
+
+        contacts = [
+            contact_model(id=contact_id, phone_e164=format_e164(phone_number))
+            for contact_id, phone_number in rows
+            if phone_number
+        ]
+        if contacts:
+            # One CASE ... WHEN UPDATE per window
+            contact_model.objects.bulk_update(contacts, ['phone_e164'])
+            updated += len(contacts)
+
+        window_start = window_end
+        logger.debug(f"Contact E.164 backfill reached contact id {window_start} ({updated} updated)")
+
+    return updated
@@ -0,0 +1,110 @@
+"""
+WASender Session Credentials
+Per-process cache of decrypted session API keys and the shared Fernet cipher.
+
+Every send, presence update, number check and status call used to build a new
+Fernet cipher and decrypt the session's stored token. The cipher is now built
+once per process, and decrypted keys are cached in memory keyed by
+(session id, stored ciphertext), so a rotated token can never be served from
+the cache. Entries expire after WASENDER_CREDENTIAL_CACHE_SECONDS and are
+dropped when the session row is saved or deleted (in this process; other
+processes rely on the ciphertext key and the TTL).
+
+Decrypted keys are only kept in process memory, never in the shared cache.
+
+Settings (all optional):
+    ENCRYPTION_KEY                       Fernet key for stored session tokens
+    WASENDER_CREDENTIAL_CACHE_SECONDS    lifetime of a decrypted key in memory (default 300)
+"""
+
+import logging
+import threading
+import time
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_LOCAL_MAX = 10000
+
+_cipher = None
+_cipher_key = None
+# session id -> (stored ciphertext, decrypted key, expiry on the monotonic clock)
+_credentials = {}
+_lock = threading.Lock()
+
+
+def _ttl():
+    try:
+        return int(getattr(settings, 'WASENDER_CREDENTIAL_CACHE_SECONDS', 300))
+    except (TypeError, ValueError):
+        return 300
+
+
+def get_cipher():
+    """The process-wide Fernet cipher for ENCRYPTION_KEY (rebuilt only if the key changes)"""
+    global _cipher, _cipher_key
+    key = getattr(settings, 'ENCRYPTION_KEY', None)
+    if _cipher is None or key != _cipher_key:
+        with _lock:
+            if _cipher is None or key != _cipher_key:
+                # Without a configured key tokens cannot survive a restart; same as before
+                _cipher = Fernet(key or Fernet.generate_key())
+                _cipher_key = key
+    return _cipher
+
+
+def decrypt_token(encrypted_token):
+    """Decrypt a stored API token, falling back for unencrypted legacy tokens"""
+    if not encrypted_token:
+        return ''
+
+    try:
+        return get_cipher().decrypt(encrypted_token.encode()).decode()
+    except Exception as e:
+        # If decryption fails, token might be plain text or encrypted with old key
+        # Avoid mistakenly sending Fernet ciphertext as a Bearer token.
+        # If the token looks like Fernet ('gAAAAA' prefix), return empty string
+        # so header generation falls back to the personal access token.
+        try:
+            looks_like_fernet = str(encrypted_token).startswith('gAAAAA')
+        except Exception:
+            looks_like_fernet = False
+        logger.warning(f"Token decryption failed; looks_like_fernet={looks_like_fernet}. Error: {str(e)[:50]}")
+        return '' if looks_like_fernet else encrypted_token
+
+
+def session_api_key(session):
+    """A session's decrypted API key, from memory or one decryption"""
+    now = time.monotonic()
+    entry = _credentials.get(session.pk)
+    if entry is not None and entry[0] == session.api_token and entry[2] > now:
+        return entry[1]
+
+    api_key = decrypt_token(session.api_token)
+    if session.pk is not None:
+        with _lock:
+            if len(_credentials) >= _LOCAL_MAX:
+                _credentials.clear()
+            _credentials[session.pk] = (session.api_token, api_key, now + _ttl())
+    return api_key
+
+
+def forget_session_credentials(session_id):
+    """Drop a session's cached key (call after its token changes)"""
+    with _lock:
+        _credentials.pop(session_id, None)
+
+
+@receiver(post_save, sender='userpanel.WASenderSession')
+def _session_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'api_token' in update_fields:
+        forget_session_credentials(instance.pk)
+
+
+@receiver(post_delete, sender='userpanel.WASenderSession')
+def _session_deleted(sender, instance, **kwargs):
+    forget_session_credentials(instance.pk)
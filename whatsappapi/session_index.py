@@ -0,0 +1,261 @@
+"""
+WASender Session Key Index
+Resolves a webhook sessionId (the session API key) to a WASenderSession.
+
+API keys are stored Fernet-encrypted, and Fernet is randomized, so the old
+lookup decrypted every session's token per webhook. Each session now also
+stores a deterministic HMAC-SHA256 of its API key in the indexed
+``api_key_hash`` column, and resolved hashes are mapped to session ids in the
+Django cache (Redis) with a short in-process mirror. Resolution is one indexed
+query no matter how many tenants exist.
+
+Sessions created before the column existed are hashed by the migration; any
+left without a hash are matched by the old decrypt scan once and backfilled.
+When a session's api_token is changed (e.g. in the admin) its hash is
+recomputed on save, and the old mapping is dropped on a change or delete.
+
+Stored hashes depend on the HMAC secret. Set a dedicated
+WASENDER_SESSION_KEY_SECRET so rotating SECRET_KEY leaves them valid. When
+the secret does change anyway, the first lookup that misses under the new
+secret decrypts every session once and rehashes it (see rehash_session_keys),
+after which lookups are indexed again.
+
+Settings (all optional):
+    WASENDER_SESSION_KEY_SECRET        HMAC secret for API key hashes (default SECRET_KEY)
+    WASENDER_SESSION_KEY_CACHE_SECONDS  hash -> session id cache lifetime (default 86400)
+"""
+
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_LOCAL_SECONDS = 60
+_LOCAL_MAX = 10000
+
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _hash_secret():
+    return str(getattr(settings, 'WASENDER_SESSION_KEY_SECRET', None) or settings.SECRET_KEY)
+
+
+def hash_session_key(api_key):
+    """Deterministic keyed hash of a session API key (64 hex chars), '' for no key"""
+    if not api_key:
+        return ''
+    return hmac.new(_hash_secret().encode(), str(api_key).encode(), hashlib.sha256).hexdigest()
+
+
+def _rehash_marker_key():
+    # Identifies the current secret without revealing it
+    fingerprint = hashlib.sha256(b'wasender-session-key:' + _hash_secret().encode()).hexdigest()[:16]
+    return f"wasender:session_key:rehashed:{fingerprint}"
+
+
+def _ttl():
+    try:
+        return int(getattr(settings, 'WASENDER_SESSION_KEY_CACHE_SECONDS', 86400))
+    except (TypeError, ValueError):
+        return 86400
+
+
+def _cache_key(key_hash):
+    return f"wasender:session_key:{key_hash}"
+
+
+def _remember_pk(key_hash, pk):
+    with _local_lock:
+        if len(_local) >= _LOCAL_MAX:
+            _local.clear()
+        _local[key_hash] = (pk, time.monotonic() + _LOCAL_SECONDS)
+    try:
+        cache.set(_cache_key(key_hash), pk, _ttl())
+    except Exception:
+        pass
+
+
+def _cached_pk(key_hash):
+    with _local_lock:
+        entry = _local.get(key_hash)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+    try:
+        pk = cache.get(_cache_key(key_hash))
+    except Exception:
+        pk = None
+    if pk:
+        with _local_lock:
+            _local[key_hash] = (pk, time.monotonic() + _LOCAL_SECONDS)
+    return pk
+
+
+def forget_session_key(key_hash):
+    """Drop a cached mapping (e.g. after a session is deleted or its key rotated)"""
+    with _local_lock:
+        _local.pop(key_hash, None)
+    try:
+        cache.delete(_cache_key(key_hash))
+    except Exception:
+        pass
+
+
+def index_session_key(session, api_key):
+    """Store the hash of a session's plaintext API key on the session row"""
+    key_hash = hash_session_key(api_key)
+    if session.api_key_hash != key_hash:
+        session.api_key_hash = key_hash or None
+        session.save(update_fields=['api_key_hash'])
+    if key_hash:
+        _remember_pk(key_hash, session.pk)
+    return key_hash
+
+
+def _scan_unindexed(queryset, api_key, key_hash):
+    """Legacy decrypt scan, limited to sessions that have no hash yet; backfills on match"""
+    from django.db.models import Q
+    from whatsappapi.session_credentials import session_api_key
+
+    for s in queryset.filter(Q(api_key_hash__isnull=True) | Q(api_key_hash='')):
+        try:
+            decrypted = session_api_key(s)
+        except Exception:
+            continue
+        if decrypted:
+            # Backfill every row we had to decrypt so the scan shrinks to nothing
+            s.api_key_hash = hash_session_key(decrypted)
+            s.save(update_fields=['api_key_hash'])
+            if decrypted == api_key:
+                logger.info(f"🔑 Indexed API key hash for session {s.session_id} on first webhook")
+                _remember_pk(key_hash, s.pk)
+                return s
+    return None
+
+
+def rehash_session_keys():
+    """
+    Recompute every session's api_key_hash under the current secret (decrypts each session once).
+
+    Returns:
+        int: number of sessions whose hash changed
+    """
+    from userpanel.models import WASenderSession
+    from whatsappapi.session_credentials import session_api_key
+
+    changed = 0
+    for s in WASenderSession.objects.exclude(api_token='').iterator():
+        try:
+            key_hash = hash_session_key(session_api_key(s)) or None
+        except Exception:
+            continue
+        if s.api_key_hash != key_hash:
+            WASenderSession.objects.filter(pk=s.pk).update(api_key_hash=key_hash)
+            changed += 1
+    if changed:
+        logger.warning(f"🔑 Rehashed {changed} session API key hash(es) after a secret change")
+    return changed
+
+
+def _rehash_once_per_secret():
+    """Run rehash_session_keys the first time a lookup misses under the current secret"""
+    try:
+        first = cache.add(_rehash_marker_key(), 1, None)
+    except Exception:
+        return False
+    if not first:
+        return False
+    try:
+        return rehash_session_keys() > 0
+    except Exception as e:
+        logger.error(f"❌ Rehashing session API keys failed: {e}")
+        try:
+            cache.delete(_rehash_marker_key())
+        except Exception:
+            pass
+        return False
+
+
+def resolve_session(api_key, queryset=None):
+    """
+    Find the session whose API key equals api_key.
+
+    Args:
+        api_key: Webhook sessionId (the session API key)
+        queryset: Optional WASenderSession queryset to restrict the search
+                  (e.g. filtered by the webhook URL's user_id)
+
+    Returns:
+        WASenderSession or None
+    """
+    from userpanel.models import WASenderSession
+
+    if not api_key:
+        return None
+    if queryset is None:
+        queryset = WASenderSession.objects.all()
+
+    key_hash = hash_session_key(api_key)
+    pk = _cached_pk(key_hash)
+    if pk:
+        session = queryset.filter(pk=pk, api_key_hash=key_hash).first()
+        if session:
+            return session
+
+    session = queryset.filter(api_key_hash=key_hash).first()
+    if session:
+        _remember_pk(key_hash, session.pk)
+        return session
+
+    session = _scan_unindexed(queryset, api_key, key_hash)
+    if session:
+        return session
+
+    # Stored hashes may predate a secret change (e.g. a rotated SECRET_KEY)
+    if _rehash_once_per_secret():
+        session = queryset.filter(api_key_hash=key_hash).first()
+        if session:
+            _remember_pk(key_hash, session.pk)
+        return session
+    return None
+
+
+
+# ==================== Keep hashes in step with api_token ====================
+
+@receiver(pre_save, sender='userpanel.WASenderSession')
+def _session_saving(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'api_token' not in update_fields:
+        return
+    previous = None
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).values('api_token', 'api_key_hash').first()
+    if previous is None or previous['api_token'] != instance.api_token:
+        # post_save re-indexes; the old hash (if any) is dropped there
+        instance._previous_api_key_hash = (previous or {}).get('api_key_hash') or ''
+
+
+@receiver(post_save, sender='userpanel.WASenderSession')
+def _session_saved(sender, instance, **kwargs):
+    if not hasattr(instance, '_previous_api_key_hash'):
+        return
+    old_hash = instance.__dict__.pop('_previous_api_key_hash')
+    from whatsappapi.session_credentials import decrypt_token
+
+    new_hash = index_session_key(instance, decrypt_token(instance.api_token))
+    if old_hash and old_hash != new_hash:
+        forget_session_key(old_hash)
+
+
+@receiver(post_delete, sender='userpanel.WASenderSession')
+def _session_deleted(sender, instance, **kwargs):
+    if instance.api_key_hash:
+        forget_session_key(instance.api_key_hash)
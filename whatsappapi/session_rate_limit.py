@@ -0,0 +1,307 @@
+"""
+WASender Session Rate Limiter
+Atomic per-session send spacing and daily/monthly quotas shared by all workers.
+
+WASenderSession.can_send_message used to decide from the session object in
+hand (possibly stale, and resetting the daily count with a write), and
+increment_message_count wrote four columns after every send, so two workers
+sending on one session could both pass the WASENDER_SEND_DELAY_SECONDS check.
+The limiter state now lives in Redis, one hash per session:
+
+    acquire_send    one Lua script: deny if the daily/monthly quota is used up
+                    or the spacing window is still open, otherwise reserve the
+                    slot by stamping the send time (check and stamp are atomic)
+    record_sent     one Lua script: count a successful send, rolling the day
+                    and month over as needed
+    sync            the counts are written back to the session row for display
+                    at most every WASENDER_RATE_LIMIT_SYNC_SECONDS per session
+                    (and by manage.py sync_session_usage)
+
+A missing hash (first use, Redis flushed) is seeded from the session row.
+Without a Redis client the Django cache stands in: cache.add for the spacing
+window and cache.incr for the counters, which is atomic on memcached/Redis
+backends and good enough for local development.
+
+Settings (all optional):
+    WASENDER_SEND_DELAY_SECONDS          spacing between sends with account protection (default 5)
+    WASENDER_MONTHLY_MESSAGE_LIMIT       sends per session per month, 0 for no limit (default 0)
+    WASENDER_RATE_LIMIT_REDIS_URL        Redis for the limiter (default: the Django cache's Redis client)
+    WASENDER_RATE_LIMIT_SYNC_SECONDS     how often counts are written back to the session row (default 30)
+"""
+
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Daily limits by account protection (720 msg/hr and 15360 msg/hr over 24 hours)
+DAILY_LIMIT_PROTECTED = 17280
+DAILY_LIMIT_UNPROTECTED = 368640
+
+# Limiter state outlives a month so the monthly count survives idle sessions
+_STATE_SECONDS = 40 * 24 * 3600
+
+_ACQUIRE = """
+local key = KEYS[1]
+local now, spacing = tonumber(ARGV[1]), tonumber(ARGV[2])
+local daily_limit, monthly_limit = tonumber(ARGV[3]), tonumber(ARGV[4])
+local day, month = ARGV[5], ARGV[6]
+if redis.call('EXISTS', key) == 0 then
+    redis.call('HSET', key, 'last_ms', ARGV[7], 'day', ARGV[8], 'day_count', ARGV[9], 'month', month, 'month_count', ARGV[10])
+end
+local h = redis.call('HMGET', key, 'last_ms', 'day', 'day_count', 'month', 'month_count')
+local day_count = 0
+if h[2] == day then day_count = tonumber(h[3]) or 0 end
+local month_count = 0
+if h[4] == month then month_count = tonumber(h[5]) or 0 end
+if daily_limit > 0 and day_count >= daily_limit then return {-1, 0} end
+if monthly_limit > 0 and month_count >= monthly_limit then return {-2, 0} end
+local wait = (tonumber(h[1]) or 0) + spacing - now
+if spacing > 0 and wait > 0 then return {0, wait} end
+redis.call('HSET', key, 'last_ms', now)
+redis.call('EXPIRE', key, ARGV[11])
+return {1, 0}
+"""
+
+_RECORD = """
+local key = KEYS[1]
+local day, month = ARGV[2], ARGV[3]
+local h = redis.call('HMGET', key, 'day', 'month')
+if h[1] ~= day then redis.call('HSET', key, 'day', day, 'day_count', 0) end
+if h[2] ~= month then redis.call('HSET', key, 'month', month, 'month_count', 0) end
+local day_count = redis.call('HINCRBY', key, 'day_count', 1)
+local month_count = redis.call('HINCRBY', key, 'month_count', 1)
+redis.call('HSET', key, 'sent_ms', ARGV[1])
+redis.call('EXPIRE', key, ARGV[4])
+return {day_count, month_count}
+"""
+
+_client = None
+_client_resolved = False
+_scripts = {}
+_client_lock = threading.Lock()
+
+_last_synced = {}
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _redis_client():
+    """Redis client for the limiter: the configured URL, else the Django cache's own client, else None"""
+    global _client, _client_resolved
+    if _client_resolved:
+        return _client
+    with _client_lock:
+        if _client_resolved:
+            return _client
+        client = None
+        try:
+            url = getattr(settings, 'WASENDER_RATE_LIMIT_REDIS_URL', None)
+            if url:
+                import redis
+                client = redis.Redis.from_url(url)
+            elif hasattr(cache, '_cache') and hasattr(cache._cache, 'get_client'):
+                # django.core.cache.backends.redis.RedisCache
+                client = cache._cache.get_client(write=True)
+            elif hasattr(cache, 'client') and hasattr(cache.client, 'get_client'):
+                # django-redis
+                client = cache.client.get_client(write=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Rate limiter Redis unavailable, using the cache stand-in: {e}")
+            client = None
+        if client is not None:
+            _scripts['acquire'] = client.register_script(_ACQUIRE)
+            _scripts['record'] = client.register_script(_RECORD)
+        _client = client
+        _client_resolved = True
+        return _client
+
+
+def _state_key(session_id):
+    return f"wasender:ratelimit:{session_id}"
+
+
+def _periods(now):
+    return now.strftime('%Y%m%d'), now.strftime('%Y%m')
+
+
+def _to_ms(dt):
+    return int(dt.timestamp() * 1000) if dt else 0
+
+
+def daily_limit(session):
+    return DAILY_LIMIT_PROTECTED if session.account_protection_enabled else DAILY_LIMIT_UNPROTECTED
+
+
+def send_spacing_seconds(session):
+    """Minimum time between two sends on a session (only with account protection)"""
+    if not session.account_protection_enabled:
+        return 0
+    return _setting('WASENDER_SEND_DELAY_SECONDS', 5)
+
+
+def acquire_send(session):
+    """
+    Atomically check a session's quotas and spacing and reserve the next send slot.
+
+    Returns:
+        tuple: (allowed, error message or None)
+    """
+    now = timezone.now()
+    day, month = _periods(now)
+    spacing = send_spacing_seconds(session)
+    monthly_limit = _setting('WASENDER_MONTHLY_MESSAGE_LIMIT', 0)
+
+    client = _redis_client()
+    try:
+        if client is not None:
+            seed_day = session.last_reset_date.strftime('%Y%m%d') if session.last_reset_date else day
+            allowed, wait_ms = _scripts['acquire'](
+                keys=[_state_key(session.pk)],
+                args=[
+                    _to_ms(now), int(spacing * 1000), daily_limit(session), monthly_limit, day, month,
+                    _to_ms(session.last_message_at), seed_day, session.messages_sent_today,
+                    session.messages_sent_this_month, _STATE_SECONDS,
+                ],
+            )
+        else:
+            allowed, wait_ms = _acquire_from_cache(session, day, month, spacing, monthly_limit)
+    except Exception as e:
+        # Never block sending on a limiter outage; campaign pacing still applies
+        logger.warning(f"⚠️ Rate limiter unavailable for session {session.pk}, allowing send: {e}")
+        return True, None
+
+    allowed = int(allowed)
+    if allowed == -1:
+        return False, "Daily message limit reached"
+    if allowed == -2:
+        return False, "Monthly message limit reached"
+    if allowed == 0:
+        return False, f"Wait {math.ceil(int(wait_ms) / 1000)} seconds before next message"
+    return True, None
+
+
+def record_sent(session):
+    """Count a successful send against the session's quotas (no database write on the hot path)"""
+    now = timezone.now()
+    day, month = _periods(now)
+    client = _redis_client()
+    try:
+        if client is not None:
+            _scripts['record'](keys=[_state_key(session.pk)], args=[_to_ms(now), day, month, _STATE_SECONDS])
+        else:
+            _record_in_cache(session, day, month, now)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not count send for session {session.pk}: {e}")
+        return
+
+    session.last_message_at = now
+    if time.monotonic() - _last_synced.get(session.pk, 0) >= _setting('WASENDER_RATE_LIMIT_SYNC_SECONDS', 30):
+        sync_session_usage([session.pk])
+
+
+# ==================== Cache stand-in ====================
+
+def _cache_keys(session_id, day, month):
+    base = _state_key(session_id)
+    return f"{base}:spacing", f"{base}:day:{day}", f"{base}:month:{month}", f"{base}:sent"
+
+
+def _acquire_from_cache(session, day, month, spacing, monthly_limit):
+    spacing_key, day_key, month_key, _ = _cache_keys(session.pk, day, month)
+    today = timezone.now().date()
+    cache.add(day_key, session.messages_sent_today if session.last_reset_date == today else 0, 2 * 24 * 3600)
+    cache.add(month_key, session.messages_sent_this_month, _STATE_SECONDS)
+
+    if cache.get(day_key, 0) >= daily_limit(session):
+        return -1, 0
+    if monthly_limit and cache.get(month_key, 0) >= monthly_limit:
+        return -2, 0
+    if spacing and not cache.add(spacing_key, 1, math.ceil(spacing)):
+        return 0, int(spacing * 1000)
+    return 1, 0
+
+
+def _record_in_cache(session, day, month, now):
+    _, day_key, month_key, sent_key = _cache_keys(session.pk, day, month)
+    for key, ttl in ((day_key, 2 * 24 * 3600), (month_key, _STATE_SECONDS)):
+        cache.add(key, 0, ttl)
+        cache.incr(key)
+    cache.set(sent_key, _to_ms(now), _STATE_SECONDS)
+
+
+# ==================== Sync back to the session rows ====================
+
+def session_usage(session_id):
+    """
+    Limiter counts for a session.
+
+    Returns:
+        dict: today, this_month, last_message_at (None if unknown) or None when no state exists
+    """
+    now = timezone.now()
+    day, month = _periods(now)
+    client = _redis_client()
+    if client is not None:
+        h = client.hmget(_state_key(session_id), 'day', 'day_count', 'month', 'month_count', 'sent_ms')
+        if not any(h):
+            return None
+        h = [value.decode() if isinstance(value, bytes) else value for value in h]
+        today = int(h[1] or 0) if h[0] == day else 0
+        this_month = int(h[3] or 0) if h[2] == month else 0
+        sent_ms = int(h[4] or 0)
+    else:
+        _, day_key, month_key, sent_key = _cache_keys(session_id, day, month)
+        values = cache.get_many([day_key, month_key, sent_key])
+        if not values:
+            return None
+        today = values.get(day_key, 0)
+        this_month = values.get(month_key, 0)
+        sent_ms = values.get(sent_key, 0)
+
+    last_message_at = datetime.fromtimestamp(sent_ms / 1000, tz=dt_timezone.utc) if sent_ms else None
+    return {'today': today, 'this_month': this_month, 'last_message_at': last_message_at}
+
+
+def sync_session_usage(session_ids):
+    """
+    Write limiter counts back to WASenderSession rows for display.
+
+    Returns:
+        int: number of sessions updated
+    """
+    from userpanel.models import WASenderSession
+
+    synced = 0
+    today = timezone.now().date()
+    for session_id in session_ids:
+        _last_synced[session_id] = time.monotonic()
+        try:
+            usage = session_usage(session_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read limiter state for session {session_id}: {e}")
+            continue
+        if usage is None:
+            continue
+        fields = {
+            'messages_sent_today': usage['today'],
+            'messages_sent_this_month': usage['this_month'],
+            'last_reset_date': today,
+        }
+        if usage['last_message_at']:
+            fields['last_message_at'] = usage['last_message_at']
+            fields['last_activity_at'] = usage['last_message_at']
+        synced += WASenderSession.objects.filter(id=session_id).update(**fields)
+    return synced
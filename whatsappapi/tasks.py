@@ -8,14 +8,45 @@ import random
 from datetime import timedelta
 from django.utils import timezone
 from django.conf import settings
-from userpanel.models import WASenderCampaign, WASenderSession, WASenderMessage, OptOutContact
+from userpanel.models import WASenderCampaign, WASenderSession, WASenderMessage
 from whatsappapi.models import Contact
 from django.db.models import Q
-from whatsappapi.wasender_service import WASenderService
+from whatsappapi.wasender_service import get_wasender_service
+from whatsappapi.campaign_engine import CampaignSendEngine
+from whatsappapi.campaign_counters import reconcile_campaign_counters
+from whatsappapi.campaign_progress import publish_progress
+from whatsappapi.campaign_recipients import mark_recipients, release_unsent_claims, snapshot_recipients
+from whatsappapi.media_assets import (
+    asset_folder, file_sha256, find_asset, hosted_url, record_asset, remember_wasender_url
+)
+from whatsappapi.optout_filter import OptOutMatcher
+from whatsappapi.phone_format import contact_e164
+from whatsappapi.campaign_control import CONTROL_RUN, publish_control, is_pause_requested
 
 logger = logging.getLogger(__name__)
 
 
+def campaign_scheduler_enabled():
+    """True when campaigns are run by the shared asyncio scheduler instead of Django-Q workers"""
+    return bool(getattr(settings, 'WASENDER_CAMPAIGN_SCHEDULER', False))
+
+
+class CampaignRun:
+    """A claimed and prepared campaign: everything the send phase needs"""
+
+    def __init__(self, campaign, service, session, contacts, processed_phones):
+        self.campaign = campaign
+        self.service = service
+        self.session = session
+        self.contacts = contacts
+        self.processed_phones = processed_phones
+
+    @property
+    def batched(self):
+        """Batch processing only if Advanced Controls enabled with batching"""
+        return self.campaign.use_advanced_controls and self.campaign.batch_size_max > 0
+
+
 def send_campaign_async(campaign_id):
     """
     Background task to send WhatsApp campaign messages
@@ -26,79 +57,144 @@ def send_campaign_async(campaign_id):
     Returns:
         dict: Campaign results (sent_count, failed_count)
     """
+    if campaign_scheduler_enabled():
+        # The campaign stays pending; the scheduler claims it on its next poll
+        logger.info(f"Campaign {campaign_id} handed to the campaign scheduler")
+        return {'campaign_id': campaign_id, 'status': 'scheduled'}
+
     try:
-        # Close stale database connections to ensure fresh data
-        from django.db import close_old_connections
-        close_old_connections()
-        
-        # Get campaign with retry (handles race condition where task starts before DB commit)
-        campaign = None
-        for attempt in range(5):  # Try up to 5 times
-            try:
-                campaign = WASenderCampaign.objects.get(id=campaign_id)
-                break
-            except WASenderCampaign.DoesNotExist:
-                if attempt < 4:
-                    logger.warning(f"Campaign {campaign_id} not found on attempt {attempt + 1}, retrying in 1s...")
-                    time.sleep(1)
-                    close_old_connections()  # Refresh connection
-                else:
-                    raise  # Re-raise on final attempt
-        
-        if not campaign:
-            raise WASenderCampaign.DoesNotExist(f"Campaign {campaign_id} not found after 5 attempts")
+        campaign = claim_campaign(campaign_id)
+        if isinstance(campaign, dict):
+            return campaign
+
+        run = prepare_campaign_run(campaign)
+        if isinstance(run, dict):
+            return run
+
+        if run.batched:
+            return _send_batched(run)
+        return _send_standard(run)
         
-        # Prevent duplicate execution - check if already running
-        if campaign.status == 'running':
-            # Check if it's been running for too long (stuck)
-            if campaign.started_at and (timezone.now() - campaign.started_at) > timedelta(hours=1):
-                logger.warning(f"Campaign {campaign_id} appears stuck, forcing completion")
-                campaign.status = 'completed'
-                campaign.completed_at = timezone.now()
-                campaign.save()
-                return {'status': 'completed', 'message': 'Campaign was stuck and has been completed'}
+    except WASenderCampaign.DoesNotExist:
+        logger.error(f"Campaign {campaign_id} not found")
+        return {'error': 'Campaign not found'}
+    
+    except Exception as e:
+        return fail_campaign(campaign_id, e)
+
+
+def fail_campaign(campaign_id, error):
+    """Mark a campaign failed after an unexpected error in its run"""
+    logger.error(f"Campaign {campaign_id} failed with error: {error}")
+    try:
+        campaign = WASenderCampaign.objects.get(id=campaign_id)
+        campaign.status = 'failed'
+        campaign.save(update_fields=['status', 'updated_at'])
+        publish_progress(campaign.id, campaign.user_id, message=str(error))
+    except:
+        pass
+    return {'error': str(error)}
+
+
+def claim_campaign(campaign_id):
+    """
+    Load a campaign and atomically move it from pending to running
+    
+    Returns:
+        WASenderCampaign now owned by the caller, or a result dict when it must not run
+    """
+    # Close stale database connections to ensure fresh data
+    from django.db import close_old_connections
+    close_old_connections()
+    
+    # Get campaign with retry (handles race condition where task starts before DB commit)
+    campaign = None
+    for attempt in range(5):  # Try up to 5 times
+        try:
+            campaign = WASenderCampaign.objects.get(id=campaign_id)
+            break
+        except WASenderCampaign.DoesNotExist:
+            if attempt < 4:
+                logger.warning(f"Campaign {campaign_id} not found on attempt {attempt + 1}, retrying in 1s...")
+                time.sleep(1)
+                close_old_connections()  # Refresh connection
             else:
-                logger.warning(f"DUPLICATE TASK DETECTED: Campaign {campaign_id} is already running, aborting duplicate execution")
-                return {'status': 'already_running', 'message': 'Campaign is already running'}
-        
-        # CRITICAL: Atomically transition to running to prevent race conditions
-        # This UPDATE will only succeed if status is 'pending'
-        from django.db import transaction
-        with transaction.atomic():
-            # Lock the row for update
-            campaign_locked = WASenderCampaign.objects.select_for_update().get(id=campaign_id)
+                raise  # Re-raise on final attempt
+
+    if not campaign:
+        raise WASenderCampaign.DoesNotExist(f"Campaign {campaign_id} not found after 5 attempts")
+
+    # Prevent duplicate execution - check if already running
+    if campaign.status == 'running':
+        # Check if it's been running for too long (stuck)
+        if campaign.started_at and (timezone.now() - campaign.started_at) > timedelta(hours=1):
+            logger.warning(f"Campaign {campaign_id} appears stuck, forcing completion")
+            campaign.status = 'completed'
+            campaign.completed_at = timezone.now()
+            campaign.save()
+            return {'status': 'completed', 'message': 'Campaign was stuck and has been completed'}
+        else:
+            logger.warning(f"DUPLICATE TASK DETECTED: Campaign {campaign_id} is already running, aborting duplicate execution")
+            return {'status': 'already_running', 'message': 'Campaign is already running'}
+
+    # CRITICAL: Atomically transition to running to prevent race conditions
+    # This UPDATE will only succeed if status is 'pending'
+    from django.db import transaction
+    with transaction.atomic():
+        # Lock the row for update
+        campaign_locked = WASenderCampaign.objects.select_for_update().get(id=campaign_id)
+
+        # Only start campaigns that are pending
+        if campaign_locked.status != 'pending':
+            logger.warning(f"Campaign {campaign_id} status is '{campaign_locked.status}', not 'pending'. Skipping.")
+            return {'status': campaign_locked.status, 'message': f'Campaign status is {campaign_locked.status}, not pending'}
+
+        # Set to running
+        campaign_locked.status = 'running'
+        campaign_locked.started_at = timezone.now()
+        campaign_locked.save(update_fields=['status', 'started_at'])
+        logger.info(f"Campaign {campaign_id} status changed: pending → running")
+
+    # Clear any pause left on the control channel from a previous run
+    publish_control(campaign_id, CONTROL_RUN)
+
+    campaign.refresh_from_db()
+    return campaign
+
+
+def _upload_pending_attachment(campaign):
+    """
+    Move a temp-file attachment to Cloudinary (and WASender for documents)
+    
+    Returns:
+        None on success, or an error result dict after marking the campaign failed
+    """
+    # Upload attachment if temp file exists (stored in attachment_url temporarily)
+    temp_file_path = None
+    original_filename = None
+    
+    # Check if attachment_url is a local file path (new campaigns) vs Cloudinary URL (old campaigns)
+    if campaign.attachment_type and campaign.attachment_url:
+        # If it's a local file path that exists, upload it
+        if os.path.exists(campaign.attachment_url):
+            temp_file_path = campaign.attachment_url
+            original_filename = campaign.attachment_public_id or 'file'
             
-            # Only start campaigns that are pending
-            if campaign_locked.status != 'pending':
-                logger.warning(f"Campaign {campaign_id} status is '{campaign_locked.status}', not 'pending'. Skipping.")
-                return {'status': campaign_locked.status, 'message': f'Campaign status is {campaign_locked.status}, not pending'}
+            logger.info(f"Uploading attachment from temp: {temp_file_path}")
             
-            # Set to running
-            campaign_locked.status = 'running'
-            campaign_locked.started_at = timezone.now()
-            campaign_locked.save(update_fields=['status', 'started_at'])
-            logger.info(f"Campaign {campaign_id} status changed: pending → running")
-        
-        campaign.refresh_from_db()
-        
-        logger.info(f"Starting background campaign: {campaign.name} (ID: {campaign_id})")
-        
-        # Upload attachment if temp file exists (stored in attachment_url temporarily)
-        temp_file_path = None
-        original_filename = None
-        
-        # Check if attachment_url is a local file path (new campaigns) vs Cloudinary URL (old campaigns)
-        if campaign.attachment_type and campaign.attachment_url:
-            # If it's a local file path that exists, upload it
-            if os.path.exists(campaign.attachment_url):
-                temp_file_path = campaign.attachment_url
-                original_filename = campaign.attachment_public_id or 'file'
+            try:
+                import cloudinary.uploader
                 
-                logger.info(f"Uploading attachment from temp: {temp_file_path}")
+                # Same content already uploaded by this user? Reuse it instead of uploading again
+                sha256, size = file_sha256(temp_file_path)
+                asset = find_asset(campaign.user_id, sha256, campaign.attachment_type)
                 
-                try:
-                    import cloudinary.uploader
-                    
+                if asset is not None:
+                    campaign.attachment_url = asset.cloudinary_url
+                    campaign.attachment_public_id = asset.cloudinary_public_id
+                    campaign.save(update_fields=['attachment_url', 'attachment_public_id'])
+                    logger.info(f"♻️ Attachment already uploaded ({sha256[:12]}), reusing: {campaign.attachment_url}")
+                else:
                     # Determine resource type
                     if campaign.attachment_type == 'image':
                         resource_type = 'image'
@@ -127,7 +223,7 @@ def send_campaign_async(campaign_id):
                     with open(temp_file_path, 'rb') as f:
                         upload_result = cloudinary.uploader.upload(
                             f,
-                            folder=f"wa_campaigns/{campaign.user.id}",
+                            folder=asset_folder(campaign.user_id, sha256),
                             resource_type=resource_type,
                             type='upload',
                             access_mode='public',
@@ -141,776 +237,422 @@ def send_campaign_async(campaign_id):
                     campaign.attachment_url = upload_result['secure_url']
                     campaign.attachment_public_id = upload_result.get('public_id')
                     campaign.save(update_fields=['attachment_url', 'attachment_public_id'])
+                    asset = record_asset(
+                        campaign.user_id, sha256, campaign.attachment_type, size,
+                        campaign.attachment_public_id, campaign.attachment_url
+                    )
                     
                     logger.info(f"Attachment uploaded to Cloudinary: {campaign.attachment_url}")
-                    
-                    # Pre-upload to WASender if needed (for documents)
-                    if campaign.attachment_type == 'document':
-                        try:
-                            import requests
-                            head = requests.head(campaign.attachment_url, timeout=10, allow_redirects=True)
+                
+                # Pre-upload to WASender if needed (for documents)
+                if campaign.attachment_type == 'document':
+                    try:
+                        wasender_url = hosted_url(asset)
+                        if wasender_url:
+                            logger.info(f"♻️ Reusing WASender-hosted document: {wasender_url}")
+                        else:
+                            from whatsappapi.wasender_transport import get_http_session
+                            head = get_http_session().head(campaign.attachment_url, timeout=10, allow_redirects=True)
                             if head.status_code >= 400:
-                                # Read file bytes
-                                with open(temp_file_path, 'rb') as f:
-                                    file_bytes = f.read()
-                                
-                                # Pre-upload to WASender
-                                ws = WASenderService()
+                                # Pre-upload to WASender, streamed from the temp file
+                                ws = get_wasender_service()
                                 wasender_url = ws.upload_media_file(
                                     session=campaign.session,
                                     media_url=campaign.attachment_url,
                                     message_type='document',
                                     filename=original_filename,
                                     public_id=campaign.attachment_public_id,
-                                    file_bytes=file_bytes
+                                    file_path=temp_file_path
                                 )
                                 if wasender_url:
-                                    campaign.wasender_document_url = wasender_url
-                                    campaign.save(update_fields=['wasender_document_url'])
+                                    remember_wasender_url(campaign.user_id, campaign.attachment_url, wasender_url)
                                     logger.info(f"Document pre-uploaded to WASender: {wasender_url}")
-                        except Exception as e:
-                            logger.warning(f"WASender pre-upload failed: {e}")
-                    
-                    # Delete temp file
-                    try:
-                        os.remove(temp_file_path)
-                        logger.info(f"Temp file deleted: {temp_file_path}")
-                    except Exception as e:
-                        logger.warning(f"Failed to delete temp file: {e}")
-                        
-                except Exception as e:
-                    logger.error(f"Failed to upload attachment in background: {e}")
-                    # Mark campaign as failed
-                    campaign.status = 'failed'
-                    campaign.save(update_fields=['status'])
-                    return {'error': f'Attachment upload failed: {str(e)}'}
-            else:
-                # attachment_url is already a Cloudinary URL (old campaign), skip upload
-                logger.info(f"Attachment already uploaded: {campaign.attachment_url}")
-        
-        # Get contacts from contact list
-        contact_list = campaign.contact_list
-        if not contact_list:
-            logger.error(f"Campaign {campaign_id} has no contact list")
-            campaign.status = 'failed'
-            campaign.save()
-            return {'error': 'No contact list'}
-        
-        # CRITICAL: Verify session is still connected before starting
-        # Use safe status check with session-specific API key (not personal access token)
-        # This avoids triggering global session refresh that could disconnect other sessions
-        session = campaign.session
-        if not session:
-            error_msg = 'No session assigned to campaign'
-            logger.error(f"Campaign {campaign_id} has no session")
-            campaign.status = 'failed'
-            campaign.save()
-            return {'error': error_msg}
-        
-        # Initialize service for sending messages
-        service = WASenderService()
-        
-        # Safe API status check using session-specific key (recommended by WASender support)
-        is_connected, api_status, error = service.check_session_status_safe(session)
-        
-        if not is_connected:
-            error_msg = f'Session not connected (API status: {api_status}, error: {error})'
-            logger.error(f"Campaign {campaign_id} session check failed: {error_msg}")
-            campaign.status = 'failed'
-            campaign.save()
-            return {'error': error_msg}
-        
-        logger.info(f"✅ Session {session.session_id} verified via API (status: {api_status})")
-        logger.info(f"📱 Session phone: {session.connected_phone_number or session.phone_number}")
-        logger.info(f"👤 User: {session.user.email}")
-        
-        # Get all contacts
-        all_contacts = Contact.objects.filter(contact_list=contact_list)
-        
-        # Format all phone numbers and send (no filtering)
-        contacts = []
-        for contact in all_contacts:
-            try:
-                formatted_phone = service._format_phone_number(contact.phone_number or '')
-                if formatted_phone:
-                    contact.phone_formatted = formatted_phone
-                    contacts.append(contact)
-            except Exception as e:
-                logger.warning(f"Contact {contact.id} phone format error: {e}")
-        # Prefer verified WhatsApp contacts when available
-        if contacts:
-            whatsapp_verified = [c for c in contacts if c.is_on_whatsapp]
-            if whatsapp_verified:
-                logger.info(f"Campaign {campaign_id}: Using {len(whatsapp_verified)} verified WhatsApp contacts out of {len(contacts)}")
-                contacts = whatsapp_verified
-        
-        if not contacts:
-            logger.error(f"Contact list {contact_list.id} has no valid contacts (all {len(all_contacts)} contacts filtered)")
-            campaign.status = 'completed'
-            campaign.save()
-            return {'sent_count': 0, 'failed_count': 0, 'invalid_count': len(invalid_contacts)}
-        
-        # Initialize counters
-        sent_count = 0
-        failed_count = 0
-        session = campaign.session
-        message_template = campaign.message_template
-        
-        # Get attachment URL if exists
-        attachment_url = campaign.attachment_url
-        attachment_type = campaign.attachment_type
-        
-        # Initialize recipients list with contact data (normalized E.164 phone numbers)
-        campaign_recipients = []
-        for contact in contacts:
-            formatted_phone = service._format_phone_number(contact.phone_number or '')
-            campaign_recipients.append({
-                'phone': formatted_phone,
-                'name': f"{contact.first_name or ''} {contact.last_name or ''}".strip()
-            })
-        
-        # Update campaign with recipients list
-        campaign.recipients = campaign_recipients
-        campaign.save(update_fields=['recipients'])
-        
-        # Remove duplicate contacts based on phone number to prevent infinite loops
-        unique_contacts = []
-        seen_phones = set()
-        for contact in contacts:
-            phone_norm = service._format_phone_number(contact.phone_number or '')
-            if phone_norm and phone_norm not in seen_phones:
-                unique_contacts.append(contact)
-                seen_phones.add(phone_norm)
-        
-        logger.info(f"Processing {len(unique_contacts)} unique contacts out of {len(contacts)} total contacts")
-        
-        # Filter out opted-out contacts
-        opted_out_count = 0
-        filtered_contacts = []
-        for contact in unique_contacts:
-            phone_norm = service._format_phone_number(contact.phone_number or '')
-            if phone_norm and OptOutContact.is_opted_out(campaign.user, phone_norm):
-                opted_out_count += 1
-                logger.info(f"⏭️ Skipping opted-out contact: {phone_norm}")
-            else:
-                filtered_contacts.append(contact)
-        
-        if opted_out_count > 0:
-            logger.info(f"🚫 Filtered out {opted_out_count} opted-out contacts, {len(filtered_contacts)} remaining")
-        
-        unique_contacts = filtered_contacts
-        
-        # Initialize processed_phones tracking BEFORE batch or standard processing
-        processed_phones = set()  # Track normalized phones we've already processed in this run
-        
-        # RESUME OPTIMIZATION: Filter out contacts that already have messages for this campaign
-        # This makes resume efficient - we don't loop through already-sent contacts
-        already_sent_phones = set(
-            WASenderMessage.objects.filter(
-                metadata__campaign_id=campaign.id,
-                status__in=['sent', 'delivered', 'read']
-            ).values_list('recipient', flat=True)
-        )
-        
-        if already_sent_phones:
-            original_count = len(unique_contacts)
-            unique_contacts = [
-                c for c in unique_contacts 
-                if service._format_phone_number(c.phone_number or '') not in already_sent_phones
-            ]
-            skipped_count = original_count - len(unique_contacts)
-            logger.info(f"🔄 RESUME MODE: Skipping {skipped_count} already-sent contacts, {len(unique_contacts)} remaining")
-            
-            # Also add to processed_phones to prevent any duplicate attempts
-            processed_phones.update(already_sent_phones)
-        
-        # Batch processing logic - only if Advanced Controls enabled with batching
-        if campaign.use_advanced_controls and campaign.batch_size_max > 0:
-            logger.info(f"🎯 ADVANCED MODE: Random delays + Batching enabled")
-            logger.info(f"   Delay: {campaign.random_delay_min}-{campaign.random_delay_max}s")
-            logger.info(f"   Batch: {campaign.batch_size_min}-{campaign.batch_size_max} contacts")
-            logger.info(f"   Cooldown: {campaign.batch_cooldown_min}-{campaign.batch_cooldown_max} min")
-            
-            # Split contacts into batches with random sizes
-            batches = []
-            remaining_contacts = unique_contacts.copy()
-            
-            while remaining_contacts:
-                # Random batch size between min and max
-                batch_size = random.randint(campaign.batch_size_min, campaign.batch_size_max)
-                logger.info(f"📦 BATCH SIZE: {batch_size} contacts (Range: {campaign.batch_size_min}-{campaign.batch_size_max})")
-                batch = remaining_contacts[:batch_size]
-                batches.append(batch)
-                remaining_contacts = remaining_contacts[batch_size:]
-            
-            logger.info(f"Campaign {campaign_id}: Split {len(unique_contacts)} contacts into {len(batches)} batches")
-            
-            # Store total batches for progress tracking
-            campaign.total_batches = len(batches)
-            campaign.save(update_fields=['total_batches'])
-            
-            # Process batches with cooldown
-            total_sent = 0
-            total_failed = 0
-            
-            for batch_index, batch in enumerate(batches, 1):
-                logger.info(f"Campaign {campaign_id}: Processing batch {batch_index}/{len(batches)} ({len(batch)} contacts)")
-                
-                # Update current batch number and clear cooldown status
-                campaign.current_batch = batch_index
-                campaign.cooldown_remaining = 0
-                campaign.cooldown_status = None
-                campaign.save(update_fields=['current_batch', 'cooldown_remaining', 'cooldown_status'])
-                
-                # Process contacts in this batch
-                batch_sent, batch_failed = _process_contact_batch(
-                    campaign, batch, service, session, message_template, 
-                    attachment_url, attachment_type, processed_phones
-                )
-                
-                total_sent += batch_sent
-                total_failed += batch_failed
-                
-                # Update campaign progress
-                campaign.messages_sent = total_sent
-                campaign.messages_failed = total_failed
-                campaign.save(update_fields=['messages_sent', 'messages_failed'])
-                
-                # Cooldown between batches (except after last batch)
-                if batch_index < len(batches):
-                    # Random cooldown in minutes
-                    cooldown_minutes = random.uniform(
-                        campaign.batch_cooldown_min, 
-                        campaign.batch_cooldown_max
-                    )
-                    cooldown_seconds = int(cooldown_minutes * 60)
-                    
-                    logger.info(f"🧊 BATCH COOLDOWN: {cooldown_minutes:.1f} minutes ({cooldown_seconds}s) - Range: {campaign.batch_cooldown_min}-{campaign.batch_cooldown_max} min")
-                    logger.info(f"⏸️ Waiting {cooldown_minutes:.1f} minutes before batch {batch_index + 1}...")
-                    
-                    # Update campaign with cooldown status
-                    campaign.current_batch = batch_index
-                    campaign.cooldown_remaining = cooldown_seconds
-                    campaign.cooldown_status = f"Cooling down: {cooldown_minutes:.1f} minutes remaining"
-                    campaign.save(update_fields=['current_batch', 'cooldown_remaining', 'cooldown_status'])
-                    
-                    # Sleep with pause checks AND progress updates
-                    for second in range(cooldown_seconds):
-                        try:
-                            campaign.refresh_from_db()
-                            if campaign.status == 'paused':
-                                logger.info(f"Campaign {campaign_id} paused during batch cooldown")
-                                campaign.messages_sent = total_sent
-                                campaign.messages_failed = total_failed
-                                campaign.cooldown_remaining = 0
-                                campaign.cooldown_status = None
-                                campaign.save(update_fields=['messages_sent', 'messages_failed', 'cooldown_remaining', 'cooldown_status'])
-                                return {
-                                    'campaign_id': campaign_id,
-                                    'sent_count': total_sent,
-                                    'failed_count': total_failed,
-                                    'status': 'paused'
-                                }
-                            
-                            # Update cooldown progress every 30 seconds
-                            if second % 30 == 0 and second > 0:
-                                remaining_seconds = cooldown_seconds - second
-                                remaining_minutes = remaining_seconds / 60
-                                campaign.cooldown_remaining = remaining_seconds
-                                campaign.cooldown_status = f"Cooling down: {remaining_minutes:.1f} minutes remaining"
-                                campaign.save(update_fields=['cooldown_remaining', 'cooldown_status'])
-                                logger.info(f"❄️ Cooldown progress: {remaining_minutes:.1f} minutes remaining")
-                        except Exception as e:
-                            logger.warning(f"Error during cooldown check: {e}")
-                        time.sleep(1)
-                    
-                    # Clear cooldown status after cooldown completes
-                    campaign.cooldown_remaining = 0
-                    campaign.cooldown_status = None
-                    campaign.save(update_fields=['cooldown_remaining', 'cooldown_status'])
-                    logger.info(f"✅ Cooldown complete, starting batch {batch_index + 1}")
-            
-            # Mark campaign as completed after all batches
-            campaign.status = 'completed'
-            campaign.completed_at = timezone.now()
-            campaign.messages_sent = total_sent
-            campaign.messages_failed = total_failed
-            campaign.save()
-            
-            logger.info(f"Campaign {campaign.name} completed: {total_sent} sent, {total_failed} failed")
-            
-            return {
-                'campaign_id': campaign_id,
-                'sent_count': total_sent,
-                'failed_count': total_failed,
-                'status': 'completed'
-            }
-        
-        # Standard processing (no batching) - original logic below
-        logger.info(f"🎯 STANDARD MODE: Fixed delays based on session protection")
-        logger.info(f"   Protection: {'ON' if session.account_protection_enabled else 'OFF'}")
-        logger.info(f"   Delay: {settings.MESSAGE_DELAY_WITH_PROTECTION if session.account_protection_enabled else settings.MESSAGE_DELAY_WITHOUT_PROTECTION}s")
-        logger.info(f"   No batching, no cooldowns")
-        
-        # Process each unique contact with safety limit to prevent infinite loops
-        max_iterations = len(unique_contacts) * 2  # Safety limit: at most 2x the unique contacts
-        iteration_count = 0
-        
-        # Track messages sent for periodic status check
-        messages_since_status_check = 0
-        STATUS_CHECK_INTERVAL = 50  # Check session status every N messages
-        
-        for contact in unique_contacts:
-            # Check for cancel/pause request
-            try:
-                campaign.refresh_from_db()
-                if campaign.status == 'paused':
-                    logger.info(f"Campaign {campaign_id} paused by user. Halting sends.")
-                    break
-            except Exception:
-                pass
-            
-            # Periodic session status check (every N messages) to detect disconnects early
-            messages_since_status_check += 1
-            if messages_since_status_check >= STATUS_CHECK_INTERVAL:
-                messages_since_status_check = 0
-                is_still_connected, current_status, check_error = service.check_session_status_safe(session)
-                if not is_still_connected:
-                    logger.error(f"🚨 Session disconnected during campaign! Status: {current_status}, Error: {check_error}")
-                    campaign.status = 'failed'
-                    campaign.error_message = f'Session disconnected during sending: {current_status}'
-                    campaign.save()
-                    return {
-                        'sent_count': sent_count,
-                        'failed_count': failed_count,
-                        'error': f'Session disconnected: {current_status}'
-                    }
-                logger.info(f"✅ Periodic status check OK (every {STATUS_CHECK_INTERVAL} msgs): Session still connected")
-            
-            # Format phone number once
-            phone_norm = service._format_phone_number(contact.phone_number or '')
-            
-            # Safety check to prevent infinite loops
-            iteration_count += 1
-            if iteration_count > max_iterations:
-                logger.error(f"Safety limit exceeded: {iteration_count} iterations for {len(unique_contacts)} contacts")
-                break
-            
-            # Skip if we've already processed this phone in this campaign run
-            if phone_norm in processed_phones:
-                logger.warning(f"Skipping duplicate phone {phone_norm} in current campaign run")
-                continue
-                
-            try:
-                # Mark as processed to prevent duplicate sends in same run
-                processed_phones.add(phone_norm)
-                
-                # CRITICAL: Campaign-specific duplicate prevention
-                # Check 1: Message already sent for this EXACT campaign (most important)
-                existing_campaign_msg = WASenderMessage.objects.filter(
-                    session=session,
-                    recipient=phone_norm,
-                    metadata__campaign_id=campaign.id
-                ).first()
-                
-                if existing_campaign_msg:
-                    logger.warning(f"DUPLICATE PREVENTED: Message already exists for {phone_norm} in campaign {campaign.id}")
-                    continue
-                
-                # Check 2: REMOVED - No longer blocking based on time across sessions
-                # Different sessions (different WhatsApp numbers) SHOULD be able to send to same recipient
-                # Only prevent duplicates within the SAME campaign
-                
-                # Personalize message using dynamic fields
-                personalized_message = message_template
-                
-                # Replace variables from contact.fields (dynamic JSON field)
-                if contact.fields:
-                    for field_name, field_value in contact.fields.items():
-                        placeholder = f"{{{field_name}}}"
-                        personalized_message = personalized_message.replace(
-                            placeholder, 
-                            str(field_value) if field_value else ''
-                        )
-                
-                # Also support legacy field replacements
-                personalized_message = personalized_message.replace('{first_name}', contact.first_name or '')
-                personalized_message = personalized_message.replace('{last_name}', contact.last_name or '')
-                personalized_message = personalized_message.replace('{phone}', contact.phone_number or '')
-                personalized_message = personalized_message.replace('{email}', contact.email or '')
-                personalized_message = personalized_message.replace('{custom_field_1}', contact.custom_field_1 or '')
-                personalized_message = personalized_message.replace('{custom_field_2}', contact.custom_field_2 or '')
-                personalized_message = personalized_message.replace('{custom_field_3}', contact.custom_field_3 or '')
-                
-                # Send message with or without attachment
-                msg = None
-                if attachment_url and attachment_type:
-                    # Check pause before sending attachment
-                    try:
-                        campaign.refresh_from_db()
-                        if campaign.status == 'paused':
-                            logger.info(f"Campaign {campaign_id} paused by user. Halting sends before attachment.")
-                            break
-                    except Exception:
-                        pass
-                    
-                    # Special handling: for audio, send text first, then audio media
-                    if attachment_type == 'audio':
-                        # 1) Send text message to guarantee content delivery
-                        text_msg = service.send_text_message(session, phone_norm, personalized_message)
-                        if text_msg:
-                            try:
-                                current_meta = text_msg.metadata or {}
-                                current_meta.update({'campaign_id': campaign.id})
-                                text_msg.metadata = current_meta
-                                text_msg.save(update_fields=['metadata'])
-                            except Exception as e:
-                                logger.warning(f"Unable to tag text message {getattr(text_msg, 'id', '?')} with campaign_id: {e}")
-                            if text_msg.status == 'sent':
-                                sent_count += 1
-                            else:
-                                failed_count += 1
-                        else:
-                            failed_count += 1
-                            # Record failed text message
-                            try:
-                                WASenderMessage.objects.create(
-                                    session=session,
-                                    user=session.user,
-                                    recipient=phone_norm,
-                                    message_type='text',
-                                    content=personalized_message,
-                                    status='failed',
-                                    error_message='Text send failed before audio',
-                                    metadata={'campaign_id': campaign.id}
-                                )
-                            except Exception as e:
-                                logger.error(f"Failed to record failed text message for {phone_norm}: {e}")
-
-                        # 2) Then send audio media (caption often not shown for audio)
-                        media_to_send = attachment_url
-                        msg = service.send_media_message(
-                            session=session,
-                            recipient=phone_norm,
-                            media_url=media_to_send,
-                            message_type='audio',
-                            caption=None
-                        )
-                    else:
-                        # Prefer Wasender-hosted URL if available for documents
-                        media_to_send = attachment_url
-                        if attachment_type == 'document' and getattr(campaign, 'wasender_document_url', None):
-                            media_to_send = campaign.wasender_document_url
-                        # Send media message with caption
-                        msg = service.send_media_message(
-                            session=session,
-                            recipient=phone_norm,
-                            media_url=media_to_send,
-                            message_type=attachment_type,
-                            caption=personalized_message
-                        )
-                else:
-                    # Check pause before sending text message
-                    try:
-                        campaign.refresh_from_db()
-                        if campaign.status == 'paused':
-                            logger.info(f"Campaign {campaign_id} paused by user. Halting sends before text.")
-                            break
-                    except Exception:
-                        pass
-                    
-                    # Send text-only message
-                    msg = service.send_text_message(session, phone_norm, personalized_message)
-                
-                # Update counters and tag messages with campaign id metadata
-                if msg:
-                    try:
-                        current_meta = msg.metadata or {}
-                        current_meta.update({'campaign_id': campaign.id})
-                        msg.metadata = current_meta
-                        msg.save(update_fields=['metadata'])
-                        logger.info(f"✅ Tagged message {msg.id} with campaign_id={campaign.id}")
-                    except Exception as e:
-                        logger.error(f"❌ FAILED to tag message {getattr(msg, 'id', '?')} with campaign_id: {e}", exc_info=True)
-                    if msg.status == 'sent':
-                        sent_count += 1
-                        logger.info(f"✅ Message sent successfully to {phone_norm}")
-                    else:
-                        failed_count += 1
-                        error_msg = getattr(msg, 'error_message', 'Unknown error')
-                        logger.error(f"❌ Message failed to {phone_norm}: status={msg.status}, error={error_msg}")
-                else:
-                    failed_count += 1
-                    logger.error(f"❌ No message object returned for {phone_norm} - send_text_message returned None")
-                    # Record failed message for visibility in campaign details and exports
-                    try:
-                        WASenderMessage.objects.create(
-                            session=session,
-                            user=session.user,
-                            recipient=phone_norm,
-                            message_type=attachment_type or 'text',
-                            content=attachment_url or personalized_message,
-                            caption=personalized_message if attachment_url and attachment_type else None,
-                            status='failed',
-                            error_message='Send method returned None - possible API error or rate limit',
-                            metadata={'campaign_id': campaign.id}
-                        )
+                        if wasender_url:
+                            campaign.wasender_document_url = wasender_url
+                            campaign.save(update_fields=['wasender_document_url'])
                     except Exception as e:
-                        logger.error(f"Failed to record failed message for {phone_norm}: {e}")
+                        logger.warning(f"WASender pre-upload failed: {e}")
                 
-                # Update campaign progress in real-time
-                campaign.messages_sent = sent_count
-                campaign.messages_failed = failed_count
-                campaign.save()
-                
-                # Add delay based on account protection setting with pause check
-                # Use advanced controls if enabled, otherwise use standard delay
-                if campaign.use_advanced_controls:
-                    # Random delay between min and max
-                    delay = random.randint(campaign.random_delay_min, campaign.random_delay_max)
-                    logger.info(f"⏱️ ADVANCED DELAY: {delay}s (Range: {campaign.random_delay_min}-{campaign.random_delay_max}s)")
-                else:
-                    # Standard delay from settings
-                    delay = settings.MESSAGE_DELAY_WITH_PROTECTION if session.account_protection_enabled else settings.MESSAGE_DELAY_WITHOUT_PROTECTION
-                    logger.info(f"⏱️ STANDARD DELAY: {delay}s (Protection: {session.account_protection_enabled})")
-                
-                # Sleep in intervals so we can check for pause status
-                # Only refresh every 10 seconds to reduce database queries
-                pause_check_interval = 10  # Check pause status every 10 seconds
-                checked_at = 0
-                
-                for second in range(delay):
-                    checked_at += 1
-                    
-                    # Check pause status less frequently (every 10 seconds)
-                    if checked_at >= pause_check_interval:
-                        try:
-                            campaign.refresh_from_db()
-                            if campaign.status == 'paused':
-                                logger.info(f"Campaign {campaign_id} paused during delay. Halting sends.")
-                                break
-                        except Exception:
-                            pass
-                        checked_at = 0
+                # Delete temp file
+                try:
+                    os.remove(temp_file_path)
+                    logger.info(f"Temp file deleted: {temp_file_path}")
+                except Exception as e:
+                    logger.warning(f"Failed to delete temp file: {e}")
                     
-                    time.sleep(1)
-                
             except Exception as e:
-                logger.error(f"Error sending to {contact.phone_number}: {e}")
-                failed_count += 1
-                campaign.messages_failed = failed_count
-                campaign.save()
-        
-        # If paused, keep status and return partial results
-        campaign.refresh_from_db()
-        if campaign.status == 'paused':
-            logger.info(f"Campaign {campaign.name} paused: {sent_count} sent, {failed_count} failed")
-            # IMPORTANT: Do NOT change status back from paused - keep it paused
-            campaign.messages_sent = sent_count
-            campaign.messages_failed = failed_count
-            campaign.save(update_fields=['messages_sent', 'messages_failed'])
+                logger.error(f"Failed to upload attachment in background: {e}")
+                # Mark campaign as failed
+                campaign.status = 'failed'
+                campaign.save(update_fields=['status'])
+                return {'error': f'Attachment upload failed: {str(e)}'}
+        else:
+            # attachment_url is already a Cloudinary URL (old campaign), skip upload
+            logger.info(f"Attachment already uploaded: {campaign.attachment_url}")
+    
+    return None
+
+
+def prepare_campaign_run(campaign):
+    """
+    Verify a claimed campaign can send and build its ordered contact list
+    
+    Returns:
+        CampaignRun, or a result dict when the campaign finished without sending
+    """
+    campaign_id = campaign.id
+    
+    upload_error = _upload_pending_attachment(campaign)
+    if upload_error:
+        return upload_error
+    
+    # Get contacts from contact list
+    contact_list = campaign.contact_list
+    if not contact_list:
+        logger.error(f"Campaign {campaign_id} has no contact list")
+        campaign.status = 'failed'
+        campaign.save()
+        return {'error': 'No contact list'}
+    
+    # CRITICAL: Verify session is still connected before starting
+    # Use safe status check with session-specific API key (not personal access token)
+    # This avoids triggering global session refresh that could disconnect other sessions
+    session = campaign.session
+    if not session:
+        error_msg = 'No session assigned to campaign'
+        logger.error(f"Campaign {campaign_id} has no session")
+        campaign.status = 'failed'
+        campaign.save()
+        return {'error': error_msg}
+    
+    # Initialize service for sending messages
+    service = get_wasender_service()
+    
+    # Safe API status check using session-specific key (recommended by WASender support)
+    is_connected, api_status, error = service.check_session_status_safe(session)
+    
+    if not is_connected:
+        error_msg = f'Session not connected (API status: {api_status}, error: {error})'
+        logger.error(f"Campaign {campaign_id} session check failed: {error_msg}")
+        campaign.status = 'failed'
+        campaign.save()
+        return {'error': error_msg}
+    
+    logger.info(f"✅ Session {session.session_id} verified via API (status: {api_status})")
+    logger.info(f"📱 Session phone: {session.connected_phone_number or session.phone_number}")
+    logger.info(f"👤 User: {session.user.email}")
+    
+    # Get all contacts
+    all_contacts = Contact.objects.filter(contact_list=contact_list)
+    
+    # E.164 numbers are stored at import; only rows predating phone_e164 are formatted here
+    contacts = []
+    for contact in all_contacts:
+        contact.phone_e164 = contact_e164(contact)
+        if contact.phone_e164:
+            contacts.append(contact)
+    # Prefer verified WhatsApp contacts when available
+    if contacts:
+        whatsapp_verified = [c for c in contacts if c.is_on_whatsapp]
+        if whatsapp_verified:
+            logger.info(f"Campaign {campaign_id}: Using {len(whatsapp_verified)} verified WhatsApp contacts out of {len(contacts)}")
+            contacts = whatsapp_verified
+    
+    if not contacts:
+        logger.error(f"Contact list {contact_list.id} has no valid contacts (all {len(all_contacts)} contacts filtered)")
+        campaign.status = 'completed'
+        campaign.save()
+        return {'sent_count': 0, 'failed_count': 0, 'invalid_count': len(all_contacts)}
+    
+    # Record the recipients as rows (E.164 phone, name, send state); a resumed
+    # run keeps the state of recipients already recorded
+    recipient_count = snapshot_recipients(campaign, contacts)
+    logger.info(f"Campaign {campaign_id}: {recipient_count} recipients recorded")
+    # Claims a previous run took but never sent (stopped mid-send) go back to pending
+    released = release_unsent_claims(campaign_id)
+    if released:
+        logger.info(f"Campaign {campaign_id}: {released} unsent recipient claims released")
+    
+    # Remove duplicate contacts based on phone number to prevent infinite loops
+    unique_contacts = []
+    seen_phones = set()
+    for contact in contacts:
+        if contact.phone_e164 not in seen_phones:
+            unique_contacts.append(contact)
+            seen_phones.add(contact.phone_e164)
+    
+    logger.info(f"Processing {len(unique_contacts)} unique contacts out of {len(contacts)} total contacts")
+    
+    # Filter out opted-out contacts (user's opt-outs loaded once, matched in memory)
+    optouts = OptOutMatcher.for_user(campaign.user_id)
+    opted_out_phones = []
+    filtered_contacts = []
+    for contact in unique_contacts:
+        if optouts.matches(contact.phone_e164):
+            opted_out_phones.append(contact.phone_e164)
+            logger.info(f"⏭️ Skipping opted-out contact: {contact.phone_e164}")
+        else:
+            filtered_contacts.append(contact)
+    
+    if opted_out_phones:
+        mark_recipients(campaign.id, opted_out_phones, 'skipped')
+        logger.info(f"🚫 Filtered out {len(opted_out_phones)} opted-out contacts, {len(filtered_contacts)} remaining")
+    
+    unique_contacts = filtered_contacts
+    
+    # Initialize processed_phones tracking BEFORE batch or standard processing
+    processed_phones = set()  # Track normalized phones we've already processed in this run
+    
+    # RESUME OPTIMIZATION: Filter out contacts that already have messages for this campaign
+    # (sent or failed - failed ones are retried from the campaign page, not resent here).
+    # Loaded once; the engine keeps processed_phones current instead of querying per contact.
+    attempted_phones = set(
+        WASenderMessage.objects.filter(campaign_id=campaign.id)
+        .order_by()
+        .values_list('recipient', flat=True)
+        .distinct()
+    )
+    
+    if attempted_phones:
+        original_count = len(unique_contacts)
+        unique_contacts = [
+            c for c in unique_contacts 
+            if c.phone_e164 not in attempted_phones
+        ]
+        skipped_count = original_count - len(unique_contacts)
+        logger.info(f"🔄 RESUME MODE: Skipping {skipped_count} already-attempted contacts, {len(unique_contacts)} remaining")
+        
+        # Also add to processed_phones to prevent any duplicate attempts
+        processed_phones.update(attempted_phones)
+    
+    return CampaignRun(campaign, service, session, unique_contacts, processed_phones)
+
+
+def split_into_batches(run):
+    """Split the run's contacts into random-size batches and record the batch count"""
+    campaign = run.campaign
+    logger.info(f"🎯 ADVANCED MODE: Random delays + Batching enabled")
+    logger.info(f"   Delay: {campaign.random_delay_min}-{campaign.random_delay_max}s")
+    logger.info(f"   Batch: {campaign.batch_size_min}-{campaign.batch_size_max} contacts")
+    logger.info(f"   Cooldown: {campaign.batch_cooldown_min}-{campaign.batch_cooldown_max} min")
+    
+    # Split contacts into batches with random sizes
+    batches = []
+    remaining_contacts = run.contacts.copy()
+    
+    while remaining_contacts:
+        # Random batch size between min and max
+        batch_size = random.randint(campaign.batch_size_min, campaign.batch_size_max)
+        logger.info(f"📦 BATCH SIZE: {batch_size} contacts (Range: {campaign.batch_size_min}-{campaign.batch_size_max})")
+        batch = remaining_contacts[:batch_size]
+        batches.append(batch)
+        remaining_contacts = remaining_contacts[batch_size:]
+    
+    logger.info(f"Campaign {campaign.id}: Split {len(run.contacts)} contacts into {len(batches)} batches")
+    
+    # Store total batches for progress tracking
+    campaign.total_batches = len(batches)
+    campaign.save(update_fields=['total_batches'])
+    return batches
+
+
+def start_batch(campaign, batch_index, batch_count, batch_size):
+    """Update current batch number and clear cooldown status"""
+    logger.info(f"Campaign {campaign.id}: Processing batch {batch_index}/{batch_count} ({batch_size} contacts)")
+    campaign.current_batch = batch_index
+    campaign.cooldown_remaining = 0
+    campaign.cooldown_status = None
+    campaign.save(update_fields=['current_batch', 'cooldown_remaining', 'cooldown_status'])
+
+
+def save_progress(campaign, sent_count, failed_count):
+    """
+    Checkpoint after a batch: repair any counter drift for this campaign
+    
+    Per-message counters are maintained by campaign_counters as messages are
+    written; the run's own sent/failed tallies are only logged.
+    """
+    logger.info(f"Campaign {campaign.id}: run so far {sent_count} sent, {failed_count} failed")
+    reconcile_campaign_counters([campaign.id])
+
+
+def begin_cooldown(campaign, batch_index):
+    """
+    Pick a random cooldown after a batch and publish it on the campaign
+    
+    Returns:
+        int: cooldown length in seconds
+    """
+    # Random cooldown in minutes
+    cooldown_minutes = random.uniform(
+        campaign.batch_cooldown_min, 
+        campaign.batch_cooldown_max
+    )
+    cooldown_seconds = int(cooldown_minutes * 60)
+    
+    logger.info(f"🧊 BATCH COOLDOWN: {cooldown_minutes:.1f} minutes ({cooldown_seconds}s) - Range: {campaign.batch_cooldown_min}-{campaign.batch_cooldown_max} min")
+    logger.info(f"⏸️ Waiting {cooldown_minutes:.1f} minutes before batch {batch_index + 1}...")
+    
+    # Update campaign with cooldown status
+    campaign.current_batch = batch_index
+    campaign.cooldown_remaining = cooldown_seconds
+    campaign.cooldown_status = f"Cooling down: {cooldown_minutes:.1f} minutes remaining"
+    campaign.save(update_fields=['current_batch', 'cooldown_remaining', 'cooldown_status'])
+    return cooldown_seconds
+
+
+def cooldown_tick(campaign, second, cooldown_seconds, sent_count, failed_count):
+    """
+    One second of a batch cooldown: pause check plus a progress update every 30 seconds
+    
+    Returns:
+        Paused result dict if the campaign was paused, otherwise None
+    """
+    try:
+        if is_pause_requested(campaign.id):
+            campaign.status = 'paused'
+            logger.info(f"Campaign {campaign.id} paused during batch cooldown")
+            campaign.cooldown_remaining = 0
+            campaign.cooldown_status = None
+            campaign.save(update_fields=['cooldown_remaining', 'cooldown_status'])
+            publish_progress(campaign.id, campaign.user_id)
             return {
-                'campaign_id': campaign_id,
+                'campaign_id': campaign.id,
                 'sent_count': sent_count,
                 'failed_count': failed_count,
                 'status': 'paused'
             }
         
-        # Mark campaign as completed (only if NOT paused)
-        campaign.status = 'completed'
-        campaign.completed_at = timezone.now()
-        campaign.messages_sent = sent_count
-        campaign.messages_failed = failed_count
-        campaign.save()
-        
-        logger.info(f"Campaign {campaign.name} completed: {sent_count} sent, {failed_count} failed")
-        
+        # Update cooldown progress every 30 seconds
+        if second % 30 == 0 and second > 0:
+            remaining_seconds = cooldown_seconds - second
+            remaining_minutes = remaining_seconds / 60
+            campaign.cooldown_remaining = remaining_seconds
+            campaign.cooldown_status = f"Cooling down: {remaining_minutes:.1f} minutes remaining"
+            campaign.save(update_fields=['cooldown_remaining', 'cooldown_status', 'updated_at'])
+            logger.info(f"❄️ Cooldown progress: {remaining_minutes:.1f} minutes remaining")
+    except Exception as e:
+        logger.warning(f"Error during cooldown check: {e}")
+    return None
+
+
+def end_cooldown(campaign, batch_index):
+    """Clear cooldown status after cooldown completes"""
+    campaign.cooldown_remaining = 0
+    campaign.cooldown_status = None
+    campaign.save(update_fields=['cooldown_remaining', 'cooldown_status'])
+    logger.info(f"✅ Cooldown complete, starting batch {batch_index + 1}")
+
+
+def finish_campaign(campaign, outcome, sent_count, failed_count, error=None):
+    """
+    Record the final state of a campaign run
+    
+    Args:
+        outcome: Engine outcome ('completed', 'paused' or 'disconnected')
+    
+    Returns:
+        dict: Campaign results
+    """
+    if outcome == 'disconnected':
+        campaign.status = 'failed'
+        campaign.error_message = error
+        # Counters are maintained per message; don't overwrite them from this object
+        campaign.save(update_fields=['status', 'updated_at'])
+        reconcile_campaign_counters([campaign.id])
+        publish_progress(campaign.id, campaign.user_id, message=error or '')
         return {
-            'campaign_id': campaign_id,
             'sent_count': sent_count,
             'failed_count': failed_count,
-            'status': 'completed'
+            'error': error
         }
-        
-    except WASenderCampaign.DoesNotExist:
-        logger.error(f"Campaign {campaign_id} not found")
-        return {'error': 'Campaign not found'}
     
-    except Exception as e:
-        logger.error(f"Campaign {campaign_id} failed with error: {e}")
-        try:
-            campaign = WASenderCampaign.objects.get(id=campaign_id)
-            campaign.status = 'failed'
-            campaign.save()
-        except:
-            pass
-        return {'error': str(e)}
+    # If paused, keep status and return partial results
+    campaign.refresh_from_db()
+    if campaign.status == 'paused':
+        logger.info(f"Campaign {campaign.name} paused: {sent_count} sent, {failed_count} failed")
+        # IMPORTANT: Do NOT change status back from paused - keep it paused
+        save_progress(campaign, sent_count, failed_count)
+        publish_progress(campaign.id, campaign.user_id)
+        return {
+            'campaign_id': campaign.id,
+            'sent_count': sent_count,
+            'failed_count': failed_count,
+            'status': 'paused'
+        }
+    
+    # Mark campaign as completed (only if NOT paused)
+    campaign.status = 'completed'
+    campaign.completed_at = timezone.now()
+    campaign.save(update_fields=['status', 'completed_at', 'updated_at'])
+    reconcile_campaign_counters([campaign.id])
+    publish_progress(campaign.id, campaign.user_id)
+    
+    logger.info(f"Campaign {campaign.name} completed: {sent_count} sent, {failed_count} failed")
+    
+    return {
+        'campaign_id': campaign.id,
+        'sent_count': sent_count,
+        'failed_count': failed_count,
+        'status': 'completed'
+    }
 
 
-def _process_contact_batch(campaign, batch_contacts, service, session, message_template, 
-                           attachment_url, attachment_type, processed_phones):
-    """
-    Helper function to process a batch of contacts
-    Returns tuple: (sent_count, failed_count)
-    """
-    sent_count = 0
-    failed_count = 0
+def log_standard_mode(session):
+    logger.info(f"🎯 STANDARD MODE: Fixed delays based on session protection")
+    logger.info(f"   Protection: {'ON' if session.account_protection_enabled else 'OFF'}")
+    logger.info(f"   Delay: {settings.MESSAGE_DELAY_WITH_PROTECTION if session.account_protection_enabled else settings.MESSAGE_DELAY_WITHOUT_PROTECTION}s")
+    logger.info(f"   No batching, no cooldowns")
+
+
+def _send_batched(run):
+    """Send in random-size batches with cooldowns, blocking this worker throughout"""
+    campaign = run.campaign
+    batches = split_into_batches(run)
     
-    for contact in batch_contacts:
-        # Check for pause request
-        try:
-            campaign.refresh_from_db()
-            if campaign.status == 'paused':
-                logger.info(f"Campaign {campaign.id} paused during batch processing")
-                break
-        except Exception:
-            pass
+    # Process batches with cooldown
+    total_sent = 0
+    total_failed = 0
+    
+    for batch_index, batch in enumerate(batches, 1):
+        start_batch(campaign, batch_index, len(batches), len(batch))
         
-        # Format phone number
-        phone_norm = service._format_phone_number(contact.phone_number or '')
+        # Process contacts in this batch
+        engine = CampaignSendEngine(campaign, run.service, run.session, run.processed_phones)
+        outcome = engine.run(batch)
         
-        # Skip if already processed
-        if phone_norm in processed_phones:
-            continue
+        total_sent += engine.sent_count
+        total_failed += engine.failed_count
+        save_progress(campaign, total_sent, total_failed)
         
-        try:
-            # Mark as processed
-            processed_phones.add(phone_norm)
-            
-            # Check for existing campaign message
-            existing_campaign_msg = WASenderMessage.objects.filter(
-                session=session,
-                recipient=phone_norm,
-                metadata__campaign_id=campaign.id
-            ).first()
-            
-            if existing_campaign_msg:
-                logger.warning(f"DUPLICATE PREVENTED: Message already exists for {phone_norm} in campaign {campaign.id}")
-                continue
-            
-            # Personalize message
-            personalized_message = message_template
-            
-            # Replace variables from contact.fields
-            if contact.fields:
-                for field_name, field_value in contact.fields.items():
-                    placeholder = f"{{{field_name}}}"
-                    personalized_message = personalized_message.replace(
-                        placeholder, 
-                        str(field_value) if field_value else ''
-                    )
-            
-            # Legacy field replacements
-            personalized_message = personalized_message.replace('{first_name}', contact.first_name or '')
-            personalized_message = personalized_message.replace('{last_name}', contact.last_name or '')
-            personalized_message = personalized_message.replace('{phone}', contact.phone_number or '')
-            personalized_message = personalized_message.replace('{email}', contact.email or '')
-            personalized_message = personalized_message.replace('{custom_field_1}', contact.custom_field_1 or '')
-            personalized_message = personalized_message.replace('{custom_field_2}', contact.custom_field_2 or '')
-            personalized_message = personalized_message.replace('{custom_field_3}', contact.custom_field_3 or '')
-            
-            # Send message
-            msg = None
-            if attachment_url and attachment_type:
-                if attachment_type == 'audio':
-                    # Send text first, then audio
-                    text_msg = service.send_text_message(session, phone_norm, personalized_message)
-                    if text_msg:
-                        try:
-                            current_meta = text_msg.metadata or {}
-                            current_meta.update({'campaign_id': campaign.id})
-                            text_msg.metadata = current_meta
-                            text_msg.save(update_fields=['metadata'])
-                        except Exception as e:
-                            logger.warning(f"Unable to tag text message: {e}")
-                        if text_msg.status == 'sent':
-                            sent_count += 1
-                        else:
-                            failed_count += 1
-                    else:
-                        failed_count += 1
-                    
-                    # Send audio
-                    msg = service.send_media_message(
-                        session=session,
-                        recipient=phone_norm,
-                        media_url=attachment_url,
-                        message_type='audio',
-                        caption=None
-                    )
-                else:
-                    # Send media with caption
-                    media_to_send = attachment_url
-                    if attachment_type == 'document' and getattr(campaign, 'wasender_document_url', None):
-                        media_to_send = campaign.wasender_document_url
-                    
-                    msg = service.send_media_message(
-                        session=session,
-                        recipient=phone_norm,
-                        media_url=media_to_send,
-                        message_type=attachment_type,
-                        caption=personalized_message
-                    )
-            else:
-                # Send text message only
-                msg = service.send_text_message(session, phone_norm, personalized_message)
-            
-            # Update counters
-            if msg:
-                try:
-                    current_meta = msg.metadata or {}
-                    current_meta.update({'campaign_id': campaign.id})
-                    msg.metadata = current_meta
-                    msg.save(update_fields=['metadata'])
-                    logger.info(f"✅ Tagged message {msg.id} with campaign_id={campaign.id}")
-                except Exception as e:
-                    logger.error(f"❌ FAILED to tag message {getattr(msg, 'id', '?')} with campaign_id: {e}", exc_info=True)
-                
-                if msg.status == 'sent':
-                    sent_count += 1
-                    logger.info(f"✅ Message sent successfully to {phone_norm}")
-                else:
-                    failed_count += 1
-                    error_msg = getattr(msg, 'error_message', 'Unknown error')
-                    logger.error(f"❌ Message failed to {phone_norm}: status={msg.status}, error={error_msg}")
-            else:
-                failed_count += 1
-                logger.error(f"❌ No message object returned for {phone_norm}")
-                # Record failed message
-                try:
-                    WASenderMessage.objects.create(
-                        session=session,
-                        user=session.user,
-                        recipient=phone_norm,
-                        message_type=attachment_type or 'text',
-                        content=attachment_url or personalized_message,
-                        caption=personalized_message if attachment_url and attachment_type else None,
-                        status='failed',
-                        error_message='Send method returned None - possible API error or rate limit',
-                        metadata={'campaign_id': campaign.id}
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to record failed message for {phone_norm}: {e}")
-            
-            # Random delay with pause checks
-            if campaign.use_advanced_controls:
-                delay = random.randint(campaign.random_delay_min, campaign.random_delay_max)
-                logger.info(f"⏱️ Message delay: {delay}s (Range: {campaign.random_delay_min}-{campaign.random_delay_max}s)")
-            else:
-                delay = settings.MESSAGE_DELAY_WITH_PROTECTION if session.account_protection_enabled else settings.MESSAGE_DELAY_WITHOUT_PROTECTION
+        if outcome == 'paused':
+            return finish_campaign(campaign, outcome, total_sent, total_failed)
+        
+        # Cooldown between batches (except after last batch)
+        if batch_index < len(batches):
+            cooldown_seconds = begin_cooldown(campaign, batch_index)
             
-            for _ in range(delay):
-                try:
-                    campaign.refresh_from_db()
-                    if campaign.status == 'paused':
-                        logger.info(f"Campaign {campaign.id} paused during delay")
-                        break
-                except Exception:
-                    pass
+            # Sleep with pause checks (control channel, not the DB) AND progress updates
+            for second in range(cooldown_seconds):
+                paused = cooldown_tick(campaign, second, cooldown_seconds, total_sent, total_failed)
+                if paused:
+                    return paused
                 time.sleep(1)
-                
-        except Exception as e:
-            logger.error(f"Error sending to {contact.phone_number}: {e}")
-            failed_count += 1
+            
+            end_cooldown(campaign, batch_index)
+    
+    # Mark campaign as completed after all batches
+    return finish_campaign(campaign, 'completed', total_sent, total_failed)
+
+
+def _send_standard(run):
+    """Send with fixed pacing and no batching, blocking this worker throughout"""
+    log_standard_mode(run.session)
     
-    return sent_count, failed_count
+    # Pipelined send: preparation and persistence overlap the paced network send
+    engine = CampaignSendEngine(
+        run.campaign, run.service, run.session, run.processed_phones,
+        status_check_interval=50  # Check session status every N messages
+    )
+    outcome = engine.run(run.contacts)
+    return finish_campaign(run.campaign, outcome, engine.sent_count, engine.failed_count, engine.error)
@@ -14,6 +14,7 @@ urlpatterns = [
     path('campaigns/', views.campaign_list, name='campaigns'),
     path('campaigns/<int:campaign_id>/', views.campaign_detail, name='campaign_detail'),
     path('campaigns/<int:campaign_id>/stats/', views.campaign_stats_api, name='campaign_stats_api'),
+    path('campaigns/<int:campaign_id>/recipients/', views.campaign_recipients_api, name='campaign_recipients_api'),
     path('campaigns/<int:campaign_id>/retry-failed/', views.retry_failed_messages, name='retry_failed_messages'),
     path('campaigns/<int:campaign_id>/retry-single/', views.retry_single_recipient, name='retry_single_recipient'),
     path('campaigns/<int:campaign_id>/stop/', views.stop_campaign, name='stop_campaign'),
@@ -19,9 +19,12 @@ import os
 import threading
 
 from userpanel.models import WASenderSession, WASenderMessage, WASenderCampaign
-from .wasender_service import WASenderService
+from .wasender_service import get_wasender_service
 from adminpanel.models import Subscription
 from .moderation import evaluate_content
+from .message_template import compile_template
+from .campaign_recipients import has_recipients, mark_recipients, recipient_phones, recipients_page
+from .media_resolver import forget_rejected_media, resolve_campaign_media
 
 logger = logging.getLogger(__name__)
 
@@ -82,7 +85,7 @@ def dashboard(request):
     is_public_url = 'ngrok' in current_host or ('localhost' not in current_host and '127.0.0.1' not in current_host)
     
     if is_public_url and all_sessions.exists():
-        service = WASenderService()
+        service = get_wasender_service()
         for session in all_sessions:
             # Build the correct webhook URL for this user
             expected_webhook_url = request.build_absolute_uri(
@@ -118,7 +121,7 @@ def dashboard(request):
     should_refresh = request.GET.get('refresh') == '1'
     
     if should_refresh and active_sessions.exists():
-        service = WASenderService()
+        service = get_wasender_service()
         for session in active_sessions[:3]:  # Check max 3 connected sessions
             try:
                 # This will update status in DB if session is disconnected on WASender
@@ -201,7 +204,7 @@ def sessions_list(request):
     if should_refresh:
         connected_sessions = all_sessions.filter(status='connected')
         if connected_sessions.exists():
-            service = WASenderService()
+            service = get_wasender_service()
             for session in connected_sessions[:3]:  # Reduced to 3 for faster response
                 try:
                     service.get_session_status(session)  # Updates status in DB
@@ -264,7 +267,7 @@ def create_session(request):
             status='disconnected'
         )
         
-        service = WASenderService()
+        service = get_wasender_service()
         for old_session in disconnected_sessions:
             try:
                 # Verify session still exists on WaSender API
@@ -340,7 +343,7 @@ def connect_session(request, session_id):
     """
     session = get_object_or_404(WASenderSession, id=session_id, user=request.user)
     
-    service = WASenderService()
+    service = get_wasender_service()
     
     # Always call connect first to ensure session is ready for QR
     # Use lowercase comparison for status checks
@@ -392,7 +395,7 @@ def check_session_status(request, session_id):
     """
     session = get_object_or_404(WASenderSession, id=session_id, user=request.user)
     
-    service = WASenderService()
+    service = get_wasender_service()
     try:
         # Get latest status from WASender API
         status_data = service.get_session_status(session)
@@ -438,7 +441,7 @@ def refresh_all_sessions(request):
     Detects external disconnections from WASender API
     Also detects and deletes sessions that were deleted externally (404)
     """
-    service = WASenderService()
+    service = get_wasender_service()
     all_sessions = WASenderSession.objects.filter(user=request.user).order_by('-created_at')[:10]
     
     updated_sessions = []
@@ -493,7 +496,7 @@ def disconnect_session(request, session_id):
     """
     session = get_object_or_404(WASenderSession, id=session_id, user=request.user)
     
-    service = WASenderService()
+    service = get_wasender_service()
     try:
         if service.disconnect_session(session):
             messages.success(request, "Session disconnected successfully")
@@ -516,7 +519,7 @@ def delete_session(request, session_id):
     session = get_object_or_404(WASenderSession, id=session_id, user=request.user)
     session_id_text = session.session_id
     
-    service = WASenderService()
+    service = get_wasender_service()
     try:
         # Try to delete from WASender API
         # Returns True even if session doesn't exist (404)
@@ -1316,7 +1319,7 @@ def send_single_message(request):
         )
     
     
-    service = WASenderService()
+    service = get_wasender_service()
     try:
         msg = service.send_text_message(session, recipient, message)
         if msg:
@@ -1346,6 +1349,27 @@ def send_single_message(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def _personalize_test_message(user, contact_list_id, test_phone, message):
+    """
+    Render placeholders for a test send using the contact matching the test phone,
+    or the first contact of the list as sample data
+    """
+    from .models import ContactList, Contact
+    
+    contact_list = ContactList.objects.filter(id=contact_list_id, user=user).first()
+    if not contact_list:
+        return message
+    contacts = Contact.objects.filter(contact_list=contact_list)
+    phone_digits = ''.join(ch for ch in test_phone if ch.isdigit())
+    contact = None
+    if len(phone_digits) >= 10:
+        contact = contacts.filter(phone_number__endswith=phone_digits[-10:]).first()
+    contact = contact or contacts.order_by('id').first()
+    if not contact:
+        return message
+    return compile_template(message).render(contact)
+
+
 @login_required
 @require_POST
 def send_test_message(request):
@@ -1380,6 +1404,11 @@ def send_test_message(request):
         if not test_message:
             return JsonResponse({'error': 'Message required'}, status=400)
         
+        # Personalize with the selected contact list, like the real campaign send
+        contact_list_id = request.POST.get('contact_list_id')
+        if contact_list_id:
+            test_message = _personalize_test_message(request.user, contact_list_id, test_phone, test_message)
+        
         # Content moderation for test message
         mod = evaluate_content(test_message)
         # AI-only gate: treat review as block when enabled
@@ -1410,7 +1439,7 @@ def send_test_message(request):
                 status=403
             )
         
-        service = WASenderService()
+        service = get_wasender_service()
         
         # If attachment provided, upload to Cloudinary first
         if test_attachment:
@@ -1527,7 +1556,11 @@ def wasender_webhook(request, user_id):
         # Log webhook receipt with full details
         logger.info(f"📥 WEBHOOK RECEIVED | User: {user_id} | Event: {event_type} | Session: {session_id[:20] if len(str(session_id)) > 20 else session_id}...")
         logger.info(f"🔐 Webhook Signature: {webhook_signature[:20]}..." if webhook_signature else "🔐 No signature provided")
-        logger.info(f"📦 Webhook Payload: {json.dumps(payload, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📦 Webhook Payload: %s", json.dumps(payload, separators=(',', ':'))[:2000])
+        
+        if not isinstance(payload, dict):
+            return JsonResponse({'error': 'Invalid JSON payload'}, status=400)
         
         # Verify webhook signature (if configured)
         if settings.WASENDER_VERIFY_WEBHOOK_SIGNATURE and not settings.DEBUG:
@@ -1535,18 +1568,11 @@ def wasender_webhook(request, user_id):
             session_secret = None
             try:
                 if session_id and session_id != 'unknown':
-                    from userpanel.models import WASenderSession
-                    # Try to find session by API token (sessionId is the API key)
-                    sessions = WASenderSession.objects.all()
-                    service = WASenderService()
-                    for s in sessions:
-                        try:
-                            decrypted = service._decrypt_token(s.api_token)
-                            if decrypted == session_id:
-                                session_secret = getattr(s, 'webhook_secret', None)
-                                break
-                        except:
-                            continue
+                    from .session_index import resolve_session
+                    # sessionId is the API key: one indexed lookup by its hash
+                    matched_session = resolve_session(session_id)
+                    if matched_session:
+                        session_secret = getattr(matched_session, 'webhook_secret', None)
             except Exception as e:
                 logger.warning(f"⚠️ Could not retrieve session webhook secret: {e}")
             
@@ -1561,8 +1587,25 @@ def wasender_webhook(request, user_id):
             elif secret_to_verify and not webhook_signature:
                 logger.warning(f"⚠️ Webhook signature expected but not provided - allowing in DEBUG mode")
         
+        # Queue the event and acknowledge right away; process_webhook_events does the work
+        from .webhook_queue import webhook_queue_enabled, enqueue_webhook
+        if webhook_queue_enabled():
+            try:
+                event = enqueue_webhook(user_id, payload)
+                processing_time = (time.time() - start_time) * 1000
+                logger.info(f"📬 WEBHOOK QUEUED | User: {user_id} | Event: {event_type} | ID: {event.id} | Time: {processing_time:.2f}ms")
+                return JsonResponse({
+                    'status': 'ok',
+                    'received': True,
+                    'queued': True,
+                    'event': event_type,
+                    'processing_time_ms': round(processing_time, 2)
+                })
+            except Exception as e:
+                logger.error(f"❌ Failed to queue webhook, processing inline: {e}")
+        
         # Process webhook - pass user_id for session isolation
-        service = WASenderService()
+        service = get_wasender_service()
         result = service.process_webhook(payload, user_id=user_id)
         
         # Calculate processing time
@@ -1596,9 +1639,9 @@ def wasender_webhook(request, user_id):
 def campaign_list(request):
     """
     List all campaigns with pagination (12 per page)
-    Dynamically calculate stats from messages for real-time updates
+    Stats are the campaigns' incrementally maintained counters
     """
-    campaigns_list = WASenderCampaign.objects.filter(user=request.user).order_by('-created_at')
+    campaigns_list = WASenderCampaign.objects.filter(user=request.user).defer('recipients').order_by('-created_at')
     
     # Add pagination - 12 items per page
     from django.core.paginator import Paginator
@@ -1607,58 +1650,8 @@ def campaign_list(request):
     page_number = request.GET.get('page')
     campaigns = paginator.get_page(page_number)
     
-    # Calculate real-time stats from messages for each campaign
-    from django.db.models import Q, Count
-    for campaign in campaigns:
-        # Get messages by metadata campaign_id first (newer method - works even after session deletion)
-        messages_qs = WASenderMessage.objects.filter(
-            metadata__campaign_id=campaign.id
-        )
-        
-        # Fallback to time-based if no metadata AND session exists
-        if not messages_qs.exists() and campaign.session:
-            messages_qs = WASenderMessage.objects.filter(
-                session=campaign.session,
-                created_at__gte=campaign.created_at
-            )
-            # If campaign has recipients list, filter by them
-            if campaign.recipients:
-                phones = [r.get('phone') for r in campaign.recipients if r.get('phone')]
-                if phones:
-                    messages_qs = messages_qs.filter(recipient__in=phones)
-        
-        # Calculate counts from actual messages
-        sent_count = messages_qs.filter(status__in=['sent', 'delivered', 'read']).count()
-        failed_count = messages_qs.filter(status='failed').count()
-        delivered_count = messages_qs.filter(status__in=['delivered', 'read']).count()
-        read_count = messages_qs.filter(status='read').count()
-        
-        # Check if stats changed before updating
-        stats_changed = (
-            campaign.messages_sent != sent_count or 
-            campaign.messages_failed != failed_count or
-            campaign.messages_delivered != delivered_count or
-            getattr(campaign, 'messages_read', 0) != read_count
-        )
-        
-        # Update campaign object with current stats (for display)
-        campaign.messages_sent = sent_count
-        campaign.messages_failed = failed_count
-        campaign.messages_delivered = delivered_count
-        campaign.messages_read = read_count
-        
-        # Also save to database if stats changed (for persistence)
-        if stats_changed:
-            try:
-                WASenderCampaign.objects.filter(id=campaign.id).update(
-                    messages_sent=sent_count,
-                    messages_failed=failed_count,
-                    messages_delivered=delivered_count,
-                    messages_read=read_count
-                )
-            except Exception:
-                pass
-    
+    # Stats come from the stored counters, which campaign_counters keeps current
+    # per message - no recount per campaign on the page
     context = {
         'campaigns': campaigns,
     }
@@ -1670,56 +1663,15 @@ def campaign_list(request):
 def campaign_detail(request, campaign_id):
     """
     Campaign detail and statistics
-    Dynamically calculate stats from messages for real-time updates
+    Stats are the campaign's incrementally maintained counters
     """
     from django.core.paginator import Paginator
     
-    campaign = get_object_or_404(WASenderCampaign, id=campaign_id, user=request.user)
-    
-    # Calculate real-time stats from messages
-    # Try metadata-based query first (most accurate - works even after session deletion)
-    messages_qs_metadata = WASenderMessage.objects.filter(
-        metadata__campaign_id=campaign.id
-    )
-    
-    # Time-based fallback only if session exists
-    messages_qs_time = None
-    if campaign.session:
-        messages_qs_time = WASenderMessage.objects.filter(
-            session=campaign.session,
-            created_at__gte=campaign.created_at
-        )
+    campaign = get_object_or_404(WASenderCampaign.objects.defer('recipients'), id=campaign_id, user=request.user)
     
-    # Use metadata query if it has messages, otherwise use time-based (if available)
-    # This ensures we always get stats even for old campaigns
-    if messages_qs_metadata.exists():
-        messages_qs = messages_qs_metadata
-    elif messages_qs_time is not None:
-        messages_qs = messages_qs_time
-    else:
-        messages_qs = messages_qs_metadata  # Empty queryset if no session and no metadata
-    
-    # Update campaign object with real-time stats
-    campaign.messages_sent = messages_qs.filter(status__in=['sent', 'delivered', 'read']).count()
-    campaign.messages_delivered = messages_qs.filter(status__in=['delivered', 'read']).count()
-    campaign.messages_read = messages_qs.filter(status='read').count()
-    campaign.messages_failed = messages_qs.filter(status='failed').count()
-    
-    # Also save to database for persistence
-    try:
-        WASenderCampaign.objects.filter(id=campaign.id).update(
-            messages_sent=campaign.messages_sent,
-            messages_failed=campaign.messages_failed,
-            messages_delivered=campaign.messages_delivered,
-            messages_read=campaign.messages_read
-        )
-    except Exception:
-        pass
-    
-    # Get messages for this campaign - prefer metadata linkage (works after session deletion)
-    # First try metadata-based query
+    # Get messages for this campaign - prefer the campaign link (works after session deletion)
     linked_qs = WASenderMessage.objects.filter(
-        metadata__campaign_id=campaign.id
+        campaign_id=campaign.id
     ).order_by('-created_at')
     
     if linked_qs.exists():
@@ -1731,12 +1683,9 @@ def campaign_detail(request, campaign_id):
             created_at__gte=campaign.created_at
         ).order_by('-created_at')
         
-        # Further filter by campaign recipients if available
-        if campaign.recipients:
-            phone_numbers = [recipient.get('phone') for recipient in campaign.recipients if recipient.get('phone')]
-            if phone_numbers:
-                unique_phone_numbers = list(set(phone_numbers))
-                messages_queryset = messages_queryset.filter(recipient__in=unique_phone_numbers)
+        # Further filter by campaign recipients if available (subquery, evaluated in the database)
+        if has_recipients(campaign):
+            messages_queryset = messages_queryset.filter(recipient__in=recipient_phones(campaign))
     else:
         # No session and no metadata - use empty queryset
         messages_queryset = linked_qs  # Empty queryset
@@ -1762,55 +1711,19 @@ def campaign_stats_api(request, campaign_id):
     """
     from django.http import JsonResponse
     
-    campaign = get_object_or_404(WASenderCampaign, id=campaign_id, user=request.user)
-    
-    # Calculate real-time stats from messages
-    # Try metadata-based query first (most accurate - works even after session deletion)
-    messages_qs_metadata = WASenderMessage.objects.filter(
-        metadata__campaign_id=campaign.id
-    )
-    
-    # Time-based fallback only if session exists
-    messages_qs_time = None
-    if campaign.session:
-        messages_qs_time = WASenderMessage.objects.filter(
-            session=campaign.session,
-            created_at__gte=campaign.created_at
-        )
-    
-    # Use metadata query if it has messages, otherwise use time-based (if available)
-    if messages_qs_metadata.exists():
-        messages_qs = messages_qs_metadata
-    elif messages_qs_time is not None:
-        messages_qs = messages_qs_time
-    else:
-        messages_qs = messages_qs_metadata  # Empty queryset if no session and no metadata
+    campaign = get_object_or_404(WASenderCampaign.objects.defer('recipients'), id=campaign_id, user=request.user)
     
-    # Calculate counts by status
-    messages_sent = messages_qs.filter(status__in=['sent', 'delivered', 'read']).count()
-    messages_delivered = messages_qs.filter(status__in=['delivered', 'read']).count()
-    messages_read = messages_qs.filter(status='read').count()
-    messages_failed = messages_qs.filter(status='failed').count()
+    # Counters are maintained per message (campaign_counters), so this poll is one row read
+    messages_sent = campaign.messages_sent
+    messages_delivered = campaign.messages_delivered
+    messages_read = campaign.messages_read
+    messages_failed = campaign.messages_failed
     
     # Calculate success rate
     success_rate = 0
     if campaign.total_recipients > 0:
         success_rate = round((messages_delivered / campaign.total_recipients) * 100, 2)
     
-    # Update database with latest stats
-    try:
-        WASenderCampaign.objects.filter(id=campaign.id).update(
-            messages_sent=messages_sent,
-            messages_delivered=messages_delivered,
-            messages_read=messages_read,
-            messages_failed=messages_failed
-        )
-    except Exception:
-        pass
-    
-    # Refresh campaign data from DB to get latest cooldown info
-    campaign.refresh_from_db()
-    
     return JsonResponse({
         'messages_sent': messages_sent,
         'messages_delivered': messages_delivered,
@@ -1828,6 +1741,28 @@ def campaign_stats_api(request, campaign_id):
     })
 
 
+@login_required
+def campaign_recipients_api(request, campaign_id):
+    """
+    API endpoint to page through a campaign's recipients and their send state
+    Query params: after (cursor from the previous page), limit (max 500), status
+    """
+    campaign = get_object_or_404(WASenderCampaign.objects.only('id'), id=campaign_id, user=request.user)
+
+    try:
+        after_id = max(int(request.GET.get('after', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', 100)), 1), 500)
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'after and limit must be integers'}, status=400)
+
+    recipients, next_cursor = recipients_page(campaign.id, after_id, limit, request.GET.get('status') or None)
+    return JsonResponse({
+        'success': True,
+        'recipients': recipients,
+        'next': next_cursor,
+    })
+
+
 @login_required
 @require_POST
 def stop_campaign(request, campaign_id):
@@ -1835,10 +1770,11 @@ def stop_campaign(request, campaign_id):
     Stop a running or pending campaign by setting status to 'paused'.
     The background task will detect this and halt gracefully.
     """
+    from .campaign_control import pause_campaign
+    
     campaign = get_object_or_404(WASenderCampaign, id=campaign_id, user=request.user)
-    if campaign.status in ['running', 'pending']:
-        campaign.status = 'paused'
-        campaign.save(update_fields=['status'])
+    # Writes the status and signals the send loop over the control channel
+    if pause_campaign(campaign):
         from django.contrib import messages
         messages.success(request, f"Campaign '{campaign.name}' has been stopped.")
     else:
@@ -1853,6 +1789,33 @@ def stop_campaign(request, campaign_id):
 
 # ==================== Retry Failed Messages ====================
 
+def _campaign_contacts_by_phone(campaign, service, phones):
+    """
+    Map normalized phone -> Contact from the campaign's list, for personalizing retries
+    """
+    from django.db.models import Q
+    from .models import Contact
+    from .phone_format import contact_e164
+
+    if not campaign.contact_list_id:
+        return {}
+    wanted = set(phones)
+    by_phone = {}
+    # Indexed (contact_list, phone_e164) lookup; rows not yet backfilled are formatted here
+    contacts = Contact.objects.filter(
+        Q(phone_e164__in=wanted) | Q(phone_e164=''),
+        contact_list_id=campaign.contact_list_id
+    ).only(
+        'phone_number', 'phone_e164', 'fields', 'first_name', 'last_name', 'email',
+        'custom_field_1', 'custom_field_2', 'custom_field_3'
+    )
+    for contact in contacts.iterator():
+        phone_norm = contact_e164(contact)
+        if phone_norm in wanted and phone_norm not in by_phone:
+            by_phone[phone_norm] = contact
+    return by_phone
+
+
 @login_required
 @require_POST
 def retry_failed_messages(request, campaign_id):
@@ -1869,32 +1832,46 @@ def retry_failed_messages(request, campaign_id):
         status__in=['failed', 'queued']
     ).order_by('created_at')
 
-    # Prefer metadata linkage when available
-    linked_failed = failed_qs.filter(metadata__campaign_id=campaign.id)
+    # Prefer the campaign link when available
+    linked_failed = failed_qs.filter(campaign_id=campaign.id)
     if linked_failed.exists():
         failed_qs = linked_failed
     else:
         # Fallback to campaign window and recipients
         failed_qs = failed_qs.filter(created_at__gte=campaign.created_at)
-        if campaign.recipients:
-            phones = [r.get('phone') for r in campaign.recipients if r.get('phone')]
-            if phones:
-                failed_qs = failed_qs.filter(recipient__in=list(set(phones)))
+        if has_recipients(campaign):
+            failed_qs = failed_qs.filter(recipient__in=recipient_phones(campaign))
 
     total_to_retry = failed_qs.count()
     if total_to_retry == 0:
         messages.info(request, "No failed messages to retry for this campaign.")
         return redirect('whatsappapi:campaign_detail', campaign_id=campaign.id)
 
-    service = WASenderService()
+    service = get_wasender_service()
     sent_now = 0
     failed_again = 0
+    resent_phones = []
+
+    # Personalize each retry exactly like the original campaign send
+    failed_messages = list(failed_qs)
+    template = compile_template(campaign.message_template)
+    contacts_by_phone = _campaign_contacts_by_phone(campaign, service, [fm.recipient for fm in failed_messages])
+
+    # Media is preflighted (or uploaded) once for the whole retry, not per recipient
+    media = None
+    if (campaign.message_type or 'text') != 'text':
+        media = resolve_campaign_media(
+            campaign, service, campaign.session,
+            campaign.media_url or campaign.attachment_url, campaign.message_type
+        )
 
-    for fm in failed_qs:
+    for fm in failed_messages:
         try:
             recipient = fm.recipient
             if (campaign.message_type or 'text') == 'text':
-                result = service.send_text_message(campaign.session, recipient, campaign.message_template)
+                contact = contacts_by_phone.get(recipient)
+                text = template.render(contact) if contact else campaign.message_template
+                result = service.send_text_message(campaign.session, recipient, text, campaign=campaign)
             else:
                 media_url = campaign.media_url or campaign.attachment_url
                 caption = campaign.description or ''
@@ -1903,15 +1880,22 @@ def retry_failed_messages(request, campaign_id):
                     recipient,
                     media_url,
                     campaign.message_type,
-                    caption=caption
+                    caption=caption,
+                    campaign=campaign,
+                    resolved=media
                 )
+                if forget_rejected_media(campaign, result, media_url, campaign.message_type):
+                    media = resolve_campaign_media(campaign, service, campaign.session, media_url, campaign.message_type)
             if result and result.status == 'sent':
                 sent_now += 1
+                resent_phones.append(recipient)
             else:
                 failed_again += 1
         except Exception:
             failed_again += 1
 
+    mark_recipients(campaign.id, resent_phones, 'sent')
+
     # Refresh campaign stats
     try:
         campaign.update_stats()
@@ -1941,11 +1925,14 @@ def retry_single_recipient(request, campaign_id):
         messages.error(request, "Recipient phone is required to retry.")
         return redirect('whatsappapi:campaign_detail', campaign_id=campaign.id)
 
-    service = WASenderService()
+    service = get_wasender_service()
     sent_now = False
     try:
         if (campaign.message_type or 'text') == 'text':
-            msg = service.send_text_message(campaign.session, recipient, campaign.message_template)
+            recipient_norm = service._format_phone_number(recipient)
+            contact = _campaign_contacts_by_phone(campaign, service, [recipient_norm]).get(recipient_norm)
+            text = compile_template(campaign.message_template).render(contact) if contact else campaign.message_template
+            msg = service.send_text_message(campaign.session, recipient, text, campaign=campaign)
         else:
             media_url = campaign.media_url or campaign.attachment_url
             caption = campaign.description or ''
@@ -1954,22 +1941,20 @@ def retry_single_recipient(request, campaign_id):
                 recipient,
                 media_url,
                 campaign.message_type,
-                caption=caption
+                caption=caption,
+                campaign=campaign,
+                resolved=resolve_campaign_media(campaign, service, campaign.session, media_url, campaign.message_type)
             )
+            forget_rejected_media(campaign, msg, media_url, campaign.message_type)
 
-        # Tag message with campaign id for linkage
         if msg:
-            try:
-                meta = msg.metadata or {}
-                meta.update({'campaign_id': campaign.id})
-                msg.metadata = meta
-                msg.save(update_fields=['metadata'])
-            except Exception:
-                pass
             sent_now = (msg.status == 'sent')
     except Exception:
         sent_now = False
 
+    if sent_now:
+        mark_recipients(campaign.id, [service._format_phone_number(recipient)], 'sent')
+
     # Refresh stats
     try:
         campaign.update_stats()
@@ -2033,9 +2018,7 @@ def remove_optout(request, optout_id):
         return JsonResponse({'success': False, 'error': 'Invalid request method'})
     
     try:
-        optout = OptOutContact.objects.get(id=optout_id, user=request.user)
-        phone = optout.phone_number
-        optout.delete()
+        phone = OptOutContact.remove_optout(request.user, optout_id)
         return JsonResponse({
             'success': True,
             'message': f'Contact {phone} removed from opt-out list'
@@ -2144,11 +2127,12 @@ def export_optout_excel(request):
 @login_required
 def upload_contacts(request):
     """
-    Upload and process contact list file (CSV/XLSX)
+    Upload a contact list file (CSV/XLSX) and import it in the background
     """
     from django.http import JsonResponse
-    from .models import ContactList, Contact
-    import pandas as pd
+    from .models import ContactList
+    from .contact_import import sniff_header, contact_list_payload, publish_contact_list_event, queue_contact_import
+    import uuid
     import logging
     
     logger = logging.getLogger(__name__)
@@ -2156,6 +2140,7 @@ def upload_contacts(request):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Invalid request method'})
     
+    file_path = None
     try:
         # Get uploaded file and parameters
         uploaded_file = request.FILES.get('file')
@@ -2169,22 +2154,26 @@ def upload_contacts(request):
         if not list_name:
             return JsonResponse({'success': False, 'error': 'Contact list name is required'})
         
-        # Read file based on extension
         file_extension = uploaded_file.name.split('.')[-1].lower()
-        
-        if file_extension == 'csv':
-            df = pd.read_csv(uploaded_file)
-        elif file_extension in ['xlsx', 'xls']:
-            df = pd.read_excel(uploaded_file)
-        else:
+        if file_extension not in ['csv', 'xlsx', 'xls']:
             return JsonResponse({'success': False, 'error': 'Unsupported file format'})
         
-        # Validate required columns
-        if 'phone' not in df.columns:
+        # Save to temporary location for the background import
+        temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp_uploads')
+        os.makedirs(temp_dir, exist_ok=True)
+        file_path = os.path.join(temp_dir, f"{uuid.uuid4()}.{file_extension}")
+        with open(file_path, 'wb+') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+        
+        # Validate required columns (header row only; the body is streamed by the import job)
+        header = sniff_header(file_path, file_extension)
+        if 'phone' not in header.columns:
+            os.remove(file_path)
             return JsonResponse({'success': False, 'error': 'Phone column is required in the file'})
         
         # Get all CSV headers (excluding 'phone') for dynamic fields
-        available_fields = [col for col in df.columns if col != 'phone']
+        available_fields = header.available_fields
         
         # Create ContactList
         contact_list = ContactList.objects.create(
@@ -2192,135 +2181,32 @@ def upload_contacts(request):
             name=list_name,
             file_name=uploaded_file.name,
             country_code=f"+{country_code}" if country_code else '',
-            total_contacts=0,  # Will update after processing
+            total_contacts=0,  # Updated by the import job as chunks land
             valid_contacts=0,
             available_fields=available_fields  # Store CSV headers dynamically
         )
-
-        # Broadcast: new contact list created
-        try:
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            from django.utils import timezone
-
-            channel_layer = get_channel_layer()
-            formatted_created_at = timezone.localtime(contact_list.created_at).strftime("%d/%m/%Y, %H:%M:%S")
-            async_to_sync(channel_layer.group_send)(
-                f"user_updates_{request.user.id}",
-                {
-                    'type': 'contact_list_created',
-                    'list': {
-                        'id': contact_list.id,
-                        'name': contact_list.name,
-                        'total_contacts': contact_list.total_contacts,
-                        'created_at': formatted_created_at,
-                    }
-                }
-            )
-        except Exception:
-            pass
-        
-        # Remove duplicate phone numbers from DataFrame
-        df_cleaned = df.drop_duplicates(subset=['phone'], keep='first')
-        duplicates_removed = len(df) - len(df_cleaned)
         
-        if duplicates_removed > 0:
-            logger.info(f"Removed {duplicates_removed} duplicate phone numbers from upload")
-        
-        # Process contacts (limit to 10000)
-        contacts_added = 0
-        seen_phones = set()  # Track phones to prevent duplicates within this upload
-        
-        for index, row in df_cleaned.head(10000).iterrows():
-            try:
-                phone = str(row.get('phone', '')).strip()
-                
-                if not phone:
-                    continue
-                
-                # Add country code if single country mode
-                if country_type == 'single' and country_code:
-                    # Remove leading zeros
-                    phone = phone.lstrip('0')
-                    # Add country code if not present
-                    if not phone.startswith(country_code):
-                        phone = f"{country_code}{phone}"
-                
-                # Skip if this phone was already processed in this upload
-                if phone in seen_phones:
-                    logger.debug(f"Skipping duplicate phone in same upload: {phone}")
-                    continue
-                
-                # Check if phone already exists in THIS contact list
-                if Contact.objects.filter(contact_list=contact_list, phone_number=phone).exists():
-                    logger.debug(f"Skipping existing phone in contact list: {phone}")
-                    continue
-                
-                seen_phones.add(phone)
-                
-                # Build dynamic fields dictionary (all columns except 'phone')
-                contact_fields = {}
-                for col in df.columns:
-                    if col != 'phone':
-                        value = row.get(col, '')
-                        contact_fields[col] = str(value) if pd.notna(value) else ''
-                
-                # Create contact with dynamic fields
-                Contact.objects.create(
-                    contact_list=contact_list,
-                    phone_number=phone,
-                    fields=contact_fields,  # Store all CSV fields dynamically
-                    # Backward compatibility - populate specific fields if they exist
-                    first_name=contact_fields.get('first_name', ''),
-                    last_name=contact_fields.get('last_name', ''),
-                    email=contact_fields.get('email', ''),
-                    custom_field_1=contact_fields.get('custom_field_1', ''),
-                    custom_field_2=contact_fields.get('custom_field_2', ''),
-                    custom_field_3=contact_fields.get('custom_field_3', '')
-                )
-                contacts_added += 1
-                
-            except Exception as e:
-                logger.warning(f"Error processing contact at row {index}: {e}")
-                continue
+        # Broadcast: new contact list created
+        publish_contact_list_event(contact_list, 'contact_list_created')
         
-        # Update contact list counts
-        contact_list.total_contacts = contacts_added
-        contact_list.save()
-
-        # Broadcast: contacts count updated
-        try:
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            from django.utils import timezone
-
-            channel_layer = get_channel_layer()
-            formatted_created_at = timezone.localtime(contact_list.created_at).strftime("%d/%m/%Y, %H:%M:%S")
-            async_to_sync(channel_layer.group_send)(
-                f"user_updates_{request.user.id}",
-                {
-                    'type': 'contacts_count_updated',
-                    'list': {
-                        'id': contact_list.id,
-                        'name': contact_list.name,
-                        'total_contacts': contact_list.total_contacts,
-                        'created_at': formatted_created_at,
-                    }
-                }
-            )
-        except Exception:
-            pass
+        task_id = queue_contact_import(contact_list, file_path, country_code, country_type)
+        logger.info(f"Contact import queued for list {contact_list.id}: {task_id}")
         
         return JsonResponse({
             'success': True,
-            'total_contacts': contacts_added,
+            'status': 'importing',
             'list_id': contact_list.id,
-            'duplicates_removed': duplicates_removed,
-            'message': f'Successfully imported {contacts_added} contacts' + (f' ({duplicates_removed} duplicates removed)' if duplicates_removed > 0 else '')
+            'list': contact_list_payload(contact_list),
+            'message': f'Importing contacts into "{contact_list.name}" in the background'
         })
         
     except Exception as e:
         logger.error(f"Error uploading contacts: {e}")
+        if file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except Exception:
+                pass
         return JsonResponse({'success': False, 'error': str(e)})
 
 
@@ -2794,21 +2680,18 @@ def export_campaign_messages_excel(request, campaign_id):
             session=campaign.session
         ).order_by('-created_at')
         
-        # Prefer metadata linkage (campaign_id) if available; use JSON key transform
-        linked_qs = messages_qs.filter(metadata__campaign_id=campaign.id)
+        # Prefer the campaign link if available (also finds messages whose session was deleted)
+        linked_qs = WASenderMessage.objects.filter(campaign_id=campaign.id).order_by('-created_at')
         if linked_qs.exists():
             messages = linked_qs
         else:
             # Fallback to created_at window
             messages = messages_qs.filter(created_at__gte=campaign.created_at)
         
-        # Further filter by recipients only if not using metadata linkage
+        # Further filter by recipients only if not using the campaign link
         if not linked_qs.exists():
-            if campaign.recipients:
-                phone_numbers = [recipient.get('phone') for recipient in campaign.recipients if recipient.get('phone')]
-                if phone_numbers:
-                    unique_phone_numbers = list(set(phone_numbers))
-                    messages = messages.filter(recipient__in=unique_phone_numbers)
+            if has_recipients(campaign):
+                messages = messages.filter(recipient__in=recipient_phones(campaign))
             else:
                 # SQLite does not support DISTINCT ON; pick latest per recipient via Subquery
                 try:
@@ -2830,10 +2713,12 @@ def export_campaign_messages_excel(request, campaign_id):
         
         # Calculate statistics
         total_messages = messages.count()
-        messages_sent = messages.filter(status__in=['sent', 'delivered', 'read']).count()
-        messages_delivered = messages.filter(status__in=['delivered', 'read']).count()
-        messages_read = messages.filter(status='read').count()
-        messages_failed = messages.filter(status='failed').count()
+        from .campaign_counters import count_statuses
+        counts = count_statuses(messages)
+        messages_sent = counts['messages_sent']
+        messages_delivered = counts['messages_delivered']
+        messages_read = counts['messages_read']
+        messages_failed = counts['messages_failed']
         messages_pending = messages.filter(status='pending').count()
         
         success_rate = 0
@@ -3146,7 +3031,7 @@ def update_all_webhooks(request):
         messages.warning(request, "No sessions found to update")
         return redirect('whatsappapi:dashboard')
     
-    service = WASenderService()
+    service = get_wasender_service()
     updated_count = 0
     failed_count = 0
     
@@ -0,0 +1,222 @@
+"""
+WASender Upstream Circuit Breaker
+Process-wide health state for the WASender API, shared across workers.
+
+Replaces the per-message HEAD/GET availability probe. The breaker is driven by
+the real outcomes of API calls (5xx, timeouts, Cloudflare HTML pages) and an
+occasional background probe while the circuit is open:
+
+    closed     upstream healthy; requests pass with zero extra network calls
+    open       upstream down; requests fail fast until the cooldown elapses
+    half_open  cooldown elapsed; a single trial request decides open/closed
+
+State lives in the Django cache (Redis in production) so every gunicorn and
+Django-Q worker sees the same circuit, with a short in-process snapshot so the
+hot path does not hit the cache on every send.
+
+Settings (all optional):
+    WASENDER_CIRCUIT_FAILURE_THRESHOLD  failures within the window that open the circuit (default 5)
+    WASENDER_CIRCUIT_FAILURE_WINDOW     seconds failures are counted over (default 60)
+    WASENDER_CIRCUIT_OPEN_SECONDS       fail-fast cooldown before a trial request (default 30)
+    WASENDER_CIRCUIT_PROBE_INTERVAL     min seconds between background probes (default 15)
+    WASENDER_CIRCUIT_CACHE_SECONDS      in-process state snapshot lifetime (default 2)
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def is_upstream_failure(response):
+    """
+    Classify an API response as an upstream outage signal.
+
+    Connection failures/timeouts (None or the status 0 placeholder), 5xx and
+    an HTML page in place of a 2xx/3xx JSON answer (Cloudflare interstitials)
+    count as failures. 4xx responses, HTML or not, mean upstream is alive:
+    route fallbacks expect HTML 404/405 pages from unsupported paths.
+    """
+    if response is None:
+        return True
+    status = getattr(response, 'status_code', 0) or 0
+    if status == 0 or status >= 500:
+        return True
+    if status >= 400:
+        return False
+    try:
+        content_type = response.headers.get('Content-Type', '')
+    except Exception:
+        content_type = ''
+    return 'text/html' in content_type
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker whose state is shared through the Django cache"""
+
+    def __init__(self, name, probe_url):
+        digest = hashlib.sha1(str(probe_url).encode()).hexdigest()[:12]
+        self.name = name
+        self.probe_url = probe_url
+        self._state_key = f"circuit:{name}:{digest}:state"
+        self._failures_key = f"circuit:{name}:{digest}:failures"
+        self._trial_key = f"circuit:{name}:{digest}:trial"
+        self._probe_key = f"circuit:{name}:{digest}:probe"
+        self._local = None
+        self._local_expires = 0.0
+        self._lock = threading.Lock()
+
+    # ---- state storage ----
+
+    def _read_state(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._local is not None and now < self._local_expires:
+                return self._local
+        try:
+            state = cache.get(self._state_key) or {'state': CLOSED}
+        except Exception as e:
+            # Cache outage must never block sending; assume healthy
+            logger.debug(f"Circuit {self.name}: cache read failed ({e}); assuming closed")
+            state = {'state': CLOSED}
+        self._remember(state)
+        return state
+
+    def _remember(self, state):
+        with self._lock:
+            self._local = state
+            self._local_expires = time.monotonic() + _setting('WASENDER_CIRCUIT_CACHE_SECONDS', 2)
+
+    def _write_state(self, state):
+        self._remember(state)
+        try:
+            if state['state'] == CLOSED:
+                cache.delete_many([self._state_key, self._failures_key, self._trial_key])
+            else:
+                cache.set(self._state_key, state, None)
+        except Exception as e:
+            logger.debug(f"Circuit {self.name}: cache write failed ({e})")
+
+    @property
+    def state(self):
+        return self._read_state()['state']
+
+    # ---- transitions ----
+
+    def _open(self, reason):
+        self._write_state({'state': OPEN, 'opened_at': time.time(), 'reason': reason})
+        logger.warning(f"⛔ Circuit {self.name} OPEN: {reason}")
+
+    def _close(self):
+        if self._read_state()['state'] != CLOSED:
+            logger.info(f"✅ Circuit {self.name} CLOSED: upstream recovered")
+        self._write_state({'state': CLOSED})
+
+    def allow_request(self):
+        """
+        Return True if a request to upstream should be attempted.
+
+        Never performs network I/O on the caller's thread.
+        """
+        state = self._read_state()
+        if state['state'] == CLOSED:
+            return True
+
+        open_seconds = _setting('WASENDER_CIRCUIT_OPEN_SECONDS', 30)
+        elapsed = time.time() - float(state.get('opened_at') or 0)
+        if elapsed < open_seconds:
+            self._maybe_probe()
+            return False
+
+        # Cooldown over: let exactly one caller through as the half-open trial
+        try:
+            acquired = cache.add(self._trial_key, 1, open_seconds)
+        except Exception:
+            acquired = True
+        if acquired:
+            self._write_state({**state, 'state': HALF_OPEN})
+            logger.info(f"🔁 Circuit {self.name} HALF-OPEN: allowing trial request")
+        return acquired
+
+    def record(self, response):
+        """Feed the outcome of a real API call into the breaker"""
+        if is_upstream_failure(response):
+            status = getattr(response, 'status_code', None) if response is not None else None
+            self.record_failure(f"status {status}" if status else 'connection error/timeout')
+        else:
+            self.record_success()
+
+    def record_success(self):
+        # Closed + success is the hot path: no cache writes at all
+        if self._read_state()['state'] != CLOSED:
+            self._close()
+
+    def record_failure(self, reason='upstream failure'):
+        state = self._read_state()
+        if state['state'] == HALF_OPEN:
+            self._open(f"trial request failed ({reason})")
+            return
+        if state['state'] == OPEN:
+            return
+
+        window = _setting('WASENDER_CIRCUIT_FAILURE_WINDOW', 60)
+        try:
+            cache.add(self._failures_key, 0, window)
+            failures = cache.incr(self._failures_key)
+        except Exception:
+            failures = 1
+        if failures >= _setting('WASENDER_CIRCUIT_FAILURE_THRESHOLD', 5):
+            self._open(f"{failures} failures within {window}s (last: {reason})")
+
+    # ---- background probe ----
+
+    def _maybe_probe(self):
+        """Occasionally probe upstream in the background while the circuit is open"""
+        try:
+            if not cache.add(self._probe_key, 1, _setting('WASENDER_CIRCUIT_PROBE_INTERVAL', 15)):
+                return
+        except Exception:
+            return
+        threading.Thread(target=self._probe, daemon=True).start()
+
+    def _probe(self):
+        from whatsappapi.wasender_transport import get_http_session
+        try:
+            resp = get_http_session().head(self.probe_url, timeout=8, allow_redirects=True)
+        except Exception:
+            resp = None
+        # The bare base URL may legitimately answer with an HTML 404/405 page
+        if resp is not None and resp.status_code < 500:
+            self._close()
+        else:
+            logger.info(f"Circuit {self.name}: background probe still failing")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit(probe_url, name='wasender'):
+    """Return the process-wide breaker for an upstream base URL"""
+    with _breakers_lock:
+        breaker = _breakers.get(probe_url)
+        if breaker is None:
+            breaker = CircuitBreaker(name, probe_url)
+            _breakers[probe_url] = breaker
+        return breaker
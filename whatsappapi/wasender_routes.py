@@ -0,0 +1,124 @@
+"""
+WASender Endpoint Route Registry
+Remembers which endpoint variant works for each API operation.
+
+Different WASender deployments expose the same operation under different
+paths (e.g. /send-message vs /messages/send-message, PUT vs POST upload).
+Instead of walking the whole fallback chain on every call, the working route
+is remembered per BASE_URL and per API key in the Django cache and tried
+first next time. A remembered route that answers 404/405 is invalidated.
+
+Settings (all optional):
+    WASENDER_ROUTE_CACHE_SECONDS   how long a discovered route is trusted (default 21600 = 6h)
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def _route_id(route):
+    """Routes are URLs or (method, url) tuples; store them as plain strings"""
+    return route if isinstance(route, str) else ' '.join(route)
+
+
+class RouteRegistry:
+    """Per-operation endpoint memory shared across workers through the Django cache"""
+
+    def __init__(self, base_url):
+        self._base_digest = hashlib.sha1(str(base_url).encode()).hexdigest()[:12]
+        self._local = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ttl():
+        try:
+            return int(getattr(settings, 'WASENDER_ROUTE_CACHE_SECONDS', 21600))
+        except (TypeError, ValueError):
+            return 21600
+
+    def _key(self, operation, api_key):
+        key_digest = hashlib.sha256(str(api_key or '').encode()).hexdigest()[:16]
+        return f"wasender:route:{self._base_digest}:{operation}:{key_digest}"
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+        try:
+            route = cache.get(key)
+        except Exception:
+            route = None
+        if route:
+            with self._lock:
+                self._local[key] = (route, now + min(self._ttl(), 60))
+        return route
+
+    def ordered(self, operation, api_key, candidates):
+        """
+        Return candidates with the remembered working route moved to the front.
+
+        Args:
+            operation: Logical operation name ('send', 'check', 'upload', ...)
+            api_key: Session API key the route was discovered with
+            candidates: Fallback chain in default order
+
+        Returns:
+            list: Same candidates, remembered route first when known
+        """
+        remembered = self._get(self._key(operation, api_key))
+        if not remembered:
+            return list(candidates)
+        preferred = [r for r in candidates if _route_id(r) == remembered]
+        if not preferred:
+            return list(candidates)
+        return preferred + [r for r in candidates if _route_id(r) != remembered]
+
+    def remember(self, operation, api_key, route):
+        """Record the route that just succeeded (no-op when already remembered)"""
+        key = self._key(operation, api_key)
+        route_id = _route_id(route)
+        if self._get(key) == route_id:
+            return
+        try:
+            cache.set(key, route_id, self._ttl())
+        except Exception as e:
+            logger.debug(f"Route cache write failed for {operation}: {e}")
+        with self._lock:
+            self._local[key] = (route_id, time.monotonic() + min(self._ttl(), 60))
+        logger.info(f"📍 Remembered WASender route for {operation}: {route_id}")
+
+    def invalidate(self, operation, api_key, route):
+        """Forget the remembered route if it is the one that just returned 404/405"""
+        key = self._key(operation, api_key)
+        if self._get(key) != _route_id(route):
+            return
+        try:
+            cache.delete(key)
+        except Exception:
+            pass
+        with self._lock:
+            self._local.pop(key, None)
+        logger.info(f"Invalidated WASender route for {operation}: {_route_id(route)}")
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_route_registry(base_url):
+    """Return the process-wide route registry for an upstream base URL"""
+    with _registries_lock:
+        registry = _registries.get(base_url)
+        if registry is None:
+            registry = RouteRegistry(base_url)
+            _registries[base_url] = registry
+        return registry
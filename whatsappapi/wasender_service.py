@@ -8,17 +8,38 @@ import requests
 import logging
 import base64
 import io
+import os
+import threading
 from datetime import datetime, timezone as dt_timezone
 from django.conf import settings
 from django.utils import timezone
-from cryptography.fernet import Fernet
 import qrcode
 from PIL import Image
 from userpanel.models import WASenderSession, WASenderMessage, WASenderIncomingMessage, OptOutContact
+from whatsappapi.wasender_transport import get_http_session
+from whatsappapi.wasender_circuit import get_circuit
+from whatsappapi.wasender_routes import get_route_registry
+from whatsappapi.session_index import hash_session_key, resolve_session
+from whatsappapi.campaign_counters import transition_message_status
+from whatsappapi.phone_format import format_e164
+from whatsappapi.session_credentials import decrypt_token, get_cipher, session_api_key
+from whatsappapi.media_resolver import clean_media_url
+from whatsappapi.media_upload import Base64JsonBody, MediaTooLarge, check_size, download_media
 
 logger = logging.getLogger(__name__)
 
 
+# Delivery progression; a webhook never moves a message backwards along it
+_STATUS_RANK = {'queued': 0, 'sending': 1, 'sent': 2, 'delivered': 3, 'read': 4, 'played': 5}
+
+
+def _status_regresses(old_status, new_status):
+    """True if new_status is an earlier delivery stage than old_status (out-of-order webhook)"""
+    if old_status not in _STATUS_RANK or new_status not in _STATUS_RANK:
+        return False
+    return _STATUS_RANK[new_status] < _STATUS_RANK[old_status]
+
+
 # Helper to avoid dumping raw HTML or oversized bodies into logs
 def _brief_response_text(response, max_len: int = 300) -> str:
     """Return a short, sanitized summary of an HTTP response body for logging.
@@ -74,7 +95,21 @@ class WASenderService:
     def __init__(self):
         # Personal Access Token (from settings page) - used for session management
         self.personal_access_token = getattr(settings, 'WASENDER_PERSONAL_ACCESS_TOKEN', '')
-        self.encryption_key = getattr(settings, 'ENCRYPTION_KEY', Fernet.generate_key())
+        # Built once per process (session_credentials), not per encrypt/decrypt
+        self.cipher = get_cipher()
+        # Everything but Authorization is the same on every request
+        self._base_headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            # Provide an explicit User-Agent to avoid generic clients being blocked by WAF/CDN
+            "User-Agent": "WA-Campaign-Sender/1.0 (+https://wasenderapi.com)",
+            # Help CDNs/WAFs treat these as API requests
+            "X-Requested-With": "XMLHttpRequest",
+            # Some gateways prefer a referer; allow override via settings
+            "Referer": getattr(settings, 'WASENDER_REFERER', 'https://wasenderapi.com')
+        }
+        # Per-thread webhook context, so one shared instance can serve concurrent webhooks
+        self._webhook_context = threading.local()
         
         # Debug: Log token status
         if self.personal_access_token:
@@ -87,48 +122,51 @@ class WASenderService:
         # None = unknown, True = supported, False = unsupported
         self.check_whatsapp_supported = None
     
+    @property
+    def http(self):
+        """Pooled keep-alive HTTP session shared by every service instance in this process"""
+        return get_http_session()
+    
+    @property
+    def circuit(self):
+        """Shared upstream-health circuit breaker for BASE_URL"""
+        return get_circuit(self.BASE_URL)
+    
+    @property
+    def routes(self):
+        """Shared registry of the endpoint variants that work on BASE_URL"""
+        return get_route_registry(self.BASE_URL)
+    
+    @property
+    def _webhook_user_id(self):
+        return getattr(self._webhook_context, 'user_id', None)
+    
+    @_webhook_user_id.setter
+    def _webhook_user_id(self, user_id):
+        self._webhook_context.user_id = user_id
+    
     def _get_headers(self, token=None):
         """Get API request headers with authentication"""
         return {
             "Authorization": f"Bearer {token or self.personal_access_token}",
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            # Provide an explicit User-Agent to avoid generic clients being blocked by WAF/CDN
-            "User-Agent": "WA-Campaign-Sender/1.0 (+https://wasenderapi.com)",
-            # Help CDNs/WAFs treat these as API requests
-            "X-Requested-With": "XMLHttpRequest",
-            # Some gateways prefer a referer; allow override via settings
-            "Referer": getattr(settings, 'WASENDER_REFERER', 'https://wasenderapi.com')
+            **self._base_headers
         }
     
     def _encrypt_token(self, token):
         """Encrypt API token for secure storage"""
         try:
-            cipher = Fernet(self.encryption_key)
-            return cipher.encrypt(token.encode()).decode()
+            return self.cipher.encrypt(token.encode()).decode()
         except Exception as e:
             logger.error(f"Token encryption error: {e}")
             return token  # Fallback to plain text (not recommended for production)
     
     def _decrypt_token(self, encrypted_token):
         """Decrypt stored API token with fallback for unencrypted tokens"""
-        if not encrypted_token:
-            return ''
-        
-        try:
-            cipher = Fernet(self.encryption_key)
-            return cipher.decrypt(encrypted_token.encode()).decode()
-        except Exception as e:
-            # If decryption fails, token might be plain text or encrypted with old key
-            # Avoid mistakenly sending Fernet ciphertext as a Bearer token.
-            # If the token looks like Fernet ('gAAAAA' prefix), return empty string
-            # so header generation falls back to the personal access token.
-            try:
-                looks_like_fernet = str(encrypted_token).startswith('gAAAAA')
-            except Exception:
-                looks_like_fernet = False
-            logger.warning(f"Token decryption failed; looks_like_fernet={looks_like_fernet}. Error: {str(e)[:50]}")
-            return '' if looks_like_fernet else encrypted_token
+        return decrypt_token(encrypted_token)
+    
+    def _session_api_key(self, session):
+        """Decrypted API key of a session, cached per process (session_credentials)"""
+        return session_api_key(session)
 
     def _send_with_retry(self, endpoint, headers, payload, max_retries=3, timeout=30):
         """
@@ -149,12 +187,13 @@ class WASenderService:
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
+                response = self.http.post(
                     endpoint,
                     headers=headers,
                     json=payload,
                     timeout=timeout
                 )
+                self.circuit.record(response)
                 
                 # Handle rate limiting (429) - respect retry_after
                 if response.status_code == 429:
@@ -187,6 +226,7 @@ class WASenderService:
                 return response
                 
             except (requests.Timeout, requests.ConnectionError) as e:
+                self.circuit.record(None)
                 if attempt == max_retries - 1:
                     logger.error(f"Connection failed after {max_retries} attempts: {e}")
                     return None
@@ -206,23 +246,13 @@ class WASenderService:
         return None
     
     def _is_api_available(self) -> bool:
-        """Lightweight check to detect upstream outage (e.g., Cloudflare 5xx).
+        """Detect upstream outage (e.g., Cloudflare 5xx) without probing per message.
 
-        Returns False when the base API appears to be down so callers can fail fast
-        and avoid collapsing send logic with repeated 5xx HTML pages.
+        Consults the shared circuit breaker, which is fed by the real outcomes of
+        send/upload/check calls. Returns False while the circuit is open so callers
+        can fail fast and avoid collapsing send logic with repeated 5xx HTML pages.
         """
-        try:
-            # HEAD first to avoid downloading HTML; treat 405/404 as available
-            resp = requests.head(self.BASE_URL, headers=self._get_headers(), timeout=8, allow_redirects=True)
-            if resp.status_code >= 500:
-                return False
-            if resp.status_code in (200, 301, 302, 304, 204, 405, 404):
-                return True
-            # As a fallback, a quick GET to confirm availability
-            resp2 = requests.get(self.BASE_URL, headers=self._get_headers(), timeout=8, allow_redirects=True)
-            return not (resp2.status_code >= 500)
-        except Exception:
-            return False
+        return self.circuit.allow_request()
     
     # ==================== Session Management ====================
     
@@ -235,7 +265,7 @@ class WASenderService:
             list of session data or None
         """
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.BASE_URL}/whatsapp-sessions",
                 headers=self._get_headers(),
                 timeout=30
@@ -306,7 +336,7 @@ class WASenderService:
             logger.info(f"Headers: {self._get_headers()}")
             logger.info(f"Payload: {payload}")
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.BASE_URL}/whatsapp-sessions",
                 headers=self._get_headers(),
                 json=payload,
@@ -330,6 +360,7 @@ class WASenderService:
                     session_id=str(session_id),
                     session_name=session_name,
                     api_token=self._encrypt_token(api_key),
+                    api_key_hash=hash_session_key(api_key) or None,
                     phone_number=phone_number,  # Store initial phone number
                     webhook_url=webhook_url,
                     status='disconnected'  # Initial status
@@ -398,7 +429,7 @@ class WASenderService:
             logger.info(f"📝 Updating webhook for session {session.session_id}")
             logger.info(f"📝 New webhook URL: {webhook_url}")
             
-            response = requests.put(
+            response = self.http.put(
                 url,
                 headers=self._get_headers(),
                 json=payload,
@@ -437,7 +468,7 @@ class WASenderService:
             url = f"{self.BASE_URL}/whatsapp-sessions/{session.session_id}/connect"
             logger.info(f"Connecting session at: {url}")
             
-            response = requests.post(
+            response = self.http.post(
                 url,
                 headers=self._get_headers(),
                 timeout=30
@@ -479,7 +510,7 @@ class WASenderService:
             url = f"{self.BASE_URL}/whatsapp-sessions/{session.session_id}/qrcode"
             logger.info(f"Fetching QR code from: {url}")
             
-            response = requests.get(
+            response = self.http.get(
                 url,
                 headers=self._get_headers(),
                 timeout=30
@@ -543,7 +574,7 @@ class WASenderService:
         try:
             # Use personal access token (not session API key) for status checks
             # Session API key returns 401 for status endpoint
-            response = requests.get(
+            response = self.http.get(
                 f"{self.BASE_URL}/whatsapp-sessions/{session.session_id}",
                 headers=self._get_headers(),  # Uses personal access token
                 timeout=15  # Short timeout for status check
@@ -608,7 +639,7 @@ class WASenderService:
         """
         try:
             # Get session details
-            response = requests.get(
+            response = self.http.get(
                 f"{self.BASE_URL}/whatsapp-sessions/{session.session_id}",
                 headers=self._get_headers(),
                 timeout=30
@@ -735,9 +766,9 @@ class WASenderService:
         """
         try:
             # Get session-specific API key
-            session_api_key = self._decrypt_token(session.api_token)
+            session_api_key = self._session_api_key(session)
             
-            response = requests.get(
+            response = self.http.get(
                 f"{self.BASE_URL}/user",
                 headers=self._get_headers(session_api_key),
                 timeout=30
@@ -786,7 +817,7 @@ class WASenderService:
             url = f"{self.BASE_URL}/whatsapp-sessions/{session.session_id}/disconnect"
             logger.info(f"Disconnecting session at: {url}")
             
-            response = requests.post(
+            response = self.http.post(
                 url,
                 headers=self._get_headers(),
                 timeout=30
@@ -837,7 +868,7 @@ class WASenderService:
             bool: True if successful or session doesn't exist (404)
         """
         try:
-            response = requests.delete(
+            response = self.http.delete(
                 f"{self.BASE_URL}/whatsapp-sessions/{session.session_id}",
                 headers=self._get_headers(),
                 timeout=30
@@ -871,17 +902,7 @@ class WASenderService:
         Returns:
             str: E.164 formatted phone (+1234567890)
         """
-        if not phone:
-            return ''
-        
-        # Remove all spaces, dashes, and other non-digit characters except +
-        phone = ''.join(c for c in str(phone) if c.isdigit() or c == '+')
-        
-        # Ensure + prefix
-        if not phone.startswith('+'):
-            phone = '+' + phone
-        
-        return phone
+        return format_e164(phone)
 
     def _is_valid_e164(self, phone: str) -> bool:
         """
@@ -1045,7 +1066,7 @@ class WASenderService:
             bool: True if successful
         """
         try:
-            session_api_key = self._decrypt_token(session.api_token)
+            session_api_key = self._session_api_key(session)
             
             # Format JID if not already formatted
             if not recipient_jid.endswith('@s.whatsapp.net'):
@@ -1058,7 +1079,7 @@ class WASenderService:
                 "type": presence_type
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.BASE_URL}/send-presence-update",
                 headers=self._get_headers(session_api_key),
                 json=payload,
@@ -1076,7 +1097,14 @@ class WASenderService:
             logger.warning(f"Presence update error (non-critical): {e}")
             return False
     
-    def send_text_message(self, session, recipient, message, send_typing=True):
+    @staticmethod
+    def _campaign_link(campaign):
+        """Create() kwargs that tag a message with its campaign at insert time"""
+        if campaign is None:
+            return {}
+        return {'campaign': campaign, 'metadata': {'campaign_id': campaign.id}}
+    
+    def send_text_message(self, session, recipient, message, send_typing=True, campaign=None):
         """
         Send text message via WhatsApp
         POST /api/send-message
@@ -1086,6 +1114,7 @@ class WASenderService:
             recipient: Phone number (without + or country code)
             message: Message text
             send_typing: If True, send "typing..." indicator before message (more human-like)
+            campaign: Optional WASenderCampaign the message is recorded under
         
         Returns:
             WASenderMessage instance or None
@@ -1096,8 +1125,10 @@ class WASenderService:
             logger.warning(f"Rate limit exceeded: {error_msg}")
             return None
         
+        campaign_link = self._campaign_link(campaign)
+        
         # Get session-specific API key
-        session_api_key = self._decrypt_token(session.api_token)
+        session_api_key = self._session_api_key(session)
         
         # Send typing indicator to make message look more human (optional, non-blocking)
         # This helps prevent WhatsApp from detecting bot-like behavior
@@ -1120,7 +1151,8 @@ class WASenderService:
                     message_type='text',
                     content=message,
                     status='queued',
-                    error_message=error_text
+                    error_message=error_text,
+                    **campaign_link
                 )
             else:
                 return WASenderMessage.objects.create(
@@ -1130,7 +1162,8 @@ class WASenderService:
                     message_type='text',
                     content=message,
                     status='failed',
-                    error_message=error_text
+                    error_message=error_text,
+                    **campaign_link
                 )
         
         # Format phone number to E.164
@@ -1147,7 +1180,8 @@ class WASenderService:
                 message_type='text',
                 content=message,
                 status='failed',
-                error_message=error_msg
+                error_message=error_msg,
+                **campaign_link
             )
         
         # Payload format - exactly as per WASender API docs
@@ -1161,11 +1195,12 @@ class WASenderService:
         logger.info(f"Sending text to {recipient}: {repr(message)[:200]}")
 
         headers = self._get_headers(session_api_key)
-        send_endpoints = [
+        # Try the remembered working route first, then the rest of the chain
+        send_endpoints = self.routes.ordered('send', session_api_key, [
             f"{self.BASE_URL}/send-message",
             f"{self.BASE_URL}/messages/send-message",
             f"{self.BASE_URL}/messages/send"
-        ]
+        ])
 
         response = None
 
@@ -1188,13 +1223,18 @@ class WASenderService:
                         message_type='text',
                         content=message,
                         status='failed',
-                        error_message='Network connection failed after multiple retries. Please check your internet connection.'
+                        error_message='Network connection failed after multiple retries. Please check your internet connection.',
+                        **campaign_link
                     )
             
             # If 200/201, break out and handle success
             if response.status_code in [200, 201]:
+                self.routes.remember('send', session_api_key, ep)
                 break
 
+            if response.status_code in [404, 405]:
+                self.routes.invalidate('send', session_api_key, ep)
+
             # If 404/405 on primary, try fallback endpoints; otherwise stop
             if response.status_code in [404, 405] and idx < len(send_endpoints) - 1:
                 continue
@@ -1297,7 +1337,8 @@ class WASenderService:
                     message_type='text',
                     content=message,
                     status='sent',
-                    sent_at=timezone.now()
+                    sent_at=timezone.now(),
+                    **campaign_link
                 )
                 # Update session counters
                 session.increment_message_count()
@@ -1323,7 +1364,8 @@ class WASenderService:
                     message_type='text',
                     content=message,
                     status='failed',
-                    error_message=error_msg
+                    error_message=error_msg,
+                    **campaign_link
                 )
                 return msg
         else:
@@ -1356,50 +1398,63 @@ class WASenderService:
                 message_type='text',
                 content=message,
                 status='failed',
-                error_message=error_text
+                error_message=error_text,
+                **campaign_link
             )
             return msg
     
-    def upload_media_file(self, session, media_url, message_type='document', filename=None, public_id=None, file_bytes=None):
+    def upload_media_file(self, session, media_url, message_type='document', filename=None, public_id=None, file_bytes=None, file_path=None):
         """
         Upload media to Wasender first, then use returned public URL.
         Endpoint: POST /api/upload (per Wasender docs)
 
+        The file is streamed as base64 JSON (media_upload.Base64JsonBody), so
+        memory stays bounded regardless of the file size; files over
+        WASENDER_MEDIA_UPLOAD_MAX_BYTES are refused.
+
         Args:
             session: WASenderSession instance
             media_url: Public URL to fetch and upload
             message_type: 'document' | 'image' | 'video' | 'audio'
             filename: Optional filename hint
+            file_bytes: Optional file content already in memory
+            file_path: Optional local file with the content (read in place, not downloaded)
 
         Returns:
             str or None: The Wasender-hosted URL to use in send-message
         """
+        source = None
         try:
-            session_api_key = self._decrypt_token(session.api_token)
+            session_api_key = self._session_api_key(session)
 
             # Skip attempts when upstream is unavailable
             if not self._is_api_available():
                 logger.error("WASender API unavailable; skipping pre-upload.")
                 return None
 
-            # 1) Try to download the bytes. If direct URL 401, use a signed Cloudinary private URL.
+            # 1) Find the bytes. If direct URL 401, use a signed Cloudinary private URL.
             clean_url = str(media_url).strip().strip('`"')
-            # If bytes were provided (fresh upload), use them directly
-            if file_bytes is None:
+            # If a local file or bytes were provided (fresh upload), use them directly
+            if file_path:
+                check_size(os.path.getsize(file_path))
+                source = file_path
+            elif file_bytes is not None:
+                check_size(len(file_bytes))
+                source = io.BytesIO(file_bytes)
+            else:
                 try:
-                    resp = requests.get(clean_url, timeout=60, allow_redirects=True)
-                    if resp.status_code < 400:
-                        file_bytes = resp.content
-                    else:
-                        logger.warning(f"Direct fetch failed ({resp.status_code}), attempting signed Cloudinary URL")
+                    source, status_code = download_media(self.http, clean_url)
+                    if source is None:
+                        logger.warning(f"Direct fetch failed ({status_code}), attempting signed Cloudinary URL")
+                except MediaTooLarge:
+                    raise
                 except Exception as e:
                     logger.warning(f"Direct fetch error: {e}, attempting signed Cloudinary URL")
 
-            if file_bytes is None:
+            if source is None:
                 # Build signed download URL from Cloudinary
                 try:
                     from urllib.parse import urlparse, unquote
-                    import os
                     import cloudinary.utils
                     if public_id:
                         public_id_no_ext = public_id
@@ -1428,10 +1483,8 @@ class WASenderService:
                         sign_url=True,
                         format=ext
                     )
-                    sresp = requests.get(signed_url, timeout=60, allow_redirects=True)
-                    if sresp.status_code < 400:
-                        file_bytes = sresp.content
-                    else:
+                    source, status_code = download_media(self.http, signed_url)
+                    if source is None:
                         # Fallback to private download URL (for private assets)
                         signed_url = cloudinary.utils.private_download_url(
                             public_id_no_ext,
@@ -1440,27 +1493,21 @@ class WASenderService:
                             attachment=False,
                             expires_at=None
                         )
-                        sresp2 = requests.get(signed_url, timeout=60, allow_redirects=True)
-                        if sresp2.status_code < 400:
-                            file_bytes = sresp2.content
-                        else:
-                            logger.error(f"Signed Cloudinary download failed ({sresp.status_code}/{sresp2.status_code}) for {signed_url}")
+                        source, status_code2 = download_media(self.http, signed_url)
+                        if source is None:
+                            logger.error(f"Signed Cloudinary download failed ({status_code}/{status_code2}) for {signed_url}")
                             return None
+                except MediaTooLarge:
+                    raise
                 except Exception as e:
                     logger.error(f"Error generating signed Cloudinary URL: {e}")
                     return None
 
-            # 2) Base64 encode
-            import base64
-            base64_str = base64.b64encode(file_bytes).decode()
-
-            # 3) Upload to Wasender using base64 field
-            payload = {
-                'type': message_type,
-                'base64': base64_str
-            }
+            # 2) Upload to Wasender using base64 field, encoded while the request is sent
+            fields = {'type': message_type}
             if filename:
-                payload['fileName'] = filename
+                fields['fileName'] = filename
+            body = Base64JsonBody(source, fields)
 
             # Some Wasender accounts expose the route under /messages/upload-media-file with PUT
             endpoint_primary = f"{self.BASE_URL}/messages/upload-media-file"
@@ -1468,46 +1515,39 @@ class WASenderService:
 
             headers = self._get_headers(session_api_key)
 
-            # Try PUT on /messages/upload-media-file first
-            try:
-                response = requests.put(
-                    endpoint_primary,
-                    headers=headers,
-                    json=payload,
-                    timeout=60
-                )
-            except Exception as e:
-                logger.warning(f"PUT {endpoint_primary} error: {e}")
-                response = requests.Response()
-                response.status_code = 0
+            # PUT on /messages/upload-media-file first, then POST and PUT on the legacy
+            # path; the route that worked last time for this key is tried first
+            upload_routes = self.routes.ordered('upload', session_api_key, [
+                ('PUT', endpoint_primary),
+                ('POST', endpoint_fallback),
+                ('PUT', endpoint_fallback),
+            ])
 
-            # If 404/405, try POST on legacy /upload-media-file
-            if response.status_code in [404, 405, 0]:
+            response = None
+            for method, ep in upload_routes:
                 try:
-                    response = requests.post(
-                        endpoint_fallback,
+                    response = self.http.request(
+                        method,
+                        ep,
                         headers=headers,
-                        json=payload,
+                        data=body,
                         timeout=60
                     )
                 except Exception as e:
-                    logger.warning(f"POST {endpoint_fallback} error: {e}")
+                    logger.warning(f"{method} {ep} error: {e}")
                     response = requests.Response()
                     response.status_code = 0
 
-            # As a final attempt, try PUT on legacy path
-            if response.status_code in [404, 405, 0]:
-                try:
-                    response = requests.put(
-                        endpoint_fallback,
-                        headers=headers,
-                        json=payload,
-                        timeout=60
-                    )
-                except Exception as e:
-                    logger.warning(f"PUT {endpoint_fallback} error: {e}")
-                    response = requests.Response()
-                    response.status_code = 0
+                if response.status_code in [200, 201]:
+                    self.routes.remember('upload', session_api_key, (method, ep))
+                    break
+                if response.status_code in [404, 405]:
+                    self.routes.invalidate('upload', session_api_key, (method, ep))
+                # If 404/405 (or no response), try the next route; otherwise stop
+                if response.status_code not in [404, 405, 0]:
+                    break
+
+            self.circuit.record(response)
 
             if response.status_code in [200, 201]:
                 data = response.json()
@@ -1529,11 +1569,17 @@ class WASenderService:
             else:
                 logger.error(f"Wasender upload failed: {response.status_code} - {_brief_response_text(response)}")
                 return None
+        except MediaTooLarge as e:
+            logger.error(f"❌ Not uploading media to Wasender: {e}")
+            return None
         except Exception as e:
             logger.error(f"Error uploading media to Wasender: {e}")
             return None
+        finally:
+            if source is not None and not isinstance(source, str):
+                source.close()
 
-    def send_media_message(self, session, recipient, media_url, message_type='image', caption='', public_id=None):
+    def send_media_message(self, session, recipient, media_url, message_type='image', caption='', public_id=None, campaign=None, resolved=None):
         """
         Send media message (image, video, document, audio)
         POST /api/send-message
@@ -1544,6 +1590,9 @@ class WASenderService:
             media_url: Public URL of media file
             message_type: 'image', 'video', 'document', 'audio'
             caption: Optional caption/text message
+            campaign: Optional WASenderCampaign the message is recorded under
+            resolved: Optional media_resolver.ResolvedMedia; its URL is sent as-is,
+                      skipping the per-recipient HEAD preflight and upload fallback
         
         Returns:
             WASenderMessage instance or None
@@ -1554,7 +1603,13 @@ class WASenderService:
             logger.warning(f"Rate limit exceeded: {error_msg}")
             return None
         
-        session_api_key = self._decrypt_token(session.api_token)
+        campaign_link = self._campaign_link(campaign)
+        
+        session_api_key = self._session_api_key(session)
+        
+        if resolved is not None:
+            media_url = resolved.url
+            message_type = resolved.message_type
 
         # Detect upstream outage early and fail fast with clear status
         if not self._is_api_available():
@@ -1568,7 +1623,8 @@ class WASenderService:
                     content=media_url,
                     caption=caption,
                     status='queued',
-                    error_message=error_text
+                    error_message=error_text,
+                    **campaign_link
                 )
             else:
                 return WASenderMessage.objects.create(
@@ -1579,7 +1635,8 @@ class WASenderService:
                     content=media_url,
                     caption=caption,
                     status='failed',
-                    error_message=error_text
+                    error_message=error_text,
+                    **campaign_link
                 )
         
         # Format phone number to E.164
@@ -1597,17 +1654,12 @@ class WASenderService:
                 content=media_url,
                 caption=caption,
                 status='failed',
-                error_message=error_msg
+                error_message=error_msg,
+                **campaign_link
             )
         
         # Sanitize URL to avoid accidental backticks/quotes from UI or logs
-        def _sanitize_url(u: str) -> str:
-            try:
-                return str(u).strip().strip('`"')
-            except Exception:
-                return str(u)
-
-        media_url = _sanitize_url(media_url)
+        media_url = clean_media_url(media_url)
 
         # WASender API format - use specific URL parameter names
         # imageUrl, videoUrl, documentUrl, audioUrl
@@ -1639,8 +1691,15 @@ class WASenderService:
         if caption:
             payload['text'] = caption
         
+        if resolved is not None:
+            # Preflight/upload already done once for the campaign (media_resolver)
+            if message_type == 'document':
+                payload['fileName'] = resolved.file_name
+                if resolved.mime_type:
+                    payload['mimeType'] = resolved.mime_type
+
         # For document messages, some APIs require additional parameters
-        if message_type == 'document' and media_url:
+        elif message_type == 'document' and media_url:
             # Extract filename for document messages (WASender expects fileName)
             from urllib.parse import urlparse
             from urllib.parse import unquote
@@ -1658,7 +1717,7 @@ class WASenderService:
 
             # Only pre-upload to Wasender if media_url is not publicly accessible
             try:
-                head_resp = requests.head(media_url, timeout=10, allow_redirects=True)
+                head_resp = self.http.head(media_url, timeout=10, allow_redirects=True)
                 if head_resp.status_code >= 400:
                     uploaded_url = self.upload_media_file(session, media_url, 'document', filename, public_id)
                     if uploaded_url:
@@ -1670,9 +1729,9 @@ class WASenderService:
         
         # Preflight: ensure URL is publicly accessible (avoid Wasender fetch 401/403)
         # Skip strict preflight for audio, as some CDNs block HEAD on audio resources
-        if message_type != 'audio':
+        if message_type != 'audio' and resolved is None:
             try:
-                head_resp = requests.head(media_url, timeout=10, allow_redirects=True)
+                head_resp = self.http.head(media_url, timeout=10, allow_redirects=True)
                 if head_resp.status_code >= 400:
                     # Attempt pre-upload to Wasender as a fallback for blocked URLs
                     from urllib.parse import urlparse
@@ -1718,17 +1777,17 @@ class WASenderService:
         
         try:
             headers = self._get_headers(session_api_key)
-            send_endpoints = [
+            send_endpoints = self.routes.ordered('send', session_api_key, [
                 f"{self.BASE_URL}/send-message",
                 f"{self.BASE_URL}/messages/send-message",
                 f"{self.BASE_URL}/messages/send"
-            ]
+            ])
 
             response = None
 
             for idx, ep in enumerate(send_endpoints):
                 try:
-                    response = requests.post(
+                    response = self.http.post(
                         ep,
                         headers=headers,
                         json=payload,
@@ -1754,7 +1813,7 @@ class WASenderService:
                     logger.warning(f"Rate limited: waiting {retry_after}s before retrying media send")
                     time.sleep(retry_after)
                     try:
-                        response = requests.post(
+                        response = self.http.post(
                             ep,
                             headers=headers,
                             json=payload,
@@ -1771,7 +1830,7 @@ class WASenderService:
                     logger.warning(f"Upstream 5xx ({response.status_code}) on media send; retrying once after 3s")
                     time.sleep(3)
                     try:
-                        response = requests.post(
+                        response = self.http.post(
                             ep,
                             headers=headers,
                             json=payload,
@@ -1784,8 +1843,12 @@ class WASenderService:
 
                 # If 200/201, break out and handle success
                 if response.status_code in [200, 201]:
+                    self.routes.remember('send', session_api_key, ep)
                     break
 
+                if response.status_code in [404, 405]:
+                    self.routes.invalidate('send', session_api_key, ep)
+
                 # If 404/405/0 on primary, try fallback endpoints; otherwise stop
                 if response.status_code in [404, 405, 0] and idx < len(send_endpoints) - 1:
                     continue
@@ -1793,6 +1856,8 @@ class WASenderService:
                     # Non-retryable or last endpoint; break and handle below
                     break
 
+            self.circuit.record(response)
+
             if response.status_code in [200, 201]:
                 data = {}
                 try:
@@ -1887,7 +1952,8 @@ class WASenderService:
                         content=media_url,
                         caption=caption,
                         status='sent',
-                        sent_at=timezone.now()
+                        sent_at=timezone.now(),
+                        **campaign_link
                     )
                     session.increment_message_count()
                     logger.info(f"Media message sent successfully: {msg.message_id} (wasender_msg_id: {wasender_internal_id})")
@@ -1913,7 +1979,8 @@ class WASenderService:
                         content=media_url,
                         caption=caption,
                         status='failed',
-                        error_message=error_msg
+                        error_message=error_msg,
+                        **campaign_link
                     )
                     return msg
             else:
@@ -1946,7 +2013,8 @@ class WASenderService:
                     content=media_url,
                     caption=caption,
                     status='failed',
-                    error_message=error_text
+                    error_message=error_text,
+                    **campaign_link
                 )
                 return msg
         
@@ -1960,7 +2028,8 @@ class WASenderService:
                 content=media_url,
                 caption=caption,
                 status='failed',
-                error_message=str(e)
+                error_message=str(e),
+                **campaign_link
             )
             return msg
     
@@ -2187,17 +2256,11 @@ class WASenderService:
                         if str(session_id).isdigit():
                             session = base_queryset.filter(session_id=session_id).first()
                         else:
-                            # sessionId from WASender is the API key hash - find by matching
+                            # sessionId from WASender is the session API key - indexed hash lookup
                             logger.info(f"Looking up session by API key hash: {session_id[:20]}...")
-                            for s in base_queryset:
-                                try:
-                                    decrypted_token = s.get_decrypted_token()
-                                    if decrypted_token and session_id in decrypted_token:
-                                        session = s
-                                        logger.info(f"Found session by API key match: {s.session_id} (User: {s.user_id})")
-                                        break
-                                except Exception:
-                                    continue
+                            session = resolve_session(session_id, base_queryset)
+                            if session:
+                                logger.info(f"Found session by API key match: {session.session_id} (User: {session.user_id})")
                     except WASenderSession.DoesNotExist:
                         logger.warning(f"Session not found: {session_id}")
                 
@@ -2426,37 +2489,27 @@ class WASenderService:
                 updated_count = 0
                 for message in messages:
                     old_status = message.status
-                    message.status = status
+                    if _status_regresses(old_status, status):
+                        # Receipts can arrive out of order; never downgrade read -> delivered
+                        logger.info(f"ℹ️ Ignoring out-of-order status | ID: {message.id} | {old_status} → {status}")
+                        continue
                     
                     # Update timestamps based on status - use actual webhook timestamp
+                    timestamps = {}
                     if status == 'sent' and not message.sent_at:
-                        message.sent_at = event_time
-                        message.save(update_fields=['status', 'sent_at'])
+                        timestamps['sent_at'] = event_time
                     elif status == 'delivered' and not message.delivered_at:
-                        message.delivered_at = event_time
-                        message.save(update_fields=['status', 'delivered_at'])
+                        timestamps['delivered_at'] = event_time
                     elif status == 'read' and not message.read_at:
-                        message.read_at = event_time
-                        message.save(update_fields=['status', 'read_at'])
-                    else:
-                        message.save(update_fields=['status'])
+                        timestamps['read_at'] = event_time
+                    
+                    # Compare-and-set write; campaign counters move by the status delta
+                    if not transition_message_status(message, status, **timestamps):
+                        logger.info(f"ℹ️ Message {message.id} changed concurrently, skipping {old_status} → {status}")
+                        continue
                     
                     updated_count += 1
                     logger.info(f"✅ Updated message status | ID: {message.id} | {old_status} → {status}")
-                    
-                    # Update campaign stats if this is a campaign message
-                    if hasattr(message, 'metadata') and message.metadata.get('campaign_id'):
-                        campaign_id = message.metadata['campaign_id']
-                        logger.info(f"📈 Updating campaign #{campaign_id} stats after status change")
-                        try:
-                            from userpanel.models import WASenderCampaign
-                            campaign = WASenderCampaign.objects.get(id=campaign_id)
-                            campaign.update_stats()
-                            logger.info(f"✅ Campaign #{campaign_id} stats updated: sent={campaign.messages_sent}, delivered={campaign.messages_delivered}, read={campaign.messages_read}, failed={campaign.messages_failed}")
-                        except WASenderCampaign.DoesNotExist:
-                            logger.warning(f"⚠️ Campaign #{campaign_id} not found for stats update")
-                        except Exception as stats_err:
-                            logger.error(f"❌ Failed to update campaign #{campaign_id} stats: {stats_err}")
                 
                 if updated_count > 1:
                     logger.warning(f"⚠️ Updated {updated_count} duplicate messages with ID: {message_id}")
@@ -2504,16 +2557,10 @@ class WASenderService:
                     session = base_queryset.filter(session_id=session_id).first()
                 
                 if not session:
-                    # sessionId is the API key hash - need to find by decrypting api_token
-                    for s in base_queryset:
-                        try:
-                            decrypted_token = self._decrypt_token(s.api_token)
-                            if decrypted_token == session_id:
-                                session = s
-                                logger.info(f"✅ Found session by API key match: {s.session_id} (User: {s.user_id})")
-                                break
-                        except:
-                            continue
+                    # sessionId is the session API key - indexed hash lookup
+                    session = resolve_session(session_id, base_queryset)
+                    if session:
+                        logger.info(f"✅ Found session by API key match: {session.session_id} (User: {session.user_id})")
                 
                 # Check if session was found
                 if not session:
@@ -2704,20 +2751,23 @@ class WASenderService:
                 updated_count = 0
                 for message in messages:
                     old_status = message.status
-                    message.status = status
+                    if _status_regresses(old_status, status):
+                        # Receipts can arrive out of order; never downgrade read -> delivered
+                        logger.info(f"ℹ️ Ignoring out-of-order receipt | ID: {message.id} | {old_status} → {status}")
+                        continue
                     
                     # Update timestamps based on status
+                    timestamps = {}
                     if status == 'delivered' and not message.delivered_at:
-                        message.delivered_at = timezone.now()
-                        message.save(update_fields=['status', 'delivered_at'])
+                        timestamps['delivered_at'] = timezone.now()
                     elif status == 'read' and not message.read_at:
-                        message.read_at = timezone.now()
-                        message.save(update_fields=['status', 'read_at'])
+                        timestamps['read_at'] = timezone.now()
                     elif status == 'played':
-                        message.read_at = timezone.now()  # Treat played as read
-                        message.save(update_fields=['status', 'read_at'])
-                    else:
-                        message.save(update_fields=['status'])
+                        timestamps['read_at'] = timezone.now()  # Treat played as read
+                    
+                    if not transition_message_status(message, status, **timestamps):
+                        logger.info(f"ℹ️ Message {message.id} changed concurrently, skipping {old_status} → {status}")
+                        continue
                     
                     updated_count += 1
                     logger.info(f"✅ Updated message receipt | ID: {message.id} | {old_status} → {status}")
@@ -2752,10 +2802,10 @@ class WASenderService:
                     messages = WASenderMessage.objects.filter(message_id=message_id)
                     for message in messages:
                         if not message.sent_at:
-                            message.sent_at = timezone.now()
-                            message.status = 'sent'
-                            message.save(update_fields=['status', 'sent_at'])
-                            logger.info(f"✅ Updated message sent status | ID: {message.id}")
+                            # A delivery receipt may already have beaten this event
+                            new_status = message.status if _status_regresses(message.status, 'sent') else 'sent'
+                            if transition_message_status(message, new_status, sent_at=timezone.now()):
+                                logger.info(f"✅ Updated message sent status | ID: {message.id}")
                 except Exception as e:
                     logger.warning(f"⚠️ Could not update message sent status: {e}")
             
@@ -2781,18 +2831,12 @@ class WASenderService:
             # Update session status to need_scan
             if session_id:
                 try:
-                    # Find session by API token
-                    sessions = WASenderSession.objects.all()
-                    for s in sessions:
-                        try:
-                            decrypted = self._decrypt_token(s.api_token)
-                            if decrypted == session_id:
-                                s.status = 'need_scan'
-                                s.save(update_fields=['status'])
-                                logger.info(f"✅ Session status updated to need_scan | {s.session_name}")
-                                break
-                        except:
-                            continue
+                    # Find session by API key hash
+                    s = resolve_session(session_id)
+                    if s:
+                        s.status = 'need_scan'
+                        s.save(update_fields=['status'])
+                        logger.info(f"✅ Session status updated to need_scan | {s.session_name}")
                 except Exception as e:
                     logger.warning(f"⚠️ Could not update session for QR code: {e}")
             
@@ -2817,7 +2861,7 @@ class WASenderService:
             dict: {'exists': True/False, 'jid': '1234567890@s.whatsapp.net', 'ok': True/False, 'error': str}
         """
         try:
-            session_api_key = self._decrypt_token(session.api_token)
+            session_api_key = self._session_api_key(session)
             # Fail fast during an outage to avoid misleading HTML 5xx content
             if not self._is_api_available():
                 return {
@@ -2827,11 +2871,11 @@ class WASenderService:
                     'status_code': 503,
                 }
             # Try multiple endpoint variants to accommodate different deployments
-            endpoints = [
+            endpoints = self.routes.ordered('check', session_api_key, [
                 f"{self.BASE_URL}/check-whatsapp",
                 f"{self.BASE_URL}/messages/check-whatsapp",
                 f"{self.BASE_URL}/whatsapp/check",
-            ]
+            ])
 
             # Prefer no-plus format for this endpoint to reduce retries
             phone_variants = [str(phone_number or '').lstrip('+')]
@@ -2839,7 +2883,7 @@ class WASenderService:
             headers = self._get_headers(session_api_key)
 
             def _do_check(ep, ph):
-                return requests.get(
+                return self.http.get(
                     ep,
                     params={'phone': ph},
                     headers=headers,
@@ -2847,6 +2891,7 @@ class WASenderService:
                 )
 
             response = None
+            response_ep = None
             last_response = None
             for ep in endpoints:
                 for ph in phone_variants:
@@ -2858,6 +2903,7 @@ class WASenderService:
                     # Skip obvious 404/405 and try next endpoint
                     if resp.status_code in (404, 405):
                         logger.info(f"check-whatsapp endpoint {ep} not found ({resp.status_code}); trying next")
+                        self.routes.invalidate('check', session_api_key, ep)
                         last_response = resp
                         continue
                     # If upstream returns HTML 5xx, try next endpoint variant before retrying
@@ -2870,6 +2916,7 @@ class WASenderService:
                         last_response = resp
                         continue
                     response = resp
+                    response_ep = ep
                     break
                 if response is not None:
                     break
@@ -2891,6 +2938,7 @@ class WASenderService:
                 time.sleep(retry_after)
                 # Retry using the first endpoint and first phone variant to minimize noise
                 response = _do_check(endpoints[0], phone_variants[0])
+                response_ep = endpoints[0]
 
             # Handle upstream server errors (HTTP 5xx): retry once after short delay
             if response.status_code in (500, 502, 503, 504):
@@ -2898,8 +2946,13 @@ class WASenderService:
                 logger.warning(f"Upstream 5xx ({response.status_code}) on check-whatsapp; retrying once after 3s")
                 time.sleep(3)
                 response = _do_check(endpoints[0], phone_variants[0])
+                response_ep = endpoints[0]
+
+            self.circuit.record(response)
 
             if response.status_code == 200:
+                if response_ep:
+                    self.routes.remember('check', session_api_key, response_ep)
                 data = response.json()
                 result = data.get('data', {})
                 # Infer existence from explicit flag or presence of jid
@@ -2933,9 +2986,9 @@ class WASenderService:
             list: List of contact dicts
         """
         try:
-            session_api_key = self._decrypt_token(session.api_token)
+            session_api_key = self._session_api_key(session)
             
-            response = requests.get(
+            response = self.http.get(
                 f"{self.BASE_URL}/contacts",
                 headers=self._get_headers(session_api_key),
                 timeout=30
@@ -2967,9 +3020,9 @@ class WASenderService:
             str: Profile picture URL or empty string
         """
         try:
-            session_api_key = self._decrypt_token(session.api_token)
+            session_api_key = self._session_api_key(session)
             
-            response = requests.get(
+            response = self.http.get(
                 f"{self.BASE_URL}/profile-picture",
                 params={'phone': phone_number},
                 headers=self._get_headers(session_api_key),
@@ -2988,3 +3041,21 @@ class WASenderService:
             logger.error(f"Error getting profile picture: {e}")
             return ''
 
+
+_shared_service = None
+_shared_service_lock = threading.Lock()
+
+
+def get_wasender_service():
+    """
+    The process-wide WASenderService.
+
+    The service keeps no per-request state (webhook context is per thread), so
+    tasks and views share one instance with its cipher and headers prebuilt.
+    """
+    global _shared_service
+    if _shared_service is None:
+        with _shared_service_lock:
+            if _shared_service is None:
+                _shared_service = WASenderService()
+    return _shared_service
@@ -0,0 +1,136 @@
+"""
+WASender HTTP Transport
+Shared, pooled keep-alive HTTP sessions for all outbound WASender calls.
+
+Each worker process (gunicorn / Django-Q) keeps one pooled ``requests.Session``
+so consecutive sends reuse the same TCP+TLS connection to the API instead of
+paying a fresh handshake per message.
+
+Settings (all optional):
+    WASENDER_HTTP_POOL_SIZE         max pooled connections per host (default 10)
+    WASENDER_HTTP_KEEPALIVE         reuse connections between requests (default True)
+    WASENDER_HTTP_CONNECT_TIMEOUT   connect timeout in seconds (default 5)
+    WASENDER_HTTP_READ_TIMEOUT      default read timeout in seconds (default 30)
+    WASENDER_HTTP_RETRIES           transport-level retries for connection errors (default 1)
+    WASENDER_HTTP_BACKOFF           backoff factor between transport retries (default 0.5)
+"""
+
+import logging
+import os
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default, cast):
+    """Read a transport setting, falling back to the default on bad values"""
+    try:
+        return cast(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _flag(value):
+    """Parse a boolean setting; strings such as "False" or "0" (from env) are false"""
+    if isinstance(value, str):
+        return value.strip().lower() in {'1', 'true', 'yes'}
+    return bool(value)
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session with a pooled adapter and default (connect, read) timeouts.
+
+    Callers keep passing ``timeout=<seconds>`` as before; a scalar timeout is
+    treated as the read timeout and paired with the configured connect timeout.
+    """
+
+    def __init__(self, pool_size, keepalive, connect_timeout, read_timeout, retries, backoff):
+        super().__init__()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # Only retry connection-level failures here. Status-based retries (429/5xx)
+        # stay in WASenderService so non-idempotent POSTs are never replayed twice.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            backoff_factor=backoff,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+        if not keepalive:
+            self.headers['Connection'] = 'close'
+
+    def request(self, method, url, **kwargs):
+        timeout = kwargs.get('timeout')
+        if timeout is None:
+            kwargs['timeout'] = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            kwargs['timeout'] = (min(self.connect_timeout, timeout), timeout)
+        return super().request(method, url, **kwargs)
+
+
+_lock = threading.Lock()
+_sessions = {}
+_owner_pid = None
+
+
+def _build_session():
+    return PooledSession(
+        pool_size=_setting('WASENDER_HTTP_POOL_SIZE', 10, int),
+        keepalive=_setting('WASENDER_HTTP_KEEPALIVE', True, _flag),
+        connect_timeout=_setting('WASENDER_HTTP_CONNECT_TIMEOUT', 5, float),
+        read_timeout=_setting('WASENDER_HTTP_READ_TIMEOUT', 30, float),
+        retries=_setting('WASENDER_HTTP_RETRIES', 1, int),
+        backoff=_setting('WASENDER_HTTP_BACKOFF', 0.5, float),
+    )
+
+
+def get_http_session(key='default'):
+    """
+    Return the pooled HTTP session for this worker process.
+
+    Args:
+        key: Pool partition key. Use the default shared pool unless a caller
+             needs an isolated pool (e.g. per session API key).
+
+    Returns:
+        PooledSession instance, created lazily and reused for the process lifetime
+    """
+    global _owner_pid
+
+    pid = os.getpid()
+    with _lock:
+        # Connections must not be shared across a fork (Django-Q spawns workers)
+        if _owner_pid != pid:
+            _sessions.clear()
+            _owner_pid = pid
+
+        http = _sessions.get(key)
+        if http is None:
+            http = _build_session()
+            _sessions[key] = http
+            logger.debug(f"Created pooled WASender HTTP session '{key}' in process {pid}")
+        return http
+
+
+def close_http_sessions():
+    """Close all pooled sessions in this process (e.g. on settings change or shutdown)"""
+    with _lock:
+        for http in _sessions.values():
+            try:
+                http.close()
+            except Exception:
+                pass
+        _sessions.clear()
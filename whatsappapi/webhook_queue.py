@@ -0,0 +1,171 @@
+"""
+WASender Webhook Queue
+Durable ingestion queue between the webhook endpoint and event processing.
+
+wasender_webhook only validates the request and inserts the raw event into the
+webhook_events table, so WASender gets its 200 after a single INSERT even
+during receipt storms. The process_webhook_events consumer pool claims pending
+events in id order with SELECT ... FOR UPDATE SKIP LOCKED and runs them
+through the shared WASenderService.process_webhook.
+
+Events left 'processing' by a crashed consumer are reclaimed after the claim
+timeout; events whose handler raises are retried up to the attempt limit.
+
+Settings (all optional):
+    WASENDER_WEBHOOK_QUEUE              queue webhooks instead of processing inline (default False;
+                                        only enable once process_webhook_events is running)
+    WASENDER_WEBHOOK_BATCH_SIZE         events claimed per batch (default 200)
+    WASENDER_WEBHOOK_MAX_ATTEMPTS       tries before an event is marked failed (default 3)
+    WASENDER_WEBHOOK_CLAIM_TIMEOUT      seconds before a stuck 'processing' event is reclaimed (default 300)
+    WASENDER_WEBHOOK_RETENTION_HOURS    hours processed events are kept (default 24)
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from whatsappapi.models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    try:
+        return type(default)(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def webhook_queue_enabled():
+    return bool(getattr(settings, 'WASENDER_WEBHOOK_QUEUE', False))
+
+
+def enqueue_webhook(user_id, payload):
+    """Store a raw webhook event for the consumer pool (one INSERT)"""
+    return WebhookEvent.objects.create(
+        user_id=user_id,
+        event_type=str(payload.get('event', ''))[:64],
+        payload=payload,
+    )
+
+
+def claim_batch(limit=None):
+    """
+    Claim up to limit pending events for this consumer.
+
+    Returns:
+        list: WebhookEvent rows now marked 'processing', oldest first
+    """
+    limit = limit or _setting('WASENDER_WEBHOOK_BATCH_SIZE', 200)
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        WebhookEvent.objects.filter(id__in=ids).update(
+            status='processing',
+            claimed_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+    return list(WebhookEvent.objects.filter(id__in=ids).order_by('id'))
+
+
+def process_batch(events):
+    """
+    Run claimed events through the webhook handlers and record their outcome.
+
+    Returns:
+        int: number of events finished (done or permanently failed)
+    """
+    from whatsappapi.wasender_service import get_wasender_service
+
+    if not events:
+        return 0
+
+    service = get_wasender_service()
+    succeeded, rejected, retry, failed = [], [], [], []
+    max_attempts = _setting('WASENDER_WEBHOOK_MAX_ATTEMPTS', 3)
+
+    for event in events:
+        try:
+            result = service.process_webhook(event.payload, user_id=event.user_id)
+            (succeeded if result else rejected).append(event.id)
+        except Exception as e:
+            logger.error(f"❌ Webhook event {event.id} ({event.event_type}) raised: {e}", exc_info=True)
+            (retry if event.attempts < max_attempts else failed).append((event.id, str(e)))
+
+    now = timezone.now()
+    if succeeded:
+        WebhookEvent.objects.filter(id__in=succeeded).update(status='done', processed=True, processed_at=now)
+    if rejected:
+        WebhookEvent.objects.filter(id__in=rejected).update(status='done', processed=False, processed_at=now)
+    for event_id, error in retry:
+        WebhookEvent.objects.filter(id=event_id).update(status='pending', error=error[:2000])
+    for event_id, error in failed:
+        WebhookEvent.objects.filter(id=event_id).update(status='failed', error=error[:2000], processed_at=now)
+
+    logger.info(
+        f"📥 Webhook batch: {len(succeeded)} processed, {len(rejected)} unmatched, "
+        f"{len(retry)} retrying, {len(failed)} failed"
+    )
+    return len(succeeded) + len(rejected) + len(failed)
+
+
+def requeue_stale():
+    """
+    Return events stuck in 'processing' (consumer died mid-batch) to the queue.
+
+    Events that already used their last attempt are marked failed instead, so a
+    payload that kills its consumer is not retried forever.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=_setting('WASENDER_WEBHOOK_CLAIM_TIMEOUT', 300))
+    stale = WebhookEvent.objects.filter(status='processing', claimed_at__lt=cutoff)
+    max_attempts = _setting('WASENDER_WEBHOOK_MAX_ATTEMPTS', 3)
+
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status='failed',
+        error='Consumer stopped while processing (claim timed out)',
+        processed_at=now,
+    )
+    if failed:
+        logger.error(f"❌ Marked {failed} stale webhook events failed after {max_attempts} attempts")
+    count = stale.filter(attempts__lt=max_attempts).update(status='pending')
+    if count:
+        logger.warning(f"⚠️ Requeued {count} stale webhook events")
+    return count
+
+
+def purge_processed():
+    """Delete finished events past the retention window"""
+    cutoff = timezone.now() - timedelta(hours=_setting('WASENDER_WEBHOOK_RETENTION_HOURS', 24))
+    count, _ = WebhookEvent.objects.filter(status__in=['done', 'failed'], processed_at__lt=cutoff).delete()
+    return count
+
+
+def drain_webhook_events(max_batches=None):
+    """
+    Process pending events until the queue is empty (or max_batches is reached).
+
+    Also usable as a Django-Q scheduled task.
+
+    Returns:
+        int: number of events finished
+    """
+    finished = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        events = claim_batch()
+        if not events:
+            break
+        finished += process_batch(events)
+        batches += 1
+    return finished